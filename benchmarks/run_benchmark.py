@@ -0,0 +1,229 @@
+"""בדיקת ביצועים של צינור העיבוד, בלי בוט אמיתי
+
+מריץ את process_video_message של VideoService על קבצי וידאו סינתטיים
+(testsrc של ffmpeg) מול לקוח טלגרם מדומה עם רוחב פס וזמן תגובה שנקבעים
+בפרמטרים, ומדווח משימות לשעה, משך כל שלב (מצירי הזמן של המשימות), ושיא
+הדיסק והזיכרון. אפשר לשמור את התוצאה ולהשוות אליה ריצות הבאות:
+
+    python benchmarks/run_benchmark.py --jobs 20 --output baseline.json
+    python benchmarks/run_benchmark.py --jobs 20 --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import resource
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# מכולה, קודק וידאו וקודק שמע לכל סוג קלט
+FORMATS = {
+    'mp4': ('mp4', 'libx264', 'aac'),      # כבר MP4 - בלי המרה
+    'mkv': ('mkv', 'libx264', 'aac'),      # העתקת זרמים
+    'avi': ('avi', 'mpeg4', 'ac3'),        # קידוד מלא
+    'webm': ('webm', 'libvpx', 'libvorbis'),
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="בדיקת ביצועים של צינור העיבוד מול לקוח מדומה")
+    parser.add_argument('--jobs', type=int, default=12, help="מספר המשימות")
+    parser.add_argument('--users', type=int, default=4, help="מספר המשתמשים ששולחים את המשימות")
+    parser.add_argument('--formats', default=','.join(FORMATS), help="סוגי הקלט, מופרדים בפסיקים")
+    parser.add_argument('--duration', type=float, default=20, help="אורך כל סרטון, בשניות")
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--download-mbps', type=float, default=80, help="רוחב פס להורדה (0 = ללא הגבלה)")
+    parser.add_argument('--upload-mbps', type=float, default=40, help="רוחב פס להעלאה (0 = ללא הגבלה)")
+    parser.add_argument('--latency', type=float, default=0.05, help="זמן תגובה לכל בקשה, בשניות")
+    parser.add_argument('--workdir', help="תיקיית עבודה (ברירת מחדל: תיקייה זמנית)")
+    parser.add_argument('--keep', action='store_true', help="לא למחוק את תיקיית העבודה בסוף")
+    parser.add_argument('--output', help="שמירת התוצאות כ-JSON")
+    parser.add_argument('--baseline', help="קובץ JSON של ריצה קודמת להשוואה")
+    return parser.parse_args()
+
+def configure_environment(workdir: str) -> None:
+    """משתני הסביבה של הבוט - חייבים להיקבע לפני טעינת config.settings
+
+    הנתיבים תמיד מופנים לתיקיית העבודה, כדי שהריצה לא תיגע ביומן ובמאגר
+    ה-file_id האמיתיים. שאר ההגדרות רק מקבלות ברירת מחדל, ואפשר לשנות אותן
+    מהסביבה (למשל MAX_CONCURRENT_CONVERSIONS) כדי להשוות תצורות.
+    """
+    data = os.path.join(workdir, 'data')
+    os.environ.update({
+        'DOWNLOAD_PATH': os.path.join(workdir, 'downloads'),
+        'JOBS_DB': os.path.join(data, 'jobs.db'),
+        'FILE_IDS_DB': os.path.join(data, 'file_ids.db'),
+        'FILE_IDS_FILE': os.path.join(data, 'file_ids.yaml'),
+        'TRACE_FILE': os.path.join(data, 'job_traces.jsonl'),
+        'SWEEP_ORPHANS_ON_START': '0',
+        'METRICS_PORT': '0',
+    })
+    for name, value in {
+        'API_ID': '1', 'API_HASH': 'benchmark', 'BOT_TOKEN': 'benchmark', 'TARGET_GROUP_ID': '-100',
+        # ההעברה המקבילית פותחת חיבורי MTProto ישירות, ואין לה תחליף מדומה
+        'PARALLEL_CONNECTIONS': '1',
+    }.items():
+        os.environ.setdefault(name, value)
+
+def generate_inputs(directory: str, formats: list, duration: float, resolution: str) -> list:
+    """יצירת סרטון testsrc לכל סוג קלט (נשמרים בין ריצות באותה תיקייה)"""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name in formats:
+        container, video_codec, audio_codec = FORMATS[name]
+        path = os.path.join(directory, f"testsrc_{name}_{resolution}_{duration:g}s.{container}")
+        if not os.path.exists(path):
+            subprocess.run([
+                'ffmpeg', '-y', '-loglevel', 'error',
+                '-f', 'lavfi', '-i', f"testsrc=size={resolution}:rate=30:duration={duration}",
+                '-f', 'lavfi', '-i', f"sine=frequency=440:duration={duration}",
+                '-c:v', video_codec, '-c:a', audio_codec, '-shortest', path
+            ], check=True)
+        paths.append(path)
+    return paths
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # נמחק בזמן המדידה
+    return total
+
+def ffmpeg_peak_rss() -> int:
+    """שיא הזיכרון (VmHWM, בבתים) של תהליכי ffmpeg שהבוט מריץ כרגע
+
+    נדגם מ-/proc (לינוקס בלבד), ולכן לא כולל את ffmpeg שיצר את קבצי הקלט
+    לפני הריצה - בניגוד ל-RUSAGE_CHILDREN, שזוכר כל ילד שהסתיים.
+    """
+    peak = 0
+    parent = os.getpid()
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/status', 'r') as file:
+                status = dict(line.split(':', 1) for line in file if ':' in line)
+        except OSError:
+            continue  # התהליך הסתיים בזמן הקריאה
+        if status.get('Name', '').strip() != 'ffmpeg' or int(status.get('PPid', 0)) != parent:
+            continue
+        peak = max(peak, int(status.get('VmHWM', '0 kB').split()[0]) * 1024)
+    return peak
+
+async def sample_peaks(path: str, peaks: dict, interval: float = 0.25) -> None:
+    while True:
+        peaks['disk'] = max(peaks['disk'], directory_size(path))
+        peaks['ffmpeg_rss'] = max(peaks['ffmpeg_rss'], ffmpeg_peak_rss())
+        await asyncio.sleep(interval)
+
+async def run(args, inputs: list) -> dict:
+    from config.settings import DOWNLOAD_PATH
+    from services.video_service import VideoService
+    from benchmarks.stub_client import Link, StubClient
+
+    mbps = 1024 * 1024 / 8
+    client = StubClient(
+        download=Link(args.download_mbps * mbps, args.latency),
+        upload=Link(args.upload_mbps * mbps, args.latency),
+        api=Link(0, args.latency),
+    )
+    service = VideoService(client, DOWNLOAD_PATH)
+    await service.start()
+
+    peaks = {'disk': 0, 'ffmpeg_rss': 0}
+    sampler = asyncio.create_task(sample_peaks(DOWNLOAD_PATH, peaks))
+    started = time.monotonic()
+    for index in range(args.jobs):
+        user_id = 1000 + index % args.users
+        # צ'אט פרטי לכל משתמש, כמו בבוט האמיתי
+        message = client.add_video(user_id, user_id, inputs[index % len(inputs)])
+        await service.process_video_message(message)
+
+    # משימה יוצאת מהיומן רק כשהיא יוצאת מהצינור (בהצלחה או בכישלון)
+    while len(service.job_store):
+        await asyncio.sleep(0.2)
+    elapsed = time.monotonic() - started
+    sampler.cancel()
+
+    summary = service.traces.summary()
+    to_mb = 1024 * 1024
+    return {
+        'jobs': args.jobs,
+        'elapsed': round(elapsed, 2),
+        'jobs_per_hour': round(args.jobs * 3600 / elapsed, 1),
+        'stages': summary,
+        'peak_disk_mb': round(peaks['disk'] / to_mb, 1),
+        # ru_maxrss בקילובייטים בלינוקס
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_ffmpeg_rss_mb': round(peaks['ffmpeg_rss'] / to_mb, 1),
+        'downloaded_mb': round(client.download.bytes / to_mb, 1),
+        'uploaded_mb': round(client.upload.bytes / to_mb, 1),
+        'telegram_calls': dict(client.calls),
+        'flood_waits': service.rate_limiter.flood_waits,
+        'rate_limiter_wait': round(service.rate_limiter.total_wait, 2),
+        'config': {
+            'formats': args.formats, 'users': args.users, 'duration': args.duration,
+            'resolution': args.resolution, 'download_mbps': args.download_mbps,
+            'upload_mbps': args.upload_mbps, 'latency': args.latency,
+        },
+    }
+
+def report(result: dict, baseline: dict = None) -> None:
+    def compare(key, value, lower_is_better=True):
+        if not baseline or key not in baseline or not baseline[key]:
+            return ""
+        change = (value - baseline[key]) / baseline[key] * 100
+        better = change < 0 if lower_is_better else change > 0
+        return f"  ({change:+.1f}% {'✓' if better else '✗'})"
+
+    print(f"משימות: {result['jobs']} ב-{result['elapsed']}s")
+    print(f"משימות לשעה: {result['jobs_per_hour']}{compare('jobs_per_hour', result['jobs_per_hour'], False)}")
+    print(f"שיא דיסק: {result['peak_disk_mb']}MB{compare('peak_disk_mb', result['peak_disk_mb'])}")
+    print(f"שיא זיכרון (בוט): {result['peak_rss_mb']}MB{compare('peak_rss_mb', result['peak_rss_mb'])}")
+    print(f"שיא זיכרון (ffmpeg): {result['peak_ffmpeg_rss_mb']}MB"
+          f"{compare('peak_ffmpeg_rss_mb', result['peak_ffmpeg_rss_mb'])}")
+    print(f"המתנה במגביל הקצב: {result['rate_limiter_wait']}s, FloodWait: {result['flood_waits']}")
+    print(f"קריאות לטלגרם: {result['telegram_calls']}")
+    print("שלבים (p50 / p95 / p99, בשניות):")
+    base_stages = (baseline or {}).get('stages', {})
+    for stage, stats in result['stages'].items():
+        line = f"  {stage:<13} {stats['p50']:8.2f} {stats['p95']:8.2f} {stats['p99']:8.2f}  ({stats['count']})"
+        if stage in base_stages and base_stages[stage]['p50']:
+            change = (stats['p50'] - base_stages[stage]['p50']) / base_stages[stage]['p50'] * 100
+            line += f"  p50 {change:+.1f}%"
+        print(line)
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='video_bot_bench_')
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        sys.exit(f"סוגי קלט לא מוכרים: {', '.join(sorted(unknown))}")
+
+    configure_environment(workdir)
+    try:
+        inputs = generate_inputs(os.path.join(workdir, 'inputs'), formats, args.duration, args.resolution)
+        result = asyncio.run(run(args, inputs))
+        baseline = None
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as file:
+                baseline = json.load(file)
+        report(result, baseline)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                json.dump(result, file, ensure_ascii=False, indent=2)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
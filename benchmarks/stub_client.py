@@ -0,0 +1,178 @@
+import os
+import asyncio
+import inspect
+from itertools import count
+
+class Link:
+    """קו רשת מדומה: רוחב פס משותף לכל ההעברות בכיוון אחד, וזמן תגובה לכל בקשה
+
+    כל חלק שעובר בקו תופס אותו לפי הגודל שלו, כך שהעברות מקבילות מתחלקות
+    ברוחב הפס במקום שכל אחת תקבל את כולו.
+    """
+
+    def __init__(self, bandwidth: float, latency: float):
+        """
+        Args:
+            bandwidth: בתים לשנייה (0 = ללא הגבלה)
+            latency: שניות לכל בקשה (הלוך ושוב)
+        """
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self._free_at = 0.0
+        self.bytes = 0
+
+    async def request(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def transfer(self, size: int) -> None:
+        """בקשה אחת שמעבירה size בתים"""
+        self.bytes += size
+        await self.request()
+        if not self.bandwidth:
+            return
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        self._free_at = max(now, self._free_at) + size / self.bandwidth
+        await asyncio.sleep(self._free_at - now)
+
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        await result
+
+class StubAttributeFilename:
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+class StubDocument:
+    def __init__(self, document_id: int, size: int, path: str = None, file_name: str = None):
+        self.id = document_id
+        self.size = size
+        self.path = path  # הקובץ המקומי שמדמה את התוכן בשרת
+        self.attributes = [StubAttributeFilename(file_name)] if file_name else []
+
+class StubMedia:
+    def __init__(self, document: StubDocument):
+        self.document = document
+
+class StubFile:
+    def __init__(self, document: StubDocument):
+        self.id = f"stub-file-{document.id}"
+        self.size = document.size
+        self.name = document.attributes[0].file_name if document.attributes else None
+
+class StubUploadedFile:
+    """מה ש-upload_file מחזיר: קובץ שהועלה וממתין ל-send_file"""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.name = os.path.basename(path)
+
+class StubMessage:
+    """הודעה מדומה עם הפעולות ש-VideoService משתמש בהן"""
+
+    def __init__(self, client, chat_id: int, message_id: int, sender_id: int, text: str = "",
+                 document: StubDocument = None):
+        self.client = client
+        self.chat_id = chat_id
+        self.id = message_id
+        self.sender_id = sender_id
+        self.text = text
+        self.document = document
+        self.media = StubMedia(document) if document else None
+        self.file = StubFile(document) if document else None
+
+    async def reply(self, text, **kwargs):
+        return await self.client.send_message(self.chat_id, text, **kwargs)
+
+    async def edit(self, text, **kwargs):
+        self.client.calls['edit'] += 1
+        await self.client.api.request()
+        self.text = text
+        return self
+
+    async def delete(self):
+        self.client.calls['delete'] += 1
+        await self.client.api.request()
+
+    async def download_media(self, file: str, progress_callback=None):
+        with open(file, 'wb') as output:
+            async for chunk in self.client.iter_download(self.media):
+                output.write(chunk)
+                if progress_callback:
+                    await _maybe_await(progress_callback(output.tell(), self.document.size))
+        return file
+
+class StubClient:
+    """תחליף מקומי ללקוח Telethon, עם רשת מדומה
+
+    ההורדות נקראות מקבצים מקומיים, וההעלאות נקראות מהדיסק ונזרקות. כל
+    קריאה לטלגרם עוברת בקו המדומה: api לבקשות רגילות, download ו-upload
+    להעברת קבצים. TransferService צריך לעבוד עם PARALLEL_CONNECTIONS=1, כי
+    ההעברה המקבילית פותחת חיבורי MTProto ישירות.
+    """
+
+    def __init__(self, download: Link, upload: Link, api: Link, part_size: int = 512 * 1024):
+        self.download = download
+        self.upload = upload
+        self.api = api
+        self.part_size = part_size
+        self._messages = {}
+        self._ids = count(1)
+        self.calls = {'send': 0, 'edit': 0, 'delete': 0, 'get_messages': 0}
+
+    def add_video(self, chat_id: int, sender_id: int, path: str) -> StubMessage:
+        """הודעה נכנסת עם קובץ וידאו (התוכן נקרא מ-path)"""
+        document = StubDocument(next(self._ids), os.path.getsize(path), path, os.path.basename(path))
+        message = StubMessage(self, chat_id, next(self._ids), sender_id, document=document)
+        self._messages[(chat_id, message.id)] = message
+        return message
+
+    async def get_messages(self, chat_id, ids=None):
+        self.calls['get_messages'] += 1
+        await self.api.request()
+        return self._messages.get((chat_id, ids))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls['send'] += 1
+        await self.api.request()
+        return StubMessage(self, chat_id, next(self._ids), 0, text)
+
+    async def iter_download(self, media, offset: int = 0, request_size: int = None, file_size: int = None):
+        request_size = request_size or self.part_size
+        with open(media.document.path, 'rb') as source:
+            source.seek(offset)
+            while True:
+                chunk = source.read(request_size)
+                if not chunk:
+                    return
+                await self.download.transfer(len(chunk))
+                yield chunk
+
+    async def upload_file(self, file_path: str, progress_callback=None):
+        size = os.path.getsize(file_path)
+        sent = 0
+        with open(file_path, 'rb') as source:
+            while True:
+                chunk = source.read(self.part_size)
+                if not chunk:
+                    break
+                await self.upload.transfer(len(chunk))
+                sent += len(chunk)
+                if progress_callback:
+                    await _maybe_await(progress_callback(sent, size))
+        return StubUploadedFile(file_path, size)
+
+    async def send_file(self, chat_id, file, caption=None, **kwargs):
+        """שליחת קובץ: קובץ שהועלה יוצר מסמך חדש, ומדיה קיימת נשלחת כמו שהיא"""
+        self.calls['send'] += 1
+        await self.api.request()
+        if isinstance(file, StubUploadedFile):
+            document = StubDocument(next(self._ids), file.size, file_name=file.name)
+        elif isinstance(file, StubMedia):
+            document = file.document
+        else:
+            # file_id מהמאגר - מסמך שכבר קיים בטלגרם
+            document = StubDocument(next(self._ids), 0)
+        return StubMessage(self, chat_id, next(self._ids), 0, caption or "", document=document)
@@ -21,8 +21,12 @@ TEMP_PATH = os.path.join(BASE_DIR, "temp")
 TARGET_GROUP_ID = int(os.getenv("TARGET_GROUP_ID"))
 
 # הגדרות קבצים
-FILE_IDS_FILE = os.path.join(BASE_DIR, "data", "file_ids.yaml")
+FILE_IDS_FILE = os.getenv("FILE_IDS_FILE", os.path.join(BASE_DIR, "data", "file_ids.yaml"))  # פורמט ישן, מוסב אוטומטית למאגר
+FILE_IDS_DB = os.getenv("FILE_IDS_DB", os.path.join(BASE_DIR, "data", "file_ids.db"))
+DEDUP_BY_NAME = os.getenv("DEDUP_BY_NAME", "1") == "1"  # חיפוש משני לפי שם קובץ (רק לקבצים עם שם אמיתי)
+CONTENT_HASH_DEDUP = os.getenv("CONTENT_HASH_DEDUP", "0") == "1"  # גיבוב תוכן אחרי ההורדה, לקבצים ממקור אחר
 USERS_FILE = os.path.join(BASE_DIR, "data", "allowed_users.yaml")
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(BASE_DIR, "data", "jobs.db"))  # יומן המשימות, להמשך עיבוד אחרי הפעלה מחדש
 
 # הגדרות קבצים
 AUTH_CONFIG_FILE = os.path.join(BASE_DIR, 'config', 'authorized_users.yaml')
@@ -39,6 +43,68 @@ VIDEO_FORMATS = {
     ]
 }
 
+# הגדרות עיבוד מקבילי (מספר העובדים בכל שלב בצינור)
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "2"))
+MAX_CONCURRENT_CONVERSIONS = int(os.getenv("MAX_CONCURRENT_CONVERSIONS", str(max(1, (os.cpu_count() or 2) // 2))))
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "2"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))  # גודל תור המסירה בין שלבים
+
+# בקרת כניסה לפי מקום פנוי בדיסק
+DISK_MIN_FREE = int(os.getenv("DISK_MIN_FREE", str(1024 ** 3)))  # בתים שנשארים תמיד פנויים
+DISK_OUTPUT_RATIO = float(os.getenv("DISK_OUTPUT_RATIO", "1.0"))  # גודל ה-MP4 המשוער ביחס למקור
+DISK_RECHECK_INTERVAL = float(os.getenv("DISK_RECHECK_INTERVAL", "5"))  # שניות בין בדיקות כשמשימה ממתינה למקום
+
+# ניקוי קבצים זמניים
+JANITOR_MAX_RETRIES = int(os.getenv("JANITOR_MAX_RETRIES", "5"))  # ניסיונות חוזרים למחיקת קובץ תפוס
+JANITOR_RETRY_DELAY = float(os.getenv("JANITOR_RETRY_DELAY", "2"))  # המתנה לפני הניסיון הראשון (מוכפלת בכל ניסיון)
+SWEEP_ORPHANS_ON_START = os.getenv("SWEEP_ORPHANS_ON_START", "1") == "1"  # ניקוי שאריות בהפעלה
+
+# תזמון הוגן בתור (WFQ לפי גודל, עם נתיב עדיפות לקבצים קטנים)
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "1"))  # כפתורי הביטול הם לפי משתמש, ולכן 1 כברירת מחדל
+SHORT_JOB_MAX_SIZE = int(os.getenv("SHORT_JOB_MAX_SIZE", str(50 * 1024 * 1024)))  # עד הגודל הזה - נתיב העדיפות
+SHORT_LANE_BURST = int(os.getenv("SHORT_LANE_BURST", "3"))  # קבצים קטנים ברצף לפני קובץ רגיל אחד
+
+# תזמון ffmpeg לפי ליבות המעבד
+FFMPEG_MAX_ENCODES = int(os.getenv("FFMPEG_MAX_ENCODES", "0"))  # קידודי וידאו מקבילים (0 = ליבות / 4)
+FFMPEG_NICENESS = int(os.getenv("FFMPEG_NICENESS", "10"))  # עדיפות נמוכה לתהליכי ffmpeg (לינוקס בלבד)
+
+# פרופילי קידוד x264 - נבחר הראשון שהקובץ עומד בכל המגבלות שלו
+# max_duration בשניות, max_height בפיקסלים (הצלע הקצרה), max_size בבתים
+ENCODING_PROFILES = [
+    {'name': 'short', 'max_duration': 10 * 60, 'max_height': 1080, 'preset': 'medium', 'crf': 23},
+    {'name': 'standard', 'max_duration': 60 * 60, 'max_height': 1080, 'preset': 'veryfast', 'crf': 23},
+    {'name': 'long', 'max_duration': 3 * 60 * 60, 'max_size': 4 * 1024 ** 3, 'preset': 'superfast', 'crf': 24},
+    {'name': 'huge', 'preset': 'ultrafast', 'crf': 25},
+]
+
+# העברות מקביליות (כמה חיבורי MTProto לכל קובץ)
+PARALLEL_CONNECTIONS = int(os.getenv("PARALLEL_CONNECTIONS", "4"))
+DOWNLOAD_PART_SIZE = int(os.getenv("DOWNLOAD_PART_SIZE", str(1024 * 1024)))  # חזקה של 2 בין 4KB ל-1MB
+PARALLEL_TRANSFER_MIN_SIZE = int(os.getenv("PARALLEL_TRANSFER_MIN_SIZE", str(10 * 1024 * 1024)))
+
+# המשך הורדה אחרי שגיאת רשת (מהחלקים שכבר נכתבו)
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "5"))
+DOWNLOAD_RETRY_DELAY = float(os.getenv("DOWNLOAD_RETRY_DELAY", "2"))  # המתנה לפני הניסיון הראשון, מוכפלת בכל ניסיון
+DOWNLOAD_RETRY_MAX_DELAY = float(os.getenv("DOWNLOAD_RETRY_MAX_DELAY", "60"))
+
+# המרה תוך כדי הורדה (ffmpeg מקבל את החלקים ישירות מההורדה)
+STREAMING_TRANSCODE = os.getenv("STREAMING_TRANSCODE", "0") == "1"
+STREAM_PROBE_BYTES = int(os.getenv("STREAM_PROBE_BYTES", str(4 * 1024 * 1024)))  # כמה בתים לבדוק לפני הפעלת ffmpeg
+
+# עדכוני התקדמות (עריכת הודעות הסטטוס)
+PROGRESS_EDITS_PER_MINUTE = int(os.getenv("PROGRESS_EDITS_PER_MINUTE", "30"))  # תקציב משותף לכל המשימות
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))  # שניות בין עריכות של אותה הודעה
+
+# מדדים בפורמט Prometheus (נקודת קצה /metrics; 0 = כבוי)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # ברירת המחדל - גישה מקומית בלבד
+
+# צירי זמן של משימות (קובץ JSONL מתחלף) וסיכום /stats
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(BASE_DIR, "data", "job_traces.jsonl"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))  # גודל הקובץ לפני החלפה
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))  # כמה קבצים ישנים לשמור
+STATS_WINDOW = float(os.getenv("STATS_WINDOW", str(24 * 60 * 60)))  # חלון הזמן של /stats, בשניות
+
 # מזהה מנהל הבוט
 ADMIN_USER_ID = 1681880347  # המרה למספר שלם עבור Telethon
 
@@ -3,9 +3,13 @@ import logging
 from telethon import TelegramClient, events
 from telethon.tl.types import DocumentAttributeVideo, Message
 from telethon.tl.custom import Button
-from config.settings import API_ID, API_HASH, BOT_TOKEN, DOWNLOAD_PATH, TARGET_GROUP_ID, ADMIN_USER_ID
+from config.settings import (
+    API_ID, API_HASH, BOT_TOKEN, DOWNLOAD_PATH, TARGET_GROUP_ID, ADMIN_USER_ID, METRICS_HOST, METRICS_PORT,
+    STATS_WINDOW
+)
 from services.video_service import VideoService
 from services.user_service import UserService
+from utils.helpers import format_duration
 
 # הגדרת הלוגר
 logging.basicConfig(
@@ -106,6 +110,55 @@ async def remove_user(event):
         logging.error(f"שגיאה בהסרת משתמש: {e}")
         await message.reply("אירעה שגיאה בהסרת המשתמש.")
 
+@client.on(events.NewMessage(pattern='/status', func=lambda e: e.is_private))
+async def pipeline_status(event):
+    """הצגת תפוסת התור ושלבי העיבוד"""
+    if event.sender_id != ADMIN_USER_ID:
+        await event.reply("אין לך הרשאה לצפות בסטטוס הבוט. 🚫")
+        return
+
+    status = video_service.get_pipeline_status()
+    lines = [
+        f"📋 ממתינים בתור: {status['queued']}",
+        f"💾 דיסק: פנוי {status['disk']['free'] / 1024 ** 3:.1f}GB, "
+        f"שמור למשימות {status['disk']['reserved'] / 1024 ** 3:.1f}GB ({status['disk']['jobs']} משימות)",
+    ]
+    for stage in status['stages']:
+        lines.append(
+            f"• {stage['stage']}: פעילים {stage['active']}/{stage['workers']}, "
+            f"ממתינים {stage['waiting']}/{stage['capacity']}, "
+            f"חסומים {stage['blocked']}, הושלמו {stage['completed']}"
+        )
+    for message_id, progress in status['conversions'].items():
+        percent = f"{progress['percent']:.0f}%" if progress['percent'] is not None else "?"
+        lines.append(
+            f"🔄 המרה {message_id}: {percent}, {progress['fps']:.0f} fps, x{progress['speed']:.1f}"
+        )
+    await event.reply("\n".join(lines))
+
+@client.on(events.NewMessage(pattern='/stats', func=lambda e: e.is_private))
+async def pipeline_stats(event):
+    """אחוזוני משך לכל שלב של המשימות בחלון הזמן האחרון"""
+    if event.sender_id != ADMIN_USER_ID:
+        await event.reply("אין לך הרשאה לצפות בסטטיסטיקות הבוט. 🚫")
+        return
+
+    summary = video_service.traces.summary()
+    if not summary:
+        await event.reply("אין עדיין נתונים על משימות בחלון הזמן הנוכחי.")
+        return
+
+    def seconds(value):
+        return f"{value:.1f}s" if value < 60 else format_duration(value)
+
+    lines = [f"⏱ משך השלבים ב-{format_duration(STATS_WINDOW)} האחרונות (p50 / p95 / p99):"]
+    for stage, stats in summary.items():
+        lines.append(
+            f"• {stage}: {seconds(stats['p50'])} / {seconds(stats['p95'])} / {seconds(stats['p99'])} "
+            f"({stats['count']} משימות)"
+        )
+    await event.reply("\n".join(lines))
+
 @client.on(events.CallbackQuery(pattern=r'^cancel_download_'))
 async def handle_cancel_download(event):
     """טיפול בלחיצה על כפתור ביטול הורדה"""
@@ -137,4 +190,7 @@ async def cancel_upload_handler(event):
 
 if __name__ == "__main__":
     logging.info("מתחיל את הבוט")
+    client.loop.run_until_complete(video_service.start())
+    if METRICS_PORT:
+        client.loop.run_until_complete(video_service.metrics.start_server(METRICS_HOST, METRICS_PORT))
     client.run_until_disconnected()
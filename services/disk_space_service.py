@@ -0,0 +1,79 @@
+import shutil
+import logging
+from config.settings import DISK_MIN_FREE, DISK_OUTPUT_RATIO
+
+logger = logging.getLogger(__name__)
+
+class DiskSpaceService:
+    """בקרת כניסה לפי המקום הפנוי בדיסק
+
+    לפני שמשימה מתחילה נשמר עבורה המקום שהיא צפויה לתפוס: קובץ המקור
+    ועוד הערכה לגודל ה-MP4. משימה נכנסת רק אם המקום הפנוי שנמדד, פחות
+    השמירות של המשימות שכבר רצות ופחות מרווח ביטחון, מספיק לה. השמירה
+    משתחררת בחלקים: המקור כשההורדה מסתיימת (מאז הוא כבר נספר במקום הפנוי
+    שנמדד), הפלט כשההמרה מסתיימת, והשאר כשהמשימה יוצאת מהצינור.
+    """
+
+    def __init__(self, path: str, min_free: int = DISK_MIN_FREE, output_ratio: float = DISK_OUTPUT_RATIO):
+        """אתחול הבקרה
+
+        Args:
+            path: התיקייה שאליה יורדים הקבצים (המדידה היא של מערכת הקבצים שלה)
+            min_free: כמה בתים להשאיר תמיד פנויים
+            output_ratio: גודל ה-MP4 המשוער ביחס לגודל המקור
+        """
+        self.path = path
+        self.min_free = min_free
+        self.output_ratio = output_ratio
+        self._reservations = {}  # מפתח משימה -> {'source': בתים, 'output': בתים}
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.path).free
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(sum(parts.values()) for parts in self._reservations.values())
+
+    def estimate(self, size: int) -> dict:
+        """המקום שמשימה צפויה לתפוס, לפי גודל קובץ המקור"""
+        size = size or 0
+        return {'source': size, 'output': int(size * self.output_ratio)}
+
+    def can_admit(self, size: int) -> bool:
+        """האם יש מקום להתחיל משימה בגודל הזה
+
+        כשאין אף משימה עם שמירה, המשימה נכנסת בכל מקרה - אחרת קובץ שההערכה
+        שלו גדולה מכל הדיסק היה חוסם את התור לתמיד.
+        """
+        if not self._reservations:
+            return True
+        needed = sum(self.estimate(size).values())
+        available = self.free_bytes() - self.min_free - self.reserved_bytes
+        if needed > available:
+            logger.debug(
+                f"אין מספיק מקום בדיסק למשימה: נדרשים {needed / 1024 ** 2:.0f}MB, "
+                f"זמינים {max(0, available) / 1024 ** 2:.0f}MB"
+            )
+            return False
+        return True
+
+    def reserve(self, key, size: int) -> None:
+        """שמירת מקום למשימה שמתחילה"""
+        self._reservations[key] = self.estimate(size)
+
+    def release(self, key, part: str = None) -> None:
+        """שחרור השמירה של משימה, כולה או רק חלק ממנה ('source' או 'output')"""
+        if part is None:
+            self._reservations.pop(key, None)
+            return
+        parts = self._reservations.get(key)
+        if parts is not None:
+            parts[part] = 0
+
+    def status(self) -> dict:
+        """מצב הדיסק לדיווח"""
+        return {
+            'free': self.free_bytes(),
+            'reserved': self.reserved_bytes,
+            'jobs': len(self._reservations),
+        }
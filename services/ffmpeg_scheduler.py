@@ -0,0 +1,189 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from config.settings import ENCODING_PROFILES, FFMPEG_MAX_ENCODES, FFMPEG_NICENESS
+
+logger = logging.getLogger(__name__)
+
+STDERR_TAIL_LINES = 30  # כמה שורות אחרונות של stderr נשמרות לדיווח שגיאה
+
+def _parse_number(value, default: float = 0.0) -> float:
+    """המרת ערך מהפלט של ffmpeg למספר ('N/A' ודומיו הופכים לברירת המחדל)"""
+    try:
+        return float(str(value).rstrip('x'))
+    except (TypeError, ValueError):
+        return default
+
+def parse_progress_block(block: dict, duration: float = 0) -> dict:
+    """המרת בלוק של -progress (מפתח=ערך) למצב התקדמות
+
+    Returns:
+        dict: זמן שקודד, fps, מכפיל מהירות, אחוז ו-ETA (אחוז ו-ETA רק כשהמשך ידוע)
+    """
+    # out_time_ms של ffmpeg הוא בפועל במיקרו-שניות, כמו out_time_us
+    out_time = _parse_number(block.get('out_time_us') or block.get('out_time_ms')) / 1_000_000
+    out_time = max(0.0, out_time)
+    speed = _parse_number(block.get('speed'))
+    percent = min(100.0, out_time * 100 / duration) if duration else None
+    eta = max(0.0, (duration - out_time) / speed) if duration and speed else None
+    return {
+        'out_time': out_time,
+        'fps': _parse_number(block.get('fps')),
+        'speed': speed,
+        'percent': percent,
+        'eta': eta,
+        'done': block.get('progress') == 'end',
+    }
+
+class FFmpegScheduler:
+    """תזמון הרצות ffmpeg לפי מספר הליבות במכונה
+
+    קידוד וידאו מלא תופס מקום (slot) מתוך מספר מוגבל, ומקבל מספר קבוע של
+    תהליכונים, כך שסך התהליכונים לא עולה על מספר הליבות. העתקת זרמים
+    (remux) כמעט לא צורכת מעבד ולכן לא ממתינה למקום פנוי. כל התהליכים רצים
+    בעדיפות נמוכה (nice) כדי שלולאת האירועים של הבוט תישאר זמינה.
+    """
+
+    def __init__(self, cpu_count: int = None, max_encodes: int = FFMPEG_MAX_ENCODES,
+                 niceness: int = FFMPEG_NICENESS, profiles: list = ENCODING_PROFILES):
+        """אתחול המתזמן
+
+        Args:
+            cpu_count: מספר הליבות (ברירת מחדל - של המכונה)
+            max_encodes: מספר הקידודים המקבילים (0 = לפי מספר הליבות)
+            niceness: ערך nice לתהליכי ffmpeg (0 = ללא שינוי)
+            profiles: רשימת פרופילי הקידוד לפי הסדר
+        """
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        # ברירת מחדל: קידוד אחד לכל 4 ליבות - קידודים מקבילים עם פחות תהליכונים
+        # נותנים יותר סרטונים בשעה מקידוד אחד שמנסה לנצל את כל הליבות
+        self.max_encodes = max_encodes or max(1, self.cpu_count // 4)
+        self.threads_per_job = max(1, self.cpu_count // self.max_encodes)
+        self.niceness = niceness
+        self.profiles = profiles
+        self.active_encodes = 0
+        self._encode_slots = asyncio.Semaphore(self.max_encodes)
+        logger.info(
+            f"מתזמן ffmpeg: ליבות={self.cpu_count}, קידודים מקבילים={self.max_encodes}, "
+            f"תהליכונים לקידוד={self.threads_per_job}, nice={self.niceness}"
+        )
+
+    def select_profile(self, probe: dict, size: int = 0) -> dict:
+        """בחירת פרופיל קידוד לפי משך, רזולוציה וגודל הקובץ
+
+        הפרופיל הראשון שהקובץ עומד בכל המגבלות שלו נבחר; אם אף אחד לא מתאים,
+        נבחר האחרון ברשימה.
+
+        Returns:
+            dict: הפרופיל, כולל מספר התהליכונים לקידוד
+        """
+        duration = probe.get('duration') or 0
+        width, height = probe.get('width') or 0, probe.get('height') or 0
+        lines = min(width, height) if width and height else max(width, height)
+        size = size or probe.get('size') or 0
+
+        selected = self.profiles[-1]
+        for profile in self.profiles:
+            if duration > profile.get('max_duration', float('inf')):
+                continue
+            if lines > profile.get('max_height', float('inf')):
+                continue
+            if size > profile.get('max_size', float('inf')):
+                continue
+            selected = profile
+            break
+
+        logger.info(
+            f"פרופיל קידוד {selected['name']} (משך={duration:.0f}s, {lines}p, "
+            f"{size / (1024 * 1024):.0f}MB)"
+        )
+        return {**selected, 'threads': self.threads_per_job}
+
+    @asynccontextmanager
+    async def slot(self, encode: bool):
+        """תפיסת מקום להרצת ffmpeg; רק קידוד וידאו ממתין למקום פנוי"""
+        if not encode:
+            yield
+            return
+        async with self._encode_slots:
+            self.active_encodes += 1
+            try:
+                yield
+            finally:
+                self.active_encodes -= 1
+
+    def _lower_priority(self) -> None:
+        os.nice(self.niceness)
+
+    async def spawn(self, args: list, **kwargs) -> asyncio.subprocess.Process:
+        """הפעלת תהליך ffmpeg בעדיפות המוגדרת (בלי להמתין למקום - ראה slot)"""
+        if self.niceness and hasattr(os, 'nice'):
+            kwargs['preexec_fn'] = self._lower_priority
+        return await asyncio.create_subprocess_exec('ffmpeg', *args, **kwargs)
+
+    async def _read_progress(self, stream, duration: float, progress_callback) -> None:
+        """קריאת הפלט של -progress שורה אחרי שורה והעברת כל בלוק שהושלם"""
+        block = {}
+        async for raw_line in stream:
+            key, _, value = raw_line.decode(errors='ignore').strip().partition('=')
+            block[key] = value
+            if key != 'progress':
+                continue
+            if progress_callback:
+                try:
+                    progress_callback(parse_progress_block(block, duration))
+                except Exception as e:
+                    logger.debug(f"שגיאה בדיווח התקדמות ffmpeg: {e}")
+            block = {}
+
+    async def run(self, args: list, encode: bool, duration: float = 0, progress_callback=None) -> tuple:
+        """הרצת ffmpeg עד סופו בתוך מקום פנוי
+
+        ההתקדמות נקראת מ--progress pipe:1 תוך כדי ההרצה, ומ-stderr נשמר רק
+        זנב חסום של שורות לדיווח שגיאות - במקום כל הפלט בזיכרון.
+
+        Args:
+            args: הפרמטרים ל-ffmpeg (בלי שם התוכנה)
+            encode: האם זה קידוד וידאו שצריך מקום פנוי
+            duration: משך המקור בשניות, לחישוב אחוז ו-ETA
+            progress_callback: פונקציה רגילה (לא אסינכרונית) שמקבלת את מצב ההתקדמות;
+                היא לא צריכה לחכות לכלום, כדי לא לעכב את קריאת הפלט של ffmpeg
+
+        Returns:
+            tuple: (קוד היציאה, זנב ה-stderr כטקסט)
+        """
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+
+        async def read_stderr(stream):
+            async for line in stream:
+                stderr_tail.append(line.decode(errors='ignore').rstrip())
+
+        async with self.slot(encode):
+            process = await self.spawn(
+                ['-nostats', '-progress', 'pipe:1', *args],
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                await asyncio.gather(
+                    self._read_progress(process.stdout, duration, progress_callback),
+                    read_stderr(process.stderr)
+                )
+                await process.wait()
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+        return process.returncode, '\n'.join(stderr_tail)
+
+_scheduler = None
+
+def get_ffmpeg_scheduler() -> FFmpegScheduler:
+    """המתזמן המשותף (נוצר בשימוש הראשון)"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FFmpegScheduler()
+    return _scheduler
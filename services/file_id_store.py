@@ -0,0 +1,131 @@
+import os
+import yaml
+import sqlite3
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class FileIdStore:
+    """מאגר מזהי קבצים מאונדקס ב-SQLite (מצב WAL)
+
+    חיפוש הוא חיפוש במפתח ראשי, ושמירה היא כתיבת שורה אחת - בלי לקרוא
+    ולכתוב מחדש את כל המאגר בכל בקשה. הזיהוי הראשי הוא לפי זהות המסמך
+    בטלגרם (document id וגודל) או גיבוב התוכן, ושם הקובץ משמש רק כגיבוי.
+    """
+
+    def __init__(self, db_path: str, legacy_yaml_path: Optional[str] = None):
+        """פתיחת המאגר
+
+        Args:
+            db_path: נתיב קובץ ה-SQLite
+            legacy_yaml_path: קובץ ה-YAML הישן, שיוסב פעם אחת אם קיים
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            "file_name TEXT PRIMARY KEY, file_id TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "document_id INTEGER NOT NULL, size INTEGER NOT NULL, file_id TEXT NOT NULL, "
+            "PRIMARY KEY (document_id, size))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS content_hashes ("
+            "content_hash TEXT PRIMARY KEY, file_id TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+        if legacy_yaml_path and os.path.exists(legacy_yaml_path):
+            self._migrate_from_yaml(legacy_yaml_path)
+
+    def _migrate_from_yaml(self, yaml_path: str) -> None:
+        """הסבה חד-פעמית של קובץ ה-YAML הישן למאגר
+
+        אחרי ההסבה הקובץ הישן משנה את שמו ל-.migrated, כך שההסבה לא תרוץ שוב.
+        """
+        try:
+            with open(yaml_path, 'r', encoding='utf-8') as file:
+                file_ids = yaml.safe_load(file) or {}
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO file_ids (file_name, file_id) VALUES (?, ?)",
+                    ((str(name), str(file_id)) for name, file_id in file_ids.items())
+                )
+            os.replace(yaml_path, f"{yaml_path}.migrated")
+            logger.info(f"הוסבו {len(file_ids)} מזהי קבצים מ-{yaml_path} למאגר {self.db_path}")
+        except Exception as e:
+            logger.error(f"שגיאה בהסבת קובץ המזהים הישן: {e}")
+
+    def get(self, file_name: str) -> Optional[str]:
+        """חיפוש מזהה קובץ לפי שם"""
+        row = self._conn.execute(
+            "SELECT file_id FROM file_ids WHERE file_name = ?", (file_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, file_name: str, file_id: str) -> None:
+        """שמירת מזהה קובץ (דורס ערך קיים)"""
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_ids (file_name, file_id) VALUES (?, ?)",
+                (file_name, str(file_id))
+            )
+
+    def get_by_document(self, document_id: int, size: int) -> Optional[str]:
+        """חיפוש מזהה קובץ לפי זהות המסמך בטלגרם"""
+        row = self._conn.execute(
+            "SELECT file_id FROM documents WHERE document_id = ? AND size = ?",
+            (document_id, size)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_by_hash(self, content_hash: str) -> Optional[str]:
+        """חיפוש מזהה קובץ לפי גיבוב התוכן"""
+        row = self._conn.execute(
+            "SELECT file_id FROM content_hashes WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_identity(self, file_id: str, file_name: Optional[str] = None,
+                     documents: tuple = (), content_hash: Optional[str] = None) -> None:
+        """שמירת מזהה קובץ תחת כל הזהויות המוכרות שלו בטרנזקציה אחת
+
+        Args:
+            file_id: מזהה הקובץ מטלגרם
+            file_name: שם הקובץ (חיפוש משני)
+            documents: זוגות (document_id, size) - למשל של קובץ המקור ושל הקובץ שנשלח
+            content_hash: גיבוב התוכן של קובץ המקור, אם חושב
+        """
+        file_id = str(file_id)
+        with self._conn:
+            if file_name:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO file_ids (file_name, file_id) VALUES (?, ?)",
+                    (file_name, file_id)
+                )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (document_id, size, file_id) VALUES (?, ?, ?)",
+                ((document_id, size, file_id) for document_id, size in documents
+                 if document_id is not None and size is not None)
+            )
+            if content_hash:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO content_hashes (content_hash, file_id) VALUES (?, ?)",
+                    (content_hash, file_id)
+                )
+
+    def as_dict(self) -> dict:
+        """כל המזהים במאגר כמילון"""
+        return dict(self._conn.execute("SELECT file_name, file_id FROM file_ids"))
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
@@ -1,73 +1,415 @@
 import os
-import yaml
+import json
+import hashlib
 import logging
 import asyncio
-from config.settings import FILE_IDS_FILE
-from typing import Union
+from collections import OrderedDict, deque
+from contextlib import AsyncExitStack
+from config.settings import FILE_IDS_FILE, FILE_IDS_DB, STREAM_PROBE_BYTES
+from services.file_id_store import FileIdStore
+from services.ffmpeg_scheduler import get_ffmpeg_scheduler
+from typing import Optional, Union
+
+_file_id_store = None
+
+def get_file_id_store() -> FileIdStore:
+    """המאגר המשותף של מזהי הקבצים (נפתח בשימוש הראשון)"""
+    global _file_id_store
+    if _file_id_store is None:
+        _file_id_store = FileIdStore(FILE_IDS_DB, legacy_yaml_path=FILE_IDS_FILE)
+    return _file_id_store
 
 def load_file_ids() -> dict:
-    """טעינת רשימת מזהי הקבצים מהקובץ"""
-    if os.path.exists(FILE_IDS_FILE):
-        with open(FILE_IDS_FILE, "r") as file:
-            return yaml.safe_load(file) or {}
-    return {}
+    """טעינת רשימת מזהי הקבצים מהמאגר"""
+    return get_file_id_store().as_dict()
 
-def save_file_id(file_name: str, file_id: str) -> None:
+def save_file_id(file_name: str, file_id: str, documents: tuple = (), content_hash: str = None) -> None:
     """שמירת מזהה הקובץ במאגר
     
     Args:
-        file_name: שם הקובץ לשמירה
+        file_name: שם הקובץ לשמירה (חיפוש משני, אפשר None)
         file_id: מזהה הקובץ מטלגרם (מחרוזת)
+        documents: זוגות (document_id, size) של המסמכים שמייצגים את אותו תוכן
+        content_hash: גיבוב התוכן של קובץ המקור, אם חושב
     """
-    file_ids = {}
-    if os.path.exists(FILE_IDS_FILE):
-        with open(FILE_IDS_FILE, 'r') as f:
-            file_ids = yaml.safe_load(f) or {}
-    
-    file_ids[file_name] = file_id
-    
-    with open(FILE_IDS_FILE, 'w') as f:
-        yaml.dump(file_ids, f)
+    get_file_id_store().set_identity(file_id, file_name, documents, content_hash)
 
-def check_existing_file(file_name: str) -> Union[str, None]:
+def check_existing_file(file_name: Optional[str], document_id: Optional[int] = None,
+                        size: Optional[int] = None, content_hash: Optional[str] = None) -> Union[str, None]:
     """בדיקה אם הקובץ כבר קיים במאגר
     
+    החיפוש הוא לפי זהות המסמך בטלגרם, אחר כך לפי גיבוב התוכן, ורק בסוף לפי שם.
+    
     Args:
-        file_name: שם הקובץ לחיפוש
+        file_name: שם הקובץ לחיפוש משני (None כדי לדלג על חיפוש לפי שם)
+        document_id: מזהה המסמך בטלגרם
+        size: גודל המסמך בבתים
+        content_hash: גיבוב התוכן של הקובץ
         
     Returns:
         str או None: מחזיר את ה-file_id כמחרוזת אם קיים, אחרת None
     """
-    if os.path.exists(FILE_IDS_FILE):
-        with open(FILE_IDS_FILE, 'r') as f:
-            file_ids = yaml.safe_load(f) or {}
-            return file_ids.get(file_name)
-    return None
-
-async def convert_to_mp4(input_file: str, output_file: str) -> bool:
-    """המרת קובץ וידאו לפורמט MP4"""
+    store = get_file_id_store()
+    if document_id is not None and size is not None:
+        file_id = store.get_by_document(document_id, size)
+        if file_id:
+            return file_id
+    if content_hash:
+        file_id = store.get_by_hash(content_hash)
+        if file_id:
+            return file_id
+    return store.get(file_name) if file_name else None
+
+async def compute_file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """חישוב גיבוב SHA-256 של קובץ בלי לחסום את לולאת האירועים"""
+    def _hash() -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    return await asyncio.to_thread(_hash)
+
+# קודקים שאפשר להעתיק לתוך MP4 בלי קידוד מחדש
+MP4_VIDEO_CODECS = {'h264', 'hevc'}
+MP4_AUDIO_CODECS = {'aac', 'mp3', 'ac3', 'eac3'}
+
+# טלגרם מגביל תמונה ממוזערת ל-320 פיקסלים בצלע הארוכה
+THUMBNAIL_MAX_SIDE = 320
+THUMBNAIL_SCALE_FILTER = (
+    f'scale={THUMBNAIL_MAX_SIDE}:{THUMBNAIL_MAX_SIDE}:force_original_aspect_ratio=decrease'
+)
+
+# מכולות שאפשר לקרוא ברצף מתחילתן (בלי אינדקס בסוף הקובץ), ולכן אפשר להמיר תוך כדי הורדה
+STREAMABLE_EXTENSIONS = {'.mkv', '.webm', '.ts', '.mts', '.flv', '.mpg', '.vob'}
+
+# מטמון תוצאות ffprobe לפי (נתיב, גודל, זמן שינוי)
+PROBE_CACHE_SIZE = 128
+_probe_cache = OrderedDict()
+
+def _parse_probe(data: dict) -> dict:
+    """המרת הפלט של ffprobe למילון מטא-דאטה אחיד"""
+    streams = data.get('streams', [])
+    fmt = data.get('format', {})
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not s.get('disposition', {}).get('attached_pic')), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    width = int(video.get('width') or 0) if video else 0
+    height = int(video.get('height') or 0) if video else 0
+    if video:
+        # וידאו מסובב (למשל מטלפון) - מחליפים רוחב וגובה לפי התצוגה
+        rotation = video.get('tags', {}).get('rotate')
+        for side_data in video.get('side_data_list', []):
+            rotation = side_data.get('rotation', rotation)
+        try:
+            if abs(int(float(rotation or 0))) % 180 == 90:
+                width, height = height, width
+        except ValueError:
+            pass
+
+    duration = fmt.get('duration') or (video or {}).get('duration') or 0
+    return {
+        'duration': float(duration),
+        'width': width,
+        'height': height,
+        'video_codec': video.get('codec_name') if video else None,
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'bit_rate': int(fmt.get('bit_rate') or 0),
+        'size': int(fmt.get('size') or 0),
+        'format_name': fmt.get('format_name'),
+        'streams': streams,
+    }
+
+async def probe_video(input_file: str) -> dict:
+    """קבלת מטא-דאטה של קובץ וידאו בהרצת ffprobe אחת
+
+    התוצאה נשמרת במטמון לפי הקובץ, כך שההמרה, התמונה הממוזערת ובניית
+    המאפיינים לטלגרם משתמשות באותה בדיקה.
+
+    Returns:
+        dict: משך, רוחב, גובה, קודקים, קצב סיביות ורשימת הזרמים,
+        או מילון ריק אם הבדיקה נכשלה
+    """
     try:
-        process = await asyncio.create_subprocess_shell(
-            f'ffmpeg -i "{input_file}" "{output_file}"',
+        stat = os.stat(input_file)
+    except OSError as e:
+        logging.error(f"לא ניתן לבדוק את הקובץ {input_file}: {e}")
+        return {}
+
+    key = (os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns)
+    if key in _probe_cache:
+        _probe_cache.move_to_end(key)
+        return _probe_cache[key]
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'error', '-print_format', 'json',
+            '-show_format', '-show_streams', input_file,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
-        await process.communicate()
-        return process.returncode == 0
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            logging.error(f"ffprobe נכשל: {stderr.decode(errors='ignore')[-500:]}")
+            return {}
+        info = _parse_probe(json.loads(stdout or b'{}'))
+    except Exception as e:
+        logging.error(f"שגיאה בבדיקת הקובץ: {e}")
+        return {}
+
+    _probe_cache[key] = info
+    if len(_probe_cache) > PROBE_CACHE_SIZE:
+        _probe_cache.popitem(last=False)
+    return info
+
+def _main_streams(streams: list) -> tuple:
+    """זרם הוידאו (בלי תמונות כריכה) וזרם האודיו הראשונים"""
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not s.get('disposition', {}).get('attached_pic')), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    return video, audio
+
+def _stream_maps(video: dict, audio: dict) -> list:
+    """מיפוי הזרמים שנבחרו לפי האינדקס שלהם, ולא 0:v:0 - שיכול להיות תמונת כריכה"""
+    return [
+        '-map', f"0:{video['index']}" if video else '0:v:0',
+        '-map', f"0:{audio['index']}" if audio else '0:a:0?'
+    ]
+
+def needs_video_encode(streams: list) -> bool:
+    """האם הוידאו צריך קידוד מלא (הקודק שלו לא נתמך ב-MP4)"""
+    video, _ = _main_streams(streams)
+    return not (video and video.get('codec_name') in MP4_VIDEO_CODECS)
+
+def build_conversion_args(streams: list, fragmented: bool = False, profile: dict = None,
+                          full_encode: bool = False) -> list:
+    """בחירת פרמטרי ההמרה לפי הקודקים בקובץ
+
+    וידאו ואודיו תואמים מועתקים כמו שהם (remux), אודיו לא תואם מקודד ל-AAC,
+    וקידוד מלא של הוידאו נעשה רק כשהקודק שלו לא נתמך ב-MP4.
+
+    Args:
+        streams: רשימת הזרמים מ-ffprobe (רשימה ריקה = קידוד מלא)
+        fragmented: פלט MP4 מפוצל, שנכתב ברצף בלי לחזור לתחילת הקובץ (להמרה תוך כדי הורדה)
+        profile: פרופיל הקידוד מהמתזמן (preset, crf, threads) לקידוד וידאו
+        full_encode: קידוד מלא של הוידאו והאודיו גם כשהקודקים נתמכים
+            (כשהעתקת הזרמים נכשלה)
+    """
+    video, audio = _main_streams(streams)
+
+    args = _stream_maps(video, audio)
+    if not full_encode and not needs_video_encode(streams):
+        args += ['-c:v', 'copy']
+        if video.get('codec_name') == 'hevc':
+            args += ['-tag:v', 'hvc1']  # נדרש לניגון HEVC בנגנים של אפל
+    else:
+        args += ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+        if profile:
+            args += [
+                '-preset', profile['preset'],
+                '-crf', str(profile['crf']),
+                '-threads', str(profile['threads'])
+            ]
+
+    if not full_encode and audio and audio.get('codec_name') in MP4_AUDIO_CODECS:
+        args += ['-c:a', 'copy']
+    else:
+        args += ['-c:a', 'aac']
+
+    movflags = 'frag_keyframe+empty_moov+default_base_moof' if fragmented else '+faststart'
+    return args + ['-sn', '-dn', '-movflags', movflags]
+
+def thumbnail_offset(duration: float) -> float:
+    """נקודת הזמן לתמונה הממוזערת - שנייה אחת, או אמצע סרטון קצר יותר"""
+    return min(1.0, duration / 2) if duration else 1.0
+
+def thumbnail_output_args(thumbnail_file: str, offset: float, streams: list = ()) -> list:
+    """פרמטרים לפלט נוסף של תמונה ממוזערת באותה הרצת ffmpeg
+
+    משמש כשהוידאו מפוענח בכל מקרה (קידוד מלא), כך שהתמונה לא דורשת מעבר
+    פענוח נוסף. הצלע הארוכה מוקטנת ל-THUMBNAIL_MAX_SIDE כדרישת טלגרם.
+    התמונה נלקחת מאותו זרם וידאו שמומר (לא מתמונת כריכה).
+    """
+    video, _ = _main_streams(streams)
+    return [
+        '-map', f"0:{video['index']}" if video else '0:v:0', '-ss', f'{offset:.3f}', '-frames:v', '1',
+        '-vf', THUMBNAIL_SCALE_FILTER, '-q:v', '4', thumbnail_file
+    ]
+
+async def _run_ffmpeg(input_file: str, output_file: str, args: list, encode: bool,
+                      duration: float = 0, progress_callback=None, extra_outputs: list = ()) -> bool:
+    """הרצת ffmpeg עם פרמטרי המרה נתונים דרך המתזמן"""
+    returncode, stderr = await get_ffmpeg_scheduler().run(
+        ['-y', '-i', input_file, *args, output_file, *extra_outputs], encode=encode,
+        duration=duration, progress_callback=progress_callback
+    )
+    if returncode != 0:
+        logging.error(f"ffmpeg נכשל: {stderr[-1000:]}")
+        return False
+    return True
+
+async def convert_to_mp4(input_file: str, output_file: str, probe: dict = None,
+                         progress_callback=None, thumbnail_file: str = None) -> bool:
+    """המרת קובץ וידאו לפורמט MP4, עם העתקת זרמים תואמים כשאפשר
+
+    Args:
+        input_file: קובץ המקור
+        output_file: קובץ ה-MP4 שייווצר
+        probe: תוצאת probe_video של קובץ המקור, אם כבר קיימת
+        progress_callback: פונקציה רגילה שמקבלת את מצב ההתקדמות של ffmpeg
+            (fps, מהירות, אחוז, ETA)
+        thumbnail_file: אם הוידאו מקודד מחדש, התמונה הממוזערת נוצרת באותה
+            הרצה. ב-remux היא לא נוצרת, וצריך לקרוא ל-create_thumbnail.
+    """
+    try:
+        if probe is None:
+            probe = await probe_video(input_file)
+        scheduler = get_ffmpeg_scheduler()
+        streams = probe.get('streams', [])
+        encode = needs_video_encode(streams)
+        profile = scheduler.select_profile(probe) if encode else None
+        args = build_conversion_args(streams, profile=profile)
+        logging.info(f"ממיר ל-MP4 עם: {' '.join(args)}")
+        duration = probe.get('duration', 0)
+        thumbnail_args = (
+            thumbnail_output_args(thumbnail_file, thumbnail_offset(duration), streams) if thumbnail_file else []
+        )
+        if await _run_ffmpeg(input_file, output_file, args, encode, duration, progress_callback,
+                             thumbnail_args if encode else []):
+            return True
+
+        # העתקת הזרמים נכשלה (למשל חותמות זמן שבורות) - קידוד מלא
+        if not encode:
+            logging.warning("העתקת הזרמים נכשלה, מבצע קידוד מלא")
+            args = build_conversion_args(streams, profile=scheduler.select_profile(probe), full_encode=True)
+            return await _run_ffmpeg(input_file, output_file, args, True, duration, progress_callback,
+                                     thumbnail_args)
+        return False
     except Exception as e:
         logging.error(f"שגיאה בהמרת הקובץ ל-MP4: {e}")
         return False
 
-async def create_thumbnail(input_file: str, thumbnail_file: str) -> bool:
-    """יצירת תמונה ממוזערת לוידאו"""
+async def probe_stream_head(data: bytes) -> dict:
+    """בדיקת הזרמים מתוך תחילת קובץ (למשל החלקים הראשונים שהורדו)"""
     try:
-        process = await asyncio.create_subprocess_shell(
-            f'ffmpeg -i "{input_file}" -ss 00:00:01.000 -vframes 1 "{thumbnail_file}"',
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'error', '-print_format', 'json',
+            '-show_format', '-show_streams', '-i', 'pipe:0',
+            stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
-        await process.communicate()
-        return process.returncode == 0
+        stdout, _ = await process.communicate(data)
+        if process.returncode != 0:
+            return {}
+        return _parse_probe(json.loads(stdout or b'{}'))
+    except Exception as e:
+        logging.error(f"שגיאה בבדיקת תחילת הקובץ: {e}")
+        return {}
+
+async def stream_to_mp4(chunks, output_file: str, total_size: int = 0, progress_callback=None) -> bool:
+    """המרה ל-MP4 תוך כדי הורדה
+
+    החלקים שמגיעים מההורדה נכתבים ישירות ל-stdin של ffmpeg, והפלט הוא MP4
+    מפוצל שנכתב ישר לקובץ היעד - כך שקובץ המקור לא נשמר על הדיסק.
+    פרמטרי ההמרה נבחרים לפי בדיקה של STREAM_PROBE_BYTES הבתים הראשונים.
+
+    Args:
+        chunks: איטרטור אסינכרוני של חלקי הקובץ לפי הסדר
+        output_file: קובץ ה-MP4 שייווצר
+        total_size: גודל קובץ המקור, לדיווח התקדמות
+        progress_callback: פונקציה אסינכרונית (current, total) כמו בהורדה רגילה;
+            חריגה ממנה (למשל ביטול) עוצרת את ffmpeg ועוברת הלאה
+    """
+    head = bytearray()
+    received = 0
+    process = None
+    stderr_task = None
+    stderr_tail = deque(maxlen=20)
+    scheduler = get_ffmpeg_scheduler()
+    exit_stack = AsyncExitStack()
+
+    async def _read_stderr():
+        async for line in process.stderr:
+            stderr_tail.append(line.decode(errors='ignore').rstrip())
+
+    async def _start_ffmpeg():
+        nonlocal process, stderr_task
+        probe = await probe_stream_head(bytes(head))
+        streams = probe.get('streams', [])
+        encode = needs_video_encode(streams)
+        profile = scheduler.select_profile(probe, size=total_size) if encode else None
+        args = build_conversion_args(streams, fragmented=True, profile=profile)
+        logging.info(f"ממיר תוך כדי הורדה עם: {' '.join(args)}")
+        # המקום אצל המתזמן נשמר עד סוף ההמרה (ראה exit_stack למטה)
+        await exit_stack.enter_async_context(scheduler.slot(encode))
+        process = await scheduler.spawn(
+            ['-y', '-loglevel', 'error', '-i', 'pipe:0', *args, output_file],
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stderr_task = asyncio.create_task(_read_stderr())
+        await _write(bytes(head))
+
+    async def _write(data: bytes):
+        process.stdin.write(data)
+        await process.stdin.drain()
+
+    async with exit_stack:
+        try:
+            async for chunk in chunks:
+                received += len(chunk)
+                if process is None:
+                    head.extend(chunk)
+                    if len(head) >= STREAM_PROBE_BYTES:
+                        await _start_ffmpeg()
+                else:
+                    await _write(chunk)
+                if progress_callback:
+                    await progress_callback(received, total_size or received)
+
+            if process is None:
+                await _start_ffmpeg()  # קובץ קטן מגודל הבדיקה
+            process.stdin.close()
+            await process.wait()
+            await stderr_task
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg נסגר באמצע - הסיבה תופיע בסוף ה-stderr
+            await process.wait()
+            await stderr_task
+        except BaseException:
+            if process and process.returncode is None:
+                process.kill()
+                await process.wait()
+            if stderr_task:
+                stderr_task.cancel()
+                await asyncio.gather(stderr_task, return_exceptions=True)
+            raise
+
+    if process.returncode != 0:
+        logging.error(f"ההמרה תוך כדי הורדה נכשלה: {' | '.join(stderr_tail)}")
+        return False
+    return True
+
+async def create_thumbnail(input_file: str, thumbnail_file: str, duration: float = 0) -> bool:
+    """יצירת תמונה ממוזערת לוידאו
+
+    החיפוש נעשה לפני ה-i- (בצד הקלט), כך ש-ffmpeg קופץ ל-keyframe הקרוב
+    ומפענח רק פריים אחד במקום לפענח את הוידאו מההתחלה.
+
+    Args:
+        duration: משך הוידאו בשניות, כדי לא לחפש מעבר לסופו בסרטונים קצרים
+    """
+    offset = thumbnail_offset(duration)
+    try:
+        returncode, _ = await get_ffmpeg_scheduler().run(
+            ['-y', '-ss', f'{offset:.3f}', '-i', input_file, '-frames:v', '1',
+             '-vf', THUMBNAIL_SCALE_FILTER, '-q:v', '4', thumbnail_file],
+            encode=False
+        )
+        return returncode == 0
     except Exception as e:
         logging.error(f"שגיאה ביצירת תמונה ממוזערת: {e}")
         return False
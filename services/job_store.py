@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# השלבים לפי הסדר; השלב שנשמר הוא השלב הבא שצריך לרוץ (או שרץ כרגע)
+JOB_STAGES = ('queued', 'downloading', 'converting', 'uploading', 'delivered')
+
+class JobStore:
+    """יומן משימות עמיד לקריסות ב-SQLite (מצב WAL)
+
+    כל משימה נרשמת כשהיא נכנסת לתור, והשלב שלה מתעדכן במעבר בין שלבי
+    הצינור יחד עם התוצרים שכבר קיימים על הדיסק (הקובץ שהורד, תוצאת
+    ההמרה). אחרי הפעלה מחדש אפשר להמשיך כל משימה מהשלב האחרון שהושלם
+    במקום להתחיל אותה מההתחלה.
+    """
+
+    def __init__(self, db_path: str):
+        """פתיחת היומן
+
+        Args:
+            db_path: נתיב קובץ ה-SQLite
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+            "stage TEXT NOT NULL, file_path TEXT, video_data TEXT, content_hash TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (chat_id, message_id))"
+        )
+        self._conn.commit()
+
+    def add(self, chat_id: int, message_id: int, user_id: int) -> None:
+        """רישום משימה חדשה בשלב queued"""
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (chat_id, message_id, user_id, stage, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?)",
+                (chat_id, message_id, user_id, now, now)
+            )
+
+    def set_stage(self, chat_id: int, message_id: int, stage: str, file_path: Optional[str] = None,
+                  video_data: Optional[dict] = None, content_hash: Optional[str] = None) -> None:
+        """עדכון השלב של משימה, יחד עם התוצרים שנוצרו עד עכשיו
+
+        ערכים שלא הועברו (None) נשארים כמו שהיו.
+        """
+        if stage not in JOB_STAGES:
+            raise ValueError(f"שלב לא מוכר: {stage}")
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, "
+                "file_path = COALESCE(?, file_path), "
+                "video_data = COALESCE(?, video_data), "
+                "content_hash = COALESCE(?, content_hash), "
+                "updated_at = ? "
+                "WHERE chat_id = ? AND message_id = ?",
+                (stage, file_path, json.dumps(video_data) if video_data is not None else None,
+                 content_hash, time.time(), chat_id, message_id)
+            )
+
+    def remove(self, chat_id: int, message_id: int) -> None:
+        """הסרת משימה שיצאה מהצינור (נמסרה, נכשלה או בוטלה)"""
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE chat_id = ? AND message_id = ?", (chat_id, message_id)
+            )
+
+    def pending(self) -> list:
+        """כל המשימות שלא הסתיימו, לפי סדר הכניסה לתור
+
+        Returns:
+            list: מילון לכל משימה, עם video_data כבר מפוענח
+        """
+        jobs = []
+        for row in self._conn.execute("SELECT * FROM jobs ORDER BY created_at"):
+            job = dict(row)
+            job['video_data'] = json.loads(job['video_data']) if job['video_data'] else None
+            jobs.append(job)
+        return jobs
+
+    def file_paths(self) -> set:
+        """כל הקבצים שמשימות ביומן עדיין צריכות"""
+        paths = set()
+        for job in self.pending():
+            paths.add(job['file_path'])
+            video_data = job['video_data'] or {}
+            for key in ('file_path', 'thumbnail_path', 'original_path'):
+                paths.add(video_data.get(key))
+        paths.discard(None)
+        return paths
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
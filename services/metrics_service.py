@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# גבולות ברירת המחדל של ההיסטוגרמות, בשניות (משך של שלבים: משניות עד שעות)
+DEFAULT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    """מונה שרק עולה, עם תוויות אופציונליות"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """התפלגות של ערכים (משך שלבים) לפי גבולות קבועים"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # תוויות -> [מונים לכל גבול, סכום, כמות]
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """מדידת משך של בלוק קוד (נמדד גם כשהבלוק נכשל)"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Gauge:
+    """ערך רגעי שנקרא בזמן הדגימה מתוך פונקציה
+
+    הפונקציה מחזירה מספר, או מילון מתוויות (tuple) לערך.
+    """
+
+    def __init__(self, name: str, documentation: str, collect, labelnames: tuple = (), kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = labelnames
+        self.kind = kind
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class MetricsService:
+    """מדדים בפורמט הטקסט של Prometheus, עם נקודת קצה /metrics מקומית
+
+    מונים והיסטוגרמות מתעדכנים במקום שבו העבודה נעשית; ערכים רגעיים (עומק
+    התורים, נתוני מגביל הקצב) נקראים ממקורם רק כשמישהו דוגם את /metrics.
+    השרת הוא asyncio בלבד, בלי תלות חיצונית.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._server = None
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, collect, labelnames: tuple = (), kind: str = "gauge") -> Gauge:
+        """ערך שנקרא בזמן הדגימה (kind='counter' לערכים מצטברים שנשמרים במקום אחר)"""
+        return self._register(Gauge(name, documentation, collect, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error(f"שגיאה באיסוף המדד {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+    async def start_server(self, host: str, port: int) -> None:
+        """הפעלת נקודת הקצה /metrics"""
+        if self._server:
+            return
+        self._server = await asyncio.start_server(self._handle, host, port)
+        logger.info(f"נקודת הקצה של המדדים זמינה בכתובת http://{host}:{port}/metrics")
+
+    async def _handle(self, reader, writer) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # שאר הכותרות לא מעניינות, אבל קוראים אותן עד השורה הריקה
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) > 1 else ''
+            if parts[:1] == ['GET'] and path == '/metrics':
+                status, body = "200 OK", self.render().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status, body, content_type = "404 Not Found", b"not found\n", "text/plain"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"בקשה לא תקינה לנקודת הקצה של המדדים: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PipelineStage:
+    """שלב בצינור העיבוד: מאגר עובדים עם תור מסירה חסום לפניו
+
+    כל שלב מושך משימות מהתור שלו, מריץ עליהן את ה-handler ומעביר אותן לשלב
+    הבא. כשהתור של השלב הבא מלא, העובד ממתין (backpressure) במקום לצבור
+    קבצים על הדיסק.
+    """
+
+    def __init__(self, name: str, handler, workers: int, queue_size: int, on_finished):
+        """אתחול שלב
+
+        Args:
+            name: שם השלב (לדיווח ולוגים)
+            handler: פונקציה אסינכרונית שמקבלת משימה ומחזירה True אם להמשיך לשלב הבא
+            workers: מספר העובדים המקבילים בשלב
+            queue_size: גודל תור המסירה לפני השלב
+            on_finished: פונקציה אסינכרונית שנקראת כשמשימה יוצאת מהצינור
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.on_finished = on_finished
+        self.next_stage = None
+        self.active = 0    # משימות שה-handler שלהן רץ כרגע
+        self.blocked = 0   # משימות שסיימו וממתינות למקום בשלב הבא
+        self.completed = 0
+        self._tasks = []
+
+    async def put(self, job) -> None:
+        """הכנסת משימה לתור השלב (ממתין אם התור מלא)"""
+        await self.queue.put(job)
+
+    def idle_workers(self) -> int:
+        """מספר העובדים שיכולים להתחיל משימה חדשה מיד"""
+        return max(0, self.workers - self.active - self.blocked - self.queue.qsize())
+
+    def occupancy(self) -> dict:
+        """דיווח תפוסה של השלב"""
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'active': self.active,
+            'blocked': self.blocked,
+            'waiting': self.queue.qsize(),
+            'capacity': self.queue.maxsize,
+            'completed': self.completed,
+        }
+
+    def start(self) -> None:
+        """הפעלת העובדים של השלב"""
+        if self._tasks:
+            return
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(index)))
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self.queue.get()
+            self.active += 1
+            passed = False
+            try:
+                passed = await self.handler(job)
+            except Exception as e:
+                logger.error(f"שגיאה לא צפויה בשלב {self.name}: {e}", exc_info=True)
+            finally:
+                self.active -= 1
+                self.queue.task_done()
+
+            try:
+                if passed and self.next_stage:
+                    self.blocked += 1
+                    try:
+                        await self.next_stage.put(job)
+                    finally:
+                        self.blocked -= 1
+                else:
+                    await self.on_finished(job)
+            except Exception as e:
+                logger.error(f"שגיאה בהעברת משימה מהשלב {self.name}: {e}", exc_info=True)
+            finally:
+                self.completed += 1
+                logger.debug(f"[{self.name}] {self.occupancy()}")
+
+
+class Pipeline:
+    """שרשרת שלבים שמעבדים משימות שונות במקביל (הורדה, המרה, העלאה)"""
+
+    def __init__(self, stages: list):
+        self.stages = stages
+        for current, following in zip(stages, stages[1:]):
+            current.next_stage = following
+
+    @property
+    def first_stage(self) -> PipelineStage:
+        return self.stages[0]
+
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+
+    async def submit(self, job) -> None:
+        """הכנסת משימה לשלב הראשון"""
+        await self.first_stage.put(job)
+
+    def occupancy(self) -> list:
+        """תפוסת כל השלבים לפי הסדר"""
+        return [stage.occupancy() for stage in self.stages]
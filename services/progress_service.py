@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from config.settings import PROGRESS_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class _ProgressEntry:
+    """הודעת התקדמות אחת שנמצאת במעקב"""
+
+    def __init__(self, message, render, buttons):
+        self.message = message
+        self.render = render
+        self.buttons = buttons
+        self.state = None       # המצב האחרון שדווח (נדרס בכל עדכון)
+        self.dirty = False      # יש מצב שעוד לא הוצג
+        self.last_edit = 0.0
+        self.idle = asyncio.Event()  # לא מתבצעת כרגע עריכה של ההודעה
+        self.idle.set()
+
+class ProgressService:
+    """הצגת התקדמות של כל המשימות הפעילות ממשימת רקע אחת
+
+    ה-callback של ההעברה רק שומר את המצב האחרון של המשימה (בלי await), כך
+    שמגביל הקצב אף פעם לא מעכב את ההורדה או ההעלאה עצמה. משימת הרקע עורכת
+    את ההודעות לפי תקציב העריכות המשותף, ומצבי ביניים שלא הספיקו להיות
+    מוצגים פשוט נדרסים - רק המצב האחרון נשלח.
+    """
+
+    def __init__(self, limiter, interval: float = PROGRESS_EDIT_INTERVAL):
+        """אתחול השירות
+
+        Args:
+            limiter: מגביל הקצב המשותף (העריכות נספרות במחלקה 'progress' של כל צ'אט)
+            interval: זמן מינימלי בשניות בין שתי עריכות של אותה הודעה
+        """
+        self.limiter = limiter
+        self.interval = interval
+        self._entries = {}
+        self._pending = asyncio.Event()
+        self._task = None
+
+    def track(self, key, message, render, buttons=None) -> None:
+        """התחלת מעקב אחרי הודעת התקדמות
+
+        Args:
+            key: מזהה המשימה (למשל מזהה ההודעה ושם השלב)
+            message: הודעת הסטטוס שתיערך
+            render: פונקציה רגילה שמקבלת את המצב האחרון ומחזירה את הטקסט
+            buttons: כפתורים שיישמרו בכל עריכה
+        """
+        self._entries[key] = _ProgressEntry(message, render, buttons)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._render_loop())
+
+    def update(self, key, *state) -> None:
+        """דיווח מצב חדש - לא ממתין לכלום"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry.state = state
+        entry.dirty = True
+        self._pending.set()
+
+    async def untrack(self, key) -> None:
+        """סיום מעקב; ממתין לעריכה שכבר נשלחה כדי שלא תדרוס את הודעת הסיום"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            await entry.idle.wait()
+
+    def _next_entry(self, now: float):
+        """ההודעה שמחכה הכי הרבה זמן מבין אלו שמותר לערוך עכשיו
+
+        הודעה בצ'אט שהמגביל מעכב (למשל אחרי FloodWait) מדולגת, כדי שלא תעכב
+        את העדכונים בצ'אטים האחרים.
+
+        Returns:
+            tuple: (המפתח וההודעה, או None; זמן ההמתנה עד שהודעה הבאה תהיה מוכנה)
+        """
+        selected, wait = None, None
+        for key, entry in self._entries.items():
+            if not entry.dirty:
+                continue
+            ready_in = max(
+                entry.last_edit + self.interval - now,
+                self.limiter.delay(entry.message.chat_id, 'progress')
+            )
+            if ready_in <= 0:
+                if selected is None or entry.last_edit < selected[1].last_edit:
+                    selected = (key, entry)
+            elif wait is None or ready_in < wait:
+                wait = ready_in
+        return selected, wait
+
+    async def _render_loop(self) -> None:
+        loop = asyncio.get_event_loop()
+        while self._entries:
+            selected, wait = self._next_entry(loop.time())
+            if selected is None:
+                self._pending.clear()
+                try:
+                    await asyncio.wait_for(self._pending.wait(), timeout=wait or self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            key, entry = selected
+            entry.idle.clear()
+            try:
+                async with self.limiter.limit(entry.message.chat_id, 'progress'):
+                    # המצב נקרא רק אחרי ההמתנה למגביל, כדי להציג את העדכני ביותר
+                    if self._entries.get(key) is not entry:
+                        continue
+                    entry.dirty = False
+                    entry.last_edit = loop.time()
+                    await entry.message.edit(entry.render(*entry.state), buttons=entry.buttons)
+            except Exception as e:
+                if "MESSAGE_NOT_MODIFIED" not in str(e):
+                    logger.debug(f"דילוג על עדכון התקדמות: {e}")
+            finally:
+                entry.idle.set()
@@ -1,85 +1,328 @@
+import time
+import heapq
+import asyncio
 import logging
-from collections import defaultdict
+from bisect import bisect_left, insort
+from collections import defaultdict, deque
+from itertools import count
+from config.settings import MAX_JOBS_PER_USER, SHORT_JOB_MAX_SIZE, SHORT_LANE_BURST, DISK_RECHECK_INTERVAL
+from utils.helpers import get_document_identity
+
+MB = 1024 * 1024
+
+class QueuedJob:
+    """רשומה קומפקטית של משימה בתור
+
+    התור לא מחזיק את אובייקט ההודעה המלא של Telethon - רק את המזהים
+    והגודל. ההודעה עצמה נטענת מחדש כשהמשימה מתחילה.
+    """
+
+    __slots__ = ('chat_id', 'message_id', 'user_id', 'document_id', 'size',
+                 'tag', 'seq', 'short', 'cancelled', 'enqueued_at')
+
+    def __init__(self, chat_id, message_id, user_id, document_id, size, tag, seq, short):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.document_id = document_id
+        self.size = size
+        self.tag = tag      # זמן הסיום הווירטואלי (WFQ) - קטן יותר מתוזמן קודם
+        self.seq = seq      # מספר סידורי, לשבירת שוויון לפי סדר ההגעה
+        self.short = short  # נכנס לנתיב העדיפות של הקבצים הקטנים
+        self.cancelled = False  # הוצא מהתור; יידלג כשיגיע לראש התור של המשתמש
+        self.enqueued_at = time.time()  # לציר הזמן של המשימה (זמן ההמתנה בתור)
+
+    @property
+    def id(self):
+        return self.message_id
+
+    @property
+    def lane(self) -> int:
+        return 0 if self.short else 1
+
+    def sort_key(self):
+        return (self.tag, self.seq)
 
 class QueueService:
-    def __init__(self):
-        self.upload_queue = []  # תור הקבצים
-        self.user_queue = []    # תור המשתמשים
-        self.queue_messages = {}  # שמירת הודעות התור לפי message_id
+    """תור הודעות עם חלוקה הוגנת בין משתמשים ועדיפות לקבצים קטנים
+
+    התזמון הוא WFQ (weighted fair queuing) לפי גודל הקובץ: כל משימה מקבלת
+    תג סיום וירטואלי = max(הזמן הווירטואלי, התג האחרון של המשתמש) + גודל/משקל,
+    ונבחרת המשימה עם התג הקטן ביותר. כך משתמש ששולח 30 קבצים מקבל את
+    אותו חלק כמו כל משתמש אחר, ולא חוסם אותם. קבצים עד SHORT_JOB_MAX_SIZE
+    נכנסים לנתיב עדיפות, שמקבל עד SHORT_LANE_BURST בחירות ברצף לפני שהנתיב
+    הרגיל מקבל תור. לכל משתמש יש עד MAX_JOBS_PER_USER משימות בעיבוד.
+
+    המבנים: מילון לפי מזהה הודעה, תור לכל משתמש ונתיב, ערימה של ראשי
+    התורים לכל נתיב ורשימה ממוינת של התגים לכל נתיב (לחישוב מיקום בחיפוש
+    בינארי). חישוב מיקום הוא O(log n). הוספה, שליפה וביטול הם O(n) במקרה
+    הגרוע: החיפוש ברשימה הממוינת בינארי, אבל ההכנסה וההוצאה ממנה מזיזות
+    את האיברים שאחריה. זו העתקת מצביעים אחת ב-C, זניחה בגודל תור
+    של בוט (אלפי משימות לכל היותר); תור גדול בהרבה יצטרך עץ סטטיסטי-סדר.
+    """
+
+    def __init__(self, rate_limiter=None, max_jobs_per_user: int = MAX_JOBS_PER_USER,
+                 short_job_max_size: int = SHORT_JOB_MAX_SIZE, short_lane_burst: int = SHORT_LANE_BURST,
+                 user_weights: dict = None):
+        self.rate_limiter = rate_limiter  # מגביל הקצב המשותף למחיקת הודעות התור
+        self.max_jobs_per_user = max_jobs_per_user
+        self.short_job_max_size = short_job_max_size
+        self.short_lane_burst = short_lane_burst
+        self.user_weights = user_weights or {}  # משקל לכל משתמש (ברירת מחדל 1)
+
+        self.upload_queue = {}  # משימות ממתינות לפי message_id
+        self.user_queue = {}    # משתמשים שיש להם קבצים בתור או בעיבוד, לפי סדר ההגעה (dict כקבוצה מסודרת)
+        self.queue_messages = {}  # הודעות "מיקומך בתור" לפי message_id
+        self.active_jobs = {}   # משימות שנמצאות בעיבוד לפי message_id
+        self._job_available = asyncio.Condition()  # התראה לעובדים על שינוי בתור
+
+        # לכל משתמש תור נפרד לכל נתיב, כך שקובץ קטן לא ממתין מאחורי סרט של אותו משתמש
+        self._user_lanes = defaultdict(lambda: (deque(), deque()))  # user_id -> (קטנים, רגילים)
+        self._waiting = defaultdict(int)    # משימות ממתינות (שלא בוטלו) לכל משתמש
+        self._in_flight = defaultdict(int)  # משימות בעיבוד לכל משתמש
+        self._lane_heads = ([], [])  # ערימה לכל נתיב של (tag, seq, user_id) - ראש התור של כל משתמש
+        self._lane_order = ([], [])  # (tag, seq) ממוינים של כל הממתינים בכל נתיב; הכנסה והוצאה O(n)
+        self._last_tag = {}  # התג האחרון שניתן לכל משתמש
+        self._virtual_time = 0.0
+        self._short_streak = 0  # בחירות רצופות מנתיב העדיפות
+        self._seq = count()
+
+    def _head(self, user_id, lane: int):
+        """המשימה הראשונה של המשתמש בנתיב, אחרי דילוג על משימות שבוטלו"""
+        queue = self._user_lanes[user_id][lane]
+        while queue and queue[0].cancelled:
+            queue.popleft()
+        return queue[0] if queue else None
+
+    def _push_head(self, user_id, lane: int) -> None:
+        """פרסום ראש התור של המשתמש בנתיב, אם מותר לו להתחיל משימה"""
+        if self._in_flight[user_id] >= self.max_jobs_per_user:
+            return
+        job = self._head(user_id, lane)
+        if job:
+            heapq.heappush(self._lane_heads[lane], (job.tag, job.seq, user_id))
+
+    def _push_user(self, user_id) -> None:
+        for lane in (0, 1):
+            self._push_head(user_id, lane)
 
     async def add_to_queue(self, message, queue_message=None):
         """הוספת הודעה לתור"""
         user_id = message.sender_id
-        
+
         # הוספת המשתמש לתור המשתמשים אם הוא לא נמצא בו
         if user_id not in self.user_queue:
-            self.user_queue.append(user_id)
-            position = len(self.user_queue)
-            logging.info(f"Added user {user_id} to queue. Position: {position}")
-        
-        # הוספת ההודעה לתור הקבצים
-        self.upload_queue.append(message)
-        logging.info(f"Added message {message.id} to queue for user {user_id}")
-        
+            self.user_queue[user_id] = None
+            logging.info(f"Added user {user_id} to queue. Position: {len(self.user_queue)}")
+
+        document_id, size = get_document_identity(message)
+        size = size or 0
+        weight = self.user_weights.get(user_id, 1)
+        tag = max(self._virtual_time, self._last_tag.get(user_id, 0.0)) + max(1.0, size / MB) / weight
+        self._last_tag[user_id] = tag
+        job = QueuedJob(
+            message.chat_id, message.id, user_id, document_id, size,
+            tag, next(self._seq), size <= self.short_job_max_size
+        )
+
+        queue = self._user_lanes[user_id][job.lane]
+        queue.append(job)
+        if self._head(user_id, job.lane) is job:
+            self._push_head(user_id, job.lane)
+        insort(self._lane_order[job.lane], job.sort_key())
+        self._waiting[user_id] += 1
+        self.upload_queue[message.id] = job
+        logging.info(
+            f"Added message {message.id} to queue for user {user_id} "
+            f"(tag={tag:.1f}, lane={'short' if job.short else 'normal'})"
+        )
+
         # שמירת הודעת התור אם יש
         if queue_message:
             self.queue_messages[message.id] = queue_message
-        
+
+        async with self._job_available:
+            self._job_available.notify()
+
         return len(self.user_queue)
 
-    def is_first_user(self, user_id):
-        """בדיקה אם המשתמש ראשון בתור"""
-        return len(self.user_queue) > 0 and self.user_queue[0] == user_id
+    def _unlist(self, job: QueuedJob) -> None:
+        """הוצאת משימה ממתינה מהאינדקסים (הרשומה בתור המשתמש מדולגת בהמשך)"""
+        del self.upload_queue[job.message_id]
+        order = self._lane_order[job.lane]
+        del order[bisect_left(order, job.sort_key())]
+        self._waiting[job.user_id] -= 1
+
+    def _valid_head(self, entry) -> bool:
+        """האם רשומה בערימה עדיין מתארת ראש תור של משתמש שמותר לו להתחיל"""
+        tag, seq, user_id = entry
+        if self._in_flight.get(user_id, 0) >= self.max_jobs_per_user:
+            return False
+        lanes = self._user_lanes.get(user_id)
+        if not lanes:
+            return False
+        return any(queue and queue[0].seq == seq and not queue[0].cancelled for queue in lanes)
+
+    def _peek_lane(self, lane: int):
+        """ראש הנתיב (אחרי ניקוי רשומות שכבר לא תקפות), או None"""
+        heap = self._lane_heads[lane]
+        while heap and not self._valid_head(heap[0]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _pop_next_job(self, can_start=None):
+        """שליפת המשימה הבאה לפי הנתיבים ותגי הסיום
+
+        Args:
+            can_start: פונקציה שמקבלת את הרשומה ומחליטה אם אפשר להתחיל אותה עכשיו.
+                אם לא - המשימה נשארת במקומה בראש התור (וגם משימות אחריה ממתינות,
+                כדי שקובץ גדול לא יידחה לתמיד על ידי קבצים קטנים).
+        """
+        short_head, normal_head = self._peek_lane(0), self._peek_lane(1)
+        if short_head and (normal_head is None or self._short_streak < self.short_lane_burst):
+            lane, head = 0, short_head
+        elif normal_head:
+            lane, head = 1, normal_head
+        else:
+            return None
+
+        tag, _, user_id = head
+        if can_start and not can_start(self._user_lanes[user_id][lane][0]):
+            return None
+        self._short_streak = self._short_streak + 1 if lane == 0 else 0
+
+        heapq.heappop(self._lane_heads[lane])
+        job = self._user_lanes[user_id][lane].popleft()
+        self._unlist(job)
+        self._virtual_time = max(self._virtual_time, tag)
+        self._in_flight[user_id] += 1
+        self.active_jobs[job.message_id] = job
+        # ראש התור החדש של המשתמש (אם עוד מותר לו להתחיל משימות)
+        self._push_head(user_id, lane)
+        return job
+
+    async def get_next_job(self, can_start=None, recheck_interval: float = DISK_RECHECK_INTERVAL) -> QueuedJob:
+        """המתנה למשימה הבאה בתור והעברתה לעיבוד
+
+        Args:
+            can_start: תנאי נוסף להתחלת משימה (למשל מקום בדיסק); כל עוד הוא לא
+                מתקיים המשימה נשארת בתור, והתנאי נבדק שוב בכל שינוי בתור או
+                כל recheck_interval שניות
+
+        Returns:
+            QueuedJob: רשומת המשימה; את ההודעה עצמה צריך לטעון מחדש
+        """
+        async with self._job_available:
+            while True:
+                job = self._pop_next_job(can_start)
+                if job:
+                    logging.info(f"Message {job.message_id} moved to processing")
+                    return job
+                if can_start and self.upload_queue:
+                    try:
+                        await asyncio.wait_for(self._job_available.wait(), recheck_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._job_available.wait()
 
     def is_first_in_queue(self, message_id):
-        """בדיקה אם ההודעה ראשונה בתור הקבצים"""
-        return len(self.upload_queue) > 0 and self.upload_queue[0].id == message_id
-
-    def get_user_position(self, user_id):
-        """קבלת מיקום המשתמש בתור"""
-        try:
-            return self.user_queue.index(user_id) + 1
-        except ValueError:
+        """בדיקה אם ההודעה הבאה שתתוזמן"""
+        return self.get_message_position(message_id) == 1
+
+    def get_message_position(self, message_id):
+        """קבלת מיקום ההודעה בסדר התזמון בין הקבצים הממתינים
+
+        המיקום מחושב לפי התגים ושילוב הנתיבים; הגבלת המשימות לכל משתמש
+        יכולה להזיז אותו מעט.
+        """
+        job = self.upload_queue.get(message_id)
+        if job is None:
             return None
+        ahead = bisect_left(self._lane_order[job.lane], job.sort_key())
+        other_lane = len(self._lane_order[1 - job.lane])
+        burst = self.short_lane_burst
+        if job.short:
+            # אחרי כל burst קבצים קטנים נכנס קובץ רגיל אחד
+            return ahead + min(other_lane, ahead // burst) + 1
+        return ahead + min(other_lane, (ahead + 1) * burst) + 1
+
+    async def _delete_queue_message(self, queue_message):
+        """מחיקת הודעת "מיקומך בתור" (דרך מגביל הקצב, אם הוגדר)"""
+        if self.rate_limiter is None:
+            await queue_message.delete()
+        else:
+            await self.rate_limiter.call(queue_message.chat_id, 'delete', queue_message.delete)
+
+    def _discard_waiting(self, message_id) -> bool:
+        """ביטול משימה ממתינה (O(1) - היא מסומנת ומדולגת כשתגיע לראש התור)"""
+        job = self.upload_queue.get(message_id)
+        if job is None:
+            return False
+        was_head = self._head(job.user_id, job.lane) is job
+        self._unlist(job)
+        job.cancelled = True
+        if was_head:
+            self._push_head(job.user_id, job.lane)
+        return True
+
+    def _forget_user_if_idle(self, user_id) -> None:
+        if not self._in_flight.get(user_id) and not self._waiting.get(user_id):
+            self._user_lanes.pop(user_id, None)
+            self._in_flight.pop(user_id, None)
+            self._waiting.pop(user_id, None)
+            self._last_tag.pop(user_id, None)
+            if user_id in self.user_queue:
+                del self.user_queue[user_id]
+                logging.info(f"Removed user {user_id} from queue - no more files")
 
     async def remove_from_queue(self, message_id, user_id):
         """הסרת הודעה מהתור"""
         # מחיקת הודעת התור אם קיימת
         if message_id in self.queue_messages:
             try:
-                await self.queue_messages[message_id].delete()
+                await self._delete_queue_message(self.queue_messages[message_id])
                 del self.queue_messages[message_id]
                 logging.info(f"Deleted queue message for message {message_id}")
             except Exception as e:
                 logging.warning(f"Failed to delete queue message: {e}")
-        
-        # הסרת ההודעה מתור הקבצים
-        self.upload_queue = [msg for msg in self.upload_queue if msg.id != message_id]
-        
-        # בדיקה אם למשתמש יש עוד קבצים בתור
-        user_has_more_files = any(msg.sender_id == user_id for msg in self.upload_queue)
-        if not user_has_more_files and user_id in self.user_queue:
-            self.user_queue.remove(user_id)
-            logging.info(f"Removed user {user_id} from queue - no more files")
-        
+
+        # הסרת ההודעה מתור הקבצים או מהמשימות הפעילות
+        if not self._discard_waiting(message_id) and self.active_jobs.pop(message_id, None) is not None:
+            self._in_flight[user_id] -= 1
+            # התפנה מקום למשימה נוספת של המשתמש
+            self._push_user(user_id)
+
+        self._forget_user_if_idle(user_id)
         logging.info(f"Removed message {message_id} from queue")
 
+        async with self._job_available:
+            self._job_available.notify_all()
+
     async def cancel_user_downloads(self, user_id):
-        """ביטול כל ההורדות של משתמש מסוים"""
-        messages_to_remove = []
-        for msg in self.upload_queue:
-            if msg.sender_id == user_id:
-                if msg.id in self.queue_messages:
-                    try:
-                        await self.queue_messages[msg.id].delete()
-                        del self.queue_messages[msg.id]
-                    except Exception as e:
-                        logging.warning(f"Failed to delete queue message: {e}")
-                messages_to_remove.append(msg)
-        
-        for msg in messages_to_remove:
-            self.upload_queue.remove(msg)
-        
-        if user_id in self.user_queue:
-            self.user_queue.remove(user_id)
-            logging.info(f"Removed user {user_id} and all their files from queue")
+        """ביטול כל ההורדות הממתינות של משתמש מסוים
+
+        Returns:
+            list: המשימות שהוצאו מהתור
+        """
+        lanes = self._user_lanes.get(user_id)
+        if not lanes:
+            return []
+        # קודם מוציאים מהתור (בלי await), ורק אחר כך מוחקים את הודעות התור
+        cancelled = [job for queue in lanes for job in queue if not job.cancelled]
+        for queue in lanes:
+            queue.clear()
+        for job in cancelled:
+            self._unlist(job)
+            job.cancelled = True
+
+        for job in cancelled:
+            if job.message_id in self.queue_messages:
+                try:
+                    await self._delete_queue_message(self.queue_messages.pop(job.message_id))
+                except Exception as e:
+                    logging.warning(f"Failed to delete queue message: {e}")
+
+        self._forget_user_if_idle(user_id)
+        logging.info(f"Removed all waiting files of user {user_id} from queue")
+        return cancelled
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import logging
+import logging.handlers
+from collections import deque
+from contextlib import contextmanager
+from config.settings import TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUPS, STATS_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# סדר השלבים בדיווח (שלבים אחרים מופיעים אחריהם)
+SPAN_ORDER = ('wait', 'download', 'probe', 'convert', 'thumbnail', 'upload_user', 'upload_group', 'cleanup')
+
+class JobTrace:
+    """ציר הזמן של משימה אחת: רשימת קטעים (span) ונתונים על המשימה"""
+
+    def __init__(self, service, key, user_id: int, enqueued_at: float = None):
+        self.service = service
+        self.key = key
+        self.user_id = user_id
+        self.started_at = enqueued_at or time.time()
+        self.spans = []
+        self.attrs = {}
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        """רישום קטע שהזמנים שלו (time.time) כבר ידועים"""
+        self.spans.append({
+            'name': name,
+            'start': round(start - self.started_at, 3),
+            'duration': round(end - start, 3),
+        })
+        self.service.observe(name, end - start)
+
+    @contextmanager
+    def span(self, name: str):
+        """מדידת קטע של המשימה (נרשם גם כשהקטע נכשל)"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.time())
+
+    def set(self, **attrs) -> None:
+        """נתונים על המשימה: בתים, מסלול ההמרה וכו'"""
+        self.attrs.update(attrs)
+
+    def to_dict(self, outcome: str) -> dict:
+        chat_id, message_id = self.key
+        return {
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'user_id': self.user_id,
+            'started_at': round(self.started_at, 3),
+            'total': round(time.time() - self.started_at, 3),
+            'outcome': outcome,
+            'spans': self.spans,
+            **self.attrs,
+        }
+
+class TraceService:
+    """רישום צירי הזמן של המשימות לקובץ JSONL מתחלף, וסיכום אחוזונים לכל שלב
+
+    כל משימה שמסתיימת נכתבת כשורת JSON אחת. משכי השלבים נשמרים גם בזיכרון
+    לחלון זמן נע (STATS_WINDOW), כדי ש-/stats יראה איזה שלב מאט את הבוט.
+    """
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_MAX_BYTES,
+                 backups: int = TRACE_BACKUPS, window: float = STATS_WINDOW, on_span=None):
+        """אתחול השירות
+
+        Args:
+            path: קובץ ה-JSONL
+            max_bytes: גודל הקובץ שאחריו הוא מתחלף
+            backups: כמה קבצים ישנים לשמור
+            window: אורך החלון לסיכום, בשניות
+            on_span: פונקציה שמקבלת (שם, משך) לכל קטע שמסתיים (למשל היסטוגרמה)
+        """
+        self.window = window
+        self.on_span = on_span
+        self._samples = deque()  # (זמן סיום, שם הקטע, משך)
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # לוגר לכל קובץ: מופע עם נתיב אחר (בדיקת ביצועים, בדיקות) כותב לקובץ שלו,
+        # ושני מופעים על אותו קובץ חולקים handler אחד שמחליף אותו
+        self._writer = logging.getLogger(f"{__name__}.file:{path}")
+        self._writer.propagate = False
+        self._writer.setLevel(logging.INFO)
+        if not self._writer.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._writer.addHandler(handler)
+
+    def start(self, key, user_id: int, enqueued_at: float = None) -> JobTrace:
+        return JobTrace(self, key, user_id, enqueued_at)
+
+    def observe(self, name: str, duration: float) -> None:
+        now = time.time()
+        self._samples.append((now, name, duration))
+        self._expire(now)
+        if self.on_span:
+            self.on_span(name, duration)
+
+    def finish(self, trace: JobTrace, outcome: str) -> None:
+        """כתיבת ציר הזמן של משימה שיצאה מהצינור"""
+        try:
+            self._writer.info(json.dumps(trace.to_dict(outcome), ensure_ascii=False))
+        except Exception as e:
+            logger.error(f"שגיאה בכתיבת ציר הזמן של משימה {trace.key}: {e}")
+
+    def _expire(self, now: float) -> None:
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+    def summary(self) -> dict:
+        """אחוזונים לכל שלב בחלון הזמן
+
+        Returns:
+            dict: שם השלב -> {'count', 'p50', 'p95', 'p99'} בשניות, לפי סדר השלבים
+        """
+        self._expire(time.time())
+        durations = {}
+        for _, name, duration in self._samples:
+            durations.setdefault(name, []).append(duration)
+
+        order = {name: index for index, name in enumerate(SPAN_ORDER)}
+        result = {}
+        for name in sorted(durations, key=lambda name: (order.get(name, len(order)), name)):
+            values = sorted(durations[name])
+            result[name] = {
+                'count': len(values),
+                **{f'p{q}': _percentile(values, q) for q in (50, 95, 99)},
+            }
+        return result
+
+def _percentile(values: list, q: float) -> float:
+    """אחוזון לפי השיטה של nearest-rank, על רשימה ממוינת"""
+    index = max(0, min(len(values) - 1, int(-(-q * len(values) // 100)) - 1))
+    return values[index]
@@ -0,0 +1,362 @@
+import os
+import json
+import math
+import random
+import asyncio
+import logging
+from telethon import helpers, utils
+from telethon.errors import ServerError
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest, SaveFilePartRequest, SaveBigFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+from config.settings import (
+    PARALLEL_CONNECTIONS, DOWNLOAD_PART_SIZE, PARALLEL_TRANSFER_MIN_SIZE,
+    DOWNLOAD_RETRIES, DOWNLOAD_RETRY_DELAY, DOWNLOAD_RETRY_MAX_DELAY
+)
+from utils.helpers import get_document_identity
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SUFFIX = '.parts'
+# שגיאות רשת שאחריהן ממשיכים את ההורדה מאותה נקודה
+RETRYABLE_ERRORS = (ConnectionError, TimeoutError, asyncio.TimeoutError, ServerError)
+
+class DownloadCheckpoint:
+    """רישום החלקים שכבר נכתבו לקובץ, בקובץ צד (file_path + .parts)
+
+    השורה הראשונה מזהה את ההורדה (מסמך, גודל וגודל חלק), וכל שורה אחריה
+    היא מספר של חלק שנכתב במלואו. הרישום נעשה אחרי הכתיבה לקובץ, כך שחלק
+    שרשום תמיד נמצא בקובץ.
+    """
+
+    def __init__(self, file_path: str, identity: dict):
+        self.file_path = file_path
+        self.path = file_path + CHECKPOINT_SUFFIX
+        self.identity = identity
+        self._file = None
+
+    def load(self) -> set:
+        """החלקים שכבר הורדו, אם קיים רישום של אותה הורדה בדיוק"""
+        if not os.path.exists(self.path) or not os.path.exists(self.file_path):
+            return set()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                if json.loads(file.readline()) != self.identity:
+                    return set()
+                return {int(line) for line in file if line.strip().isdigit()}
+        except (OSError, ValueError) as e:
+            logger.warning(f"נקודת ההמשך {self.path} לא קריאה, מתחיל מההתחלה: {e}")
+            return set()
+
+    def open(self, done: set) -> None:
+        """פתיחת הרישום לכתיבה, מחדש, עם החלקים שכבר קיימים"""
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write(json.dumps(self.identity) + '\n')
+        self._file.writelines(f"{part}\n" for part in sorted(done))
+        self._file.flush()
+
+    def mark(self, part: int) -> None:
+        self._file.write(f"{part}\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def discard(self) -> None:
+        """מחיקת הרישום (ההורדה הסתיימה או ננטשה)"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class TransferService:
+    """העברת קבצים גדולים במקביל על גבי כמה חיבורי MTProto
+
+    ההורדה וההעלאה הרגילות של Telethon מעבירות חלק אחד בכל פעם על חיבור
+    יחיד, ולכן מוגבלות על ידי זמן התגובה ולא על ידי רוחב הפס. כאן כל חיבור
+    מעביר חלקים אחרים של הקובץ: בהורדה כל חלק נכתב למקומו בקובץ שהוקצה
+    מראש, ובהעלאה כל חלק נקרא מהמקום שלו ונשלח בנפרד.
+    """
+
+    def __init__(self, client, connections: int = PARALLEL_CONNECTIONS,
+                 part_size: int = DOWNLOAD_PART_SIZE):
+        """אתחול שירות ההעברות
+
+        Args:
+            client: לקוח Telethon מחובר
+            connections: מספר החיבורים המקבילים לכל קובץ
+            part_size: גודל חלק בהורדה (חזקה של 2 בין 4KB ל-1MB, כדרישת טלגרם)
+        """
+        if part_size % 4096 or (1024 * 1024) % part_size:
+            raise ValueError(f"גודל חלק לא חוקי: {part_size}")
+        self.client = client
+        self.connections = connections
+        self.part_size = part_size
+        self._auth_keys = {}  # מפתחות הרשאה שיוצאו ל-DC אחרים, לשימוש חוזר
+
+    async def _create_sender(self, dc_id: int) -> MTProtoSender:
+        """יצירת חיבור MTProto נוסף ל-DC שבו נמצא הקובץ"""
+        dc = await self.client._get_dc(dc_id)
+        if dc_id == self.client.session.dc_id:
+            auth_key = self.client.session.auth_key
+        else:
+            auth_key = self._auth_keys.get(dc_id)
+
+        sender = MTProtoSender(auth_key, loggers=self.client._log)
+        await sender.connect(self.client._connection(
+            dc.ip_address, dc.port, dc.id,
+            loggers=self.client._log,
+            proxy=self.client._proxy
+        ))
+
+        if not auth_key:
+            # DC אחר - מייצאים את ההרשאה מהחיבור הראשי ומייבאים אותה בחיבור החדש
+            try:
+                auth = await self.client(ExportAuthorizationRequest(dc_id))
+                self.client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+                await sender.send(InvokeWithLayerRequest(LAYER, self.client._init_request))
+            except BaseException:
+                await sender.disconnect()
+                raise
+            self._auth_keys[dc_id] = sender.auth_key
+        return sender
+
+    async def _create_senders(self, dc_id: int, count: int) -> list:
+        """פתיחת count חיבורים; אם אחד נכשל, אלה שכבר נפתחו נסגרים"""
+        # הראשון לבד, כדי שהחיבורים הבאים ישתמשו במפתח שכבר יוצא
+        first = await self._create_sender(dc_id)
+        results = await asyncio.gather(
+            *(self._create_sender(dc_id) for _ in range(count - 1)), return_exceptions=True
+        )
+        senders = [first] + [result for result in results if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+            raise errors[0]
+        return senders
+
+    async def _run_workers(self, senders: list, work) -> None:
+        """הרצת עובד לכל חיבור; שגיאה או ביטול באחד עוצרים את כולם"""
+        tasks = [asyncio.create_task(work(sender)) for sender in senders]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+
+    def _part_length(self, part: int, file_size: int) -> int:
+        return min(self.part_size, file_size - part * self.part_size)
+
+    def _prepare_file(self, file_path: str, file_size: int, done: set) -> int:
+        """הכנת הקובץ להורדה; קובץ חדש מוקצה מראש בגודל המלא
+
+        Returns:
+            int: כמה בתים כבר נמצאים בקובץ מהורדה קודמת
+        """
+        if not done:
+            with open(file_path, 'wb') as file:
+                file.truncate(file_size)
+            return 0
+        return sum(self._part_length(part, file_size) for part in done)
+
+    async def _download_parallel(self, media, file_path: str, file_size: int,
+                                 checkpoint: DownloadCheckpoint, progress_callback=None) -> None:
+        """הורדת הקובץ בחלקים במקביל לתוך קובץ שהוקצה מראש
+
+        חלקים שכבר רשומים בנקודת ההמשך לא מורדים שוב.
+        """
+        dc_id, location = utils.get_input_location(media)
+        part_count = math.ceil(file_size / self.part_size)
+        done = checkpoint.load()
+        downloaded = self._prepare_file(file_path, file_size, done)
+        remaining = [part for part in range(part_count) if part not in done]
+        if done:
+            logger.info(f"ממשיך הורדה של {file_path}: {len(done)}/{part_count} חלקים כבר קיימים")
+        connections = max(1, min(self.connections, len(remaining)))
+        parts = iter(remaining)
+
+        checkpoint.open(done)
+        try:
+            # הקובץ נפתח לפני החיבורים, כך ששגיאה בפתיחה לא משאירה חיבורים פתוחים
+            with open(file_path, 'r+b') as file:
+                senders = await self._create_senders(dc_id, connections)
+
+                async def worker(sender):
+                    nonlocal downloaded
+                    for part in parts:
+                        offset = part * self.part_size
+                        result = await self.client._call(
+                            sender, GetFileRequest(location, offset=offset, limit=self.part_size)
+                        )
+                        if len(result.bytes) != self._part_length(part, file_size):
+                            raise ConnectionError(f"חלק {part} הגיע חלקי ({len(result.bytes)} בתים)")
+                        # בלי await בין seek ל-write, כך שהעובדים לא מתערבבים
+                        file.seek(offset)
+                        file.write(result.bytes)
+                        checkpoint.mark(part)
+                        downloaded += len(result.bytes)
+                        if progress_callback:
+                            await progress_callback(downloaded, file_size)
+
+                await self._run_workers(senders, worker)
+        finally:
+            checkpoint.close()
+
+        if downloaded != file_size:
+            raise ConnectionError(f"הורדו {downloaded} מתוך {file_size} בתים")
+
+    async def _download_sequential(self, media, file_path: str, file_size: int,
+                                   checkpoint: DownloadCheckpoint, progress_callback=None) -> None:
+        """הורדה רציפה על החיבור הראשי, מהחלק הרציף הראשון שעוד לא הורד"""
+        done = checkpoint.load()
+        part = 0
+        while part in done:
+            part += 1
+        if part:
+            logger.info(f"ממשיך הורדה רציפה של {file_path} מבית {part * self.part_size}")
+        # ממשיכים רק מהרצף הראשון, ולכן הרישום נבנה מחדש רק ממנו
+        done = set(range(part))
+        downloaded = self._prepare_file(file_path, file_size, done)
+
+        checkpoint.open(done)
+        try:
+            with open(file_path, 'r+b') as file:
+                file.seek(downloaded)
+                async for chunk in self.client.iter_download(
+                    media, offset=downloaded, request_size=self.part_size, file_size=file_size
+                ):
+                    file.write(chunk)
+                    checkpoint.mark(part)
+                    part += 1
+                    downloaded += len(chunk)
+                    if progress_callback:
+                        await progress_callback(downloaded, file_size)
+        finally:
+            checkpoint.close()
+
+        if downloaded != file_size:
+            raise ConnectionError(f"הורדו {downloaded} מתוך {file_size} בתים")
+
+    async def download(self, message, file_path: str, progress_callback=None,
+                       retries: int = DOWNLOAD_RETRIES) -> None:
+        """הורדת המדיה של הודעה לקובץ
+
+        קבצים גדולים מורדים במקביל, וקבצים קטנים ברצף. אחרי שגיאת רשת ההורדה
+        ממשיכה מהחלקים שכבר נכתבו, עם המתנה הולכת וגדלה, עד retries ניסיונות
+        חוזרים. שגיאה אחרת בהורדה המקבילית עוברת להורדה רציפה. הקובץ החלקי
+        ונקודת ההמשך נשארים על הדיסק כשההורדה נכשלת - ראה discard_partial.
+        """
+        file_size = message.file.size if message.file else 0
+        if not file_size:
+            await message.download_media(file=file_path, progress_callback=progress_callback)
+            return
+
+        document_id, _ = get_document_identity(message)
+        checkpoint = DownloadCheckpoint(file_path, {
+            'document_id': document_id, 'size': file_size, 'part_size': self.part_size
+        })
+        parallel = file_size >= PARALLEL_TRANSFER_MIN_SIZE and self.connections > 1
+
+        for attempt in range(retries + 1):
+            try:
+                if parallel:
+                    try:
+                        await self._download_parallel(
+                            message.media, file_path, file_size, checkpoint, progress_callback
+                        )
+                    except RETRYABLE_ERRORS:
+                        raise
+                    except Exception as e:
+                        logger.warning(f"ההורדה המקבילית נכשלה, עובר להורדה רציפה: {e}")
+                        parallel = False
+                        checkpoint.discard()
+                        await self._download_sequential(
+                            message.media, file_path, file_size, checkpoint, progress_callback
+                        )
+                else:
+                    await self._download_sequential(
+                        message.media, file_path, file_size, checkpoint, progress_callback
+                    )
+                checkpoint.discard()
+                return
+            except RETRYABLE_ERRORS as e:
+                if attempt == retries:
+                    raise
+                delay = min(DOWNLOAD_RETRY_MAX_DELAY, DOWNLOAD_RETRY_DELAY * 2 ** attempt)
+                delay *= random.uniform(0.8, 1.2)
+                logger.warning(
+                    f"שגיאת רשת בהורדת {file_path} ({e}), "
+                    f"ממשיך מנקודת ההמשך בעוד {delay:.1f} שניות (ניסיון {attempt + 1}/{retries})"
+                )
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def discard_partial(file_path: str) -> None:
+        """מחיקת קובץ חלקי ונקודת ההמשך שלו (אחרי ביטול או כישלון סופי)"""
+        for path in (file_path, file_path + CHECKPOINT_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info(f"נמחק קובץ חלקי: {path}")
+
+    async def _upload_parallel(self, file_path: str, progress_callback=None):
+        """העלאת חלקי הקובץ במקביל ל-DC הבית
+
+        Returns:
+            InputFile או InputFileBig שאפשר להעביר ל-send_file
+        """
+        file_size = os.path.getsize(file_path)
+        part_size = utils.get_appropriated_part_size(file_size) * 1024
+        part_count = math.ceil(file_size / part_size)
+        is_big = file_size > 10 * 1024 * 1024  # מעל 10MB טלגרם דורש SaveBigFilePart
+        file_id = helpers.generate_random_long()
+        connections = max(1, min(self.connections, part_count))
+        parts = iter(range(part_count))
+        uploaded = 0
+
+        with open(file_path, 'rb') as file:
+            senders = await self._create_senders(self.client.session.dc_id, connections)
+
+            async def worker(sender):
+                nonlocal uploaded
+                for part in parts:
+                    file.seek(part * part_size)
+                    data = file.read(part_size)
+                    if is_big:
+                        request = SaveBigFilePartRequest(file_id, part, part_count, data)
+                    else:
+                        request = SaveFilePartRequest(file_id, part, data)
+                    if not await self.client._call(sender, request):
+                        raise ConnectionError(f"העלאת חלק {part} נכשלה")
+                    uploaded += len(data)
+                    if progress_callback:
+                        await progress_callback(uploaded, file_size)
+
+            await self._run_workers(senders, worker)
+
+        name = os.path.basename(file_path)
+        if is_big:
+            return InputFileBig(file_id, part_count, name)
+        return InputFile(file_id, part_count, name, md5_checksum='')
+
+    async def upload(self, file_path: str, progress_callback=None):
+        """העלאת קובץ לטלגרם והחזרת ה-InputFile שלו לשימוש ב-send_file
+
+        קבצים גדולים מועלים במקביל, וגודל החלק נבחר לפי גודל הקובץ. קבצים
+        קטנים, או כל שגיאה בהעלאה המקבילית (חוץ מביטול), עוברים להעלאה
+        הרציפה של Telethon.
+        """
+        if os.path.getsize(file_path) >= PARALLEL_TRANSFER_MIN_SIZE and self.connections > 1:
+            try:
+                return await self._upload_parallel(file_path, progress_callback)
+            except Exception as e:
+                logger.warning(f"ההעלאה המקבילית נכשלה, עובר להעלאה רציפה: {e}")
+
+        return await self.client.upload_file(file_path, progress_callback=progress_callback)
@@ -1,26 +1,394 @@
 import os
+import time
 import logging
 import asyncio
 from collections import defaultdict
-from moviepy.editor import VideoFileClip
-from config.settings import TARGET_GROUP_ID
-from utils.helpers import clean_filename, get_video_caption, wait_for_file_release, wait_and_delete, get_file_name
+from config.settings import (
+    TARGET_GROUP_ID, MAX_CONCURRENT_DOWNLOADS, MAX_CONCURRENT_CONVERSIONS,
+    MAX_CONCURRENT_UPLOADS, PIPELINE_QUEUE_SIZE, DEDUP_BY_NAME, CONTENT_HASH_DEDUP,
+    STREAMING_TRANSCODE, PROGRESS_EDITS_PER_MINUTE, JOBS_DB, SWEEP_ORPHANS_ON_START
+)
+from utils.helpers import (
+    clean_filename, get_video_caption, get_file_name, get_document_identity, format_duration
+)
 from utils.rate_limiter import RateLimiter
-from services.file_service import check_existing_file, save_file_id, convert_to_mp4, create_thumbnail
+from services.file_service import (
+    check_existing_file, save_file_id, convert_to_mp4, create_thumbnail, probe_video,
+    compute_file_hash, stream_to_mp4, needs_video_encode, STREAMABLE_EXTENSIONS
+)
 from services.queue_service import QueueService
+from services.pipeline_service import Pipeline, PipelineStage
+from services.transfer_service import TransferService
+from services.progress_service import ProgressService
+from services.job_store import JobStore
+from services.disk_space_service import DiskSpaceService
+from services.workspace_service import WorkspaceManager
+from services.metrics_service import MetricsService
+from services.trace_service import TraceService
 from telethon.tl.custom import Button
 from telethon.tl.types import DocumentAttributeVideo
 
+class UserCancelledError(asyncio.CancelledError):
+    """ביטול שנעשה על ידי המשתמש (להבדיל מביטול של משימת העובד עצמה)"""
+
+class VideoJob:
+    """מצב של משימת וידאו אחת לאורך שלבי הצינור"""
+
+    def __init__(self, message):
+        self.message = message
+        self.chat_id = message.chat_id
+        self.user_id = message.sender_id
+        self.key = (self.chat_id, message.id)  # מזהה המשימה ביומן ובשמירת המקום בדיסק
+        self.clean_file_name = clean_filename(get_file_name(message))
+        self.document_id, self.size = get_document_identity(message)
+        self.content_hash = None  # גיבוב התוכן (רק אם CONTENT_HASH_DEDUP פעיל)
+        self.file_path = None    # הקובץ שהורד
+        self.video_data = None   # תוצאת העיבוד לקראת ההעלאה
+        self.workspace = None    # תיקיית העבודה של המשימה (נפתחת כשהמשימה נכנסת לצינור)
+        self.trace = None        # ציר הזמן של המשימה
+        self.outcome = 'failed'  # איך המשימה יצאה מהצינור (נרשם בציר הזמן)
+
 class VideoService:
     def __init__(self, client, download_path):
         self.client = client
         self.download_path = download_path
-        self.queue_service = QueueService()
+        self.transfer_service = TransferService(client)
+        self.job_store = JobStore(JOBS_DB)
+        self.disk_space = DiskSpaceService(download_path)
+        self.workspaces = WorkspaceManager(download_path)
+        self._recovered = {}  # (chat_id, message_id) -> תוצרים של משימה שהתחילה לפני הפעלה מחדש
         self.active_downloads = defaultdict(asyncio.Event)
         self.active_uploads = defaultdict(asyncio.Event)  # מעקב אחר העלאות פעילות
-        # מגבילי קצב להודעות
-        self.progress_limiter = RateLimiter(messages_per_minute=30, limiter_type="progress")
-        self.group_limiter = RateLimiter(messages_per_minute=20, limiter_type="group")
+        # מגביל קצב אחד לכל הפעולות מול טלגרם, עם דלי נפרד לכל צ'אט
+        self.rate_limiter = RateLimiter(
+            messages_per_minute=60,
+            limiter_type="telegram",
+            group_messages_per_minute=20,
+            class_budgets={'progress': PROGRESS_EDITS_PER_MINUTE}
+        )
+        self.queue_service = QueueService(self.rate_limiter)
+        # עריכות ההתקדמות רצות ברקע, כך שמגביל הקצב לא מעכב את ההעברות עצמן
+        self.progress_service = ProgressService(self.rate_limiter)
+        # צינור עיבוד: הורדה -> המרה -> העלאה, כל שלב עם עובדים משלו
+        self.pipeline = Pipeline([
+            PipelineStage("download", self._download_stage, MAX_CONCURRENT_DOWNLOADS,
+                          PIPELINE_QUEUE_SIZE, self._finish_job),
+            PipelineStage("convert", self._convert_stage, MAX_CONCURRENT_CONVERSIONS,
+                          PIPELINE_QUEUE_SIZE, self._finish_job),
+            PipelineStage("upload", self._upload_stage, MAX_CONCURRENT_UPLOADS,
+                          PIPELINE_QUEUE_SIZE, self._finish_job),
+        ])
+        self._dispatcher = None
+        self.conversion_progress = {}  # מצב ההמרה הנוכחי לכל הודעה (fps, מהירות, ETA)
+        self.metrics = MetricsService()
+        self._register_metrics()
+        # כל קטע בציר הזמן של משימה נספר גם בהיסטוגרמה של המדדים
+        self.traces = TraceService(on_span=lambda name, duration: self.stage_duration.observe(duration, stage=name))
+
+    def _register_metrics(self) -> None:
+        """הגדרת המדדים של הבוט; ערכים רגעיים נקראים מהשירותים בזמן הדגימה"""
+        self.stage_duration = self.metrics.histogram(
+            'bot_stage_duration_seconds', 'Duration of each processing step', ('stage',)
+        )
+        self.transfer_bytes = self.metrics.counter(
+            'bot_transfer_bytes_total', 'Bytes transferred from/to Telegram (rate() gives bytes/s)', ('direction',)
+        )
+        self.file_id_lookups = self.metrics.counter(
+            'bot_file_id_lookups_total', 'file_id cache lookups', ('lookup', 'result')
+        )
+
+        def queue_depth():
+            depths = {('queue',): len(self.queue_service.upload_queue)}
+            for stage in self.pipeline.occupancy():
+                depths[(stage['stage'],)] = stage['waiting']
+            return depths
+
+        def stage_jobs():
+            jobs = {}
+            for stage in self.pipeline.occupancy():
+                jobs[(stage['stage'], 'active')] = stage['active']
+                jobs[(stage['stage'], 'blocked')] = stage['blocked']
+            return jobs
+
+        self.metrics.gauge('bot_queue_depth', 'Jobs waiting before each stage', queue_depth, ('stage',))
+        self.metrics.gauge('bot_stage_jobs', 'Jobs inside each stage', stage_jobs, ('stage', 'state'))
+        self.metrics.gauge(
+            'bot_jobs_in_flight', 'Jobs inside the pipeline',
+            lambda: sum(s['active'] + s['blocked'] + s['waiting'] for s in self.pipeline.occupancy())
+        )
+        self.metrics.gauge(
+            'bot_rate_limiter_wait_seconds_total', 'Time requests spent waiting in the rate limiter',
+            lambda: self.rate_limiter.total_wait, kind='counter'
+        )
+        self.metrics.gauge(
+            'bot_flood_waits_total', 'FloodWait/SlowModeWait errors returned by Telegram',
+            lambda: self.rate_limiter.flood_waits, kind='counter'
+        )
+        self.metrics.gauge('bot_disk_free_bytes', 'Free space on the download disk',
+                           lambda: self.disk_space.free_bytes())
+        self.metrics.gauge('bot_disk_reserved_bytes', 'Disk space reserved for running jobs',
+                           lambda: self.disk_space.reserved_bytes)
+
+    async def start(self) -> None:
+        """הפעלת צינור העיבוד והמשימה שמזינה אותו מהתור"""
+        if self._dispatcher:
+            return
+        self.pipeline.start()
+        self._dispatcher = asyncio.create_task(self._dispatch_jobs())
+        logging.info(
+            f"צינור העיבוד הופעל "
+            f"(הורדות={MAX_CONCURRENT_DOWNLOADS}, המרות={MAX_CONCURRENT_CONVERSIONS}, "
+            f"העלאות={MAX_CONCURRENT_UPLOADS}, תור מסירה={PIPELINE_QUEUE_SIZE})"
+        )
+        if SWEEP_ORPHANS_ON_START:
+            # תיקיות וקבצים של משימות שעדיין ביומן נשמרים, כדי שיוכלו להמשיך
+            records = self.job_store.pending()
+            self.workspaces.sweep_orphans(
+                keep_keys=[(record['chat_id'], record['message_id']) for record in records],
+                keep_paths=self.job_store.file_paths()
+            )
+        await self._recover_jobs()
+
+    async def _recover_jobs(self) -> None:
+        """החזרת משימות שלא הסתיימו לפני הפעלה מחדש לתור
+
+        משימה שכבר הורדה או הומרה ממשיכה מהשלב הבא, כל עוד הקבצים שלה
+        עדיין על הדיסק; אחרת היא מתחילה מההורדה. משימה שכבר נמסרה רק
+        נמחקת מהיומן יחד עם הקבצים שלה.
+        """
+        records = self.job_store.pending()
+        if not records:
+            return
+        logging.info(f"נמצאו {len(records)} משימות שלא הסתיימו ביומן, מחזיר אותן לתור")
+
+        for record in records:
+            chat_id, message_id = record['chat_id'], record['message_id']
+            if record['stage'] == 'delivered':
+                # הקובץ כבר נשלח והבוט קרס לפני הניקוי - לא שולחים אותו שוב
+                logging.info(f"הודעה {message_id} כבר נמסרה, מוחק את השאריות שלה")
+                self.job_store.remove(chat_id, message_id)
+                self._discard_files((chat_id, message_id), record['file_path'], record['video_data'])
+                continue
+            try:
+                message = await self.client.get_messages(chat_id, ids=message_id)
+            except Exception as e:
+                logging.warning(f"לא ניתן לטעון את הודעה {message_id} מצ'אט {chat_id}: {e}")
+                message = None
+            if message is None or not message.media:
+                self.job_store.remove(chat_id, message_id)
+                continue
+
+            file_path = record['file_path']
+            if file_path and not os.path.exists(file_path):
+                file_path = None
+            video_data = record['video_data']
+            if video_data and not os.path.exists(video_data['file_path']):
+                video_data = None
+            if video_data and video_data.get('thumbnail_path') and not os.path.exists(video_data['thumbnail_path']):
+                video_data['thumbnail_path'] = None
+            self._recovered[(chat_id, message_id)] = (file_path, video_data, record['content_hash'])
+
+            await self.queue_service.add_to_queue(message)
+            stage = 'uploading' if video_data else 'converting' if file_path else 'queued'
+            logging.info(f"הודעה {message_id} חוזרת לתור (ממשיכה משלב {stage})")
+            try:
+                await self._reply(message, "🔄 הבוט הופעל מחדש - ממשיך בעיבוד הקובץ")
+            except Exception as e:
+                logging.debug(f"לא ניתן להודיע על המשך העיבוד: {e}")
+
+    def _discard_files(self, key, file_path: str = None, video_data: dict = None) -> None:
+        """מחיקת תיקיית המשימה והקבצים שנרשמו ביומן, למשימה שלא תמשיך"""
+        workspace = self.workspaces.open(key)
+        workspace.add(file_path)
+        for name in ('file_path', 'thumbnail_path', 'original_path'):
+            workspace.add((video_data or {}).get(name))
+        self.workspaces.close(key)
+
+    async def _dispatch_jobs(self) -> None:
+        """העברת משימות מהתור לשלב ההורדה כשיש בו מקום"""
+        while True:
+            # משימה נכנסת רק כשיש מספיק מקום בדיסק לקובץ המקור ולפלט שלו
+            queued = await self.queue_service.get_next_job(
+                can_start=lambda record: self.disk_space.can_admit(record.size)
+            )
+            self.disk_space.reserve((queued.chat_id, queued.message_id), queued.size)
+            # התור שומר רק מזהים; ההודעה המלאה נטענת רק כשהמשימה מתחילה
+            try:
+                message = await self.client.get_messages(queued.chat_id, ids=queued.message_id)
+            except Exception as e:
+                logging.warning(f"לא ניתן לטעון את הודעה {queued.message_id}: {e}")
+                message = None
+            if message is None or not message.media:
+                logging.info(f"הודעה {queued.message_id} כבר לא זמינה, מדלג עליה")
+                self.job_store.remove(queued.chat_id, queued.message_id)
+                self.disk_space.release((queued.chat_id, queued.message_id))
+                await self.queue_service.remove_from_queue(queued.message_id, queued.user_id)
+                continue
+
+            logging.info(f"הודעה {message.id} נכנסת לצינור העיבוד")
+            job = VideoJob(message)
+            try:
+                job.workspace = self.workspaces.open(job.key)
+                job.trace = self.traces.start(job.key, job.user_id, queued.enqueued_at)
+                job.trace.add_span('wait', queued.enqueued_at, time.time())
+                job.trace.set(source_bytes=job.size)
+                recovered = self._recovered.pop((job.chat_id, message.id), None)
+                if recovered:
+                    job.trace.set(recovered=True)
+                    job.file_path, job.video_data, job.content_hash = recovered
+                    # תוצרים מהרצה קודמת נמחקים עם המשימה, גם אם נוצרו מחוץ לתיקייה שלה
+                    job.workspace.add(job.file_path)
+                    for key in ('file_path', 'thumbnail_path', 'original_path'):
+                        job.workspace.add((job.video_data or {}).get(key))
+            except Exception as e:
+                # למשל דיסק מלא או הרשאות בתיקיית המשימות - מוותרים על המשימה הזו בלבד
+                logging.error(f"שגיאה בהכנת הודעה {message.id} לעיבוד: {e}")
+                self.workspaces.close(job.key)
+                self.job_store.remove(job.chat_id, message.id)
+                self.disk_space.release(job.key)
+                await self.queue_service.remove_from_queue(message.id, job.user_id)
+                try:
+                    await self._reply(message, "❌ שגיאה בהכנת הקובץ לעיבוד")
+                except Exception as reply_error:
+                    logging.debug(f"לא ניתן להודיע על השגיאה: {reply_error}")
+                continue
+            await self.pipeline.submit(job)
+
+    def get_pipeline_status(self) -> dict:
+        """תפוסת התור וכל שלבי הצינור"""
+        return {
+            'queued': len(self.queue_service.upload_queue),
+            'stages': self.pipeline.occupancy(),
+            'conversions': dict(self.conversion_progress),
+            'disk': self.disk_space.status(),
+        }
+
+    async def _run_stage(self, job: VideoJob, stage_coro):
+        """הרצת שלב אחד של משימה, כולל טיפול בביטול ובשגיאות
+
+        Returns:
+            תוצאת השלב, או None אם השלב נכשל או בוטל
+        """
+        try:
+            return await stage_coro
+        except UserCancelledError:
+            job.outcome = 'cancelled'
+            logging.info(f"העיבוד של הודעה {job.message.id} בוטל על ידי המשתמש")
+        except Exception as e:
+            logging.error(f"שגיאה בעיבוד הוידאו: {e}")
+            try:
+                await self._reply(job.message, "אירעה שגיאה בעיבוד הוידאו. אנא נסה שוב.")
+            except Exception:
+                pass
+        return None
+
+    async def _download_stage(self, job: VideoJob) -> bool:
+        """שלב ההורדה"""
+        if job.file_path or job.video_data:
+            logging.info(f"הודעה {job.message.id} כבר הורדה לפני ההפעלה מחדש")
+            self.disk_space.release(job.key, 'source')
+            return True
+
+        self.job_store.set_stage(job.chat_id, job.message.id, 'downloading')
+        download_message = await self._reply(job.message, "הקובץ התקבל\nאנא המתן...✅")
+        await self._delete_later(download_message)
+        with job.trace.span('download'):
+            job.file_path = await self._run_stage(
+                job, self._download_video(job.message, job.message.media, job.clean_file_name, job.workspace)
+            )
+        if job.file_path is None:
+            return False
+
+        # הגיבוב מחושב על קובץ המקור, ולכן לא על פלט של המרה תוך כדי הורדה
+        if CONTENT_HASH_DEDUP and os.path.basename(job.file_path) == job.clean_file_name:
+            # אותו תוכן שהגיע ממקור אחר (מסמך אחר בטלגרם) - אין צורך להמיר ולהעלות שוב
+            job.content_hash = await compute_file_hash(job.file_path)
+            existing_file_id = check_existing_file(None, content_hash=job.content_hash)
+            self.file_id_lookups.inc(lookup='content_hash', result='hit' if existing_file_id else 'miss')
+            if existing_file_id:
+                logging.info(f"נמצא קובץ זהה לפי גיבוב תוכן עבור הודעה {job.message.id}")
+                if await self._send_existing_video(job.message, existing_file_id, job.clean_file_name):
+                    save_file_id(None, existing_file_id, documents=((job.document_id, job.size),))
+                    job.outcome = 'duplicate'
+                job.workspace.release(job.file_path)
+                return False
+
+        self.job_store.set_stage(
+            job.chat_id, job.message.id, 'converting',
+            file_path=job.file_path, content_hash=job.content_hash
+        )
+        # המקור כבר על הדיסק ונספר במקום הפנוי שנמדד
+        self.disk_space.release(job.key, 'source')
+        return True
+
+    async def _convert_stage(self, job: VideoJob) -> bool:
+        """שלב ההמרה והתמונה הממוזערת"""
+        if job.video_data:
+            logging.info(f"הודעה {job.message.id} כבר הומרה לפני ההפעלה מחדש")
+            self.disk_space.release(job.key, 'output')
+            return True
+
+        job.video_data = await self._run_stage(
+            job, self._process_video(job.message, job.file_path, job.clean_file_name, job.workspace, job.trace)
+        )
+        if job.video_data is None:
+            return False
+        # המקור כבר לא נחוץ אחרי ההמרה - מפנים אותו עוד לפני ההעלאה
+        job.workspace.release(job.video_data.get('original_path'))
+        job.video_data['content_hash'] = job.content_hash
+        self.job_store.set_stage(job.chat_id, job.message.id, 'uploading', video_data=job.video_data)
+        self.disk_space.release(job.key, 'output')
+        return True
+
+    async def _upload_stage(self, job: VideoJob) -> bool:
+        """שלב ההעלאה למשתמש ולקבוצה"""
+        uploaded_paths = (job.video_data['file_path'], job.video_data.get('thumbnail_path'))
+        for path in uploaded_paths:
+            job.workspace.retain(path)
+        try:
+            if await self._run_stage(job, self._send_processed_video(job.message, job.video_data, job.trace)):
+                self.job_store.set_stage(job.chat_id, job.message.id, 'delivered')
+                job.outcome = 'delivered'
+        finally:
+            for path in uploaded_paths:
+                job.workspace.release(path)
+        return True
+
+    async def _finish_job(self, job: VideoJob) -> None:
+        """יציאת משימה מהצינור (בהצלחה או בכישלון)"""
+        with job.trace.span('cleanup'):
+            self.job_store.remove(job.chat_id, job.message.id)
+            self.disk_space.release(job.key)
+            # הקבצים נמחקים ברקע, גם כשהמשימה נכשלה או בוטלה באמצע
+            self.workspaces.close(job.key)
+            await self.queue_service.remove_from_queue(job.message.id, job.user_id)
+        self.traces.finish(job.trace, job.outcome)
+
+    async def _delete_later(self, message, delay: float = 3) -> None:
+        """מחיקת הודעת סטטוס ברקע, בלי לעכב את העובד"""
+        async def delete_after_delay():
+            await asyncio.sleep(delay)
+            try:
+                await self._delete(message)
+            except Exception as e:
+                logging.debug(f"לא ניתן למחוק הודעה: {e}")
+        asyncio.create_task(delete_after_delay())
+
+    async def _reply(self, message, text, **kwargs):
+        """תשובה להודעה דרך מגביל הקצב של הצ'אט"""
+        return await self.rate_limiter.call(message.chat_id, 'send', message.reply, text, **kwargs)
+
+    async def _edit(self, message, text, **kwargs):
+        """עריכת הודעה דרך מגביל הקצב של הצ'אט"""
+        return await self.rate_limiter.call(message.chat_id, 'edit', message.edit, text, **kwargs)
+
+    async def _delete(self, message):
+        """מחיקת הודעה דרך מגביל הקצב של הצ'אט"""
+        return await self.rate_limiter.call(message.chat_id, 'delete', message.delete)
+
+    async def _send_file(self, chat_id, file, **kwargs):
+        """שליחת קובץ דרך מגביל הקצב של הצ'אט"""
+        return await self.rate_limiter.call(chat_id, 'send', self.client.send_file, chat_id, file, **kwargs)
 
     async def cancel_download(self, user_id: int) -> None:
         """ביטול הורדה של משתמש"""
@@ -28,11 +396,14 @@ class VideoService:
             self.active_downloads[user_id].set()
             logging.info(f"הורדה בוטלה עבור משתמש {user_id}")
         
-        await self.queue_service.cancel_user_downloads(user_id)
-        
-        if len(self.queue_service.upload_queue) > 0:
-            next_message = self.queue_service.upload_queue[0]
-            asyncio.create_task(self.process_video_message(next_message))
+        # משימה שבוטלה לפני שהתחילה יוצאת גם מהיומן, כדי שלא תחזור בהפעלה הבאה
+        for job in await self.queue_service.cancel_user_downloads(user_id):
+            key = (job.chat_id, job.message_id)
+            self.job_store.remove(*key)
+            recovered = self._recovered.pop(key, None)
+            if recovered:
+                file_path, video_data, _ = recovered
+                self._discard_files(key, file_path, video_data)
 
     async def cancel_upload(self, user_id: int) -> None:
         """ביטול העלאה של משתמש"""
@@ -43,67 +414,55 @@ class VideoService:
     def _check_cancellation(self, user_id: int) -> None:
         """בדיקה אם ההורדה בוטלה"""
         if user_id in self.active_downloads and self.active_downloads[user_id].is_set():
-            raise asyncio.CancelledError("ההורדה בוטלה על ידי המשתמש")
+            raise UserCancelledError("ההורדה בוטלה על ידי המשתמש")
 
     def _check_upload_cancellation(self, user_id: int) -> None:
         """בדיקה אם ההעלאה בוטלה"""
         if user_id in self.active_uploads and self.active_uploads[user_id].is_set():
-            raise asyncio.CancelledError("ההעלאה בוטלה על ידי המשתמש")
+            raise UserCancelledError("ההעלאה בוטלה על ידי המשתמש")
 
     async def process_video_message(self, message):
-        """עיבוד הודעת וידאו חדשה"""
-        file = message.media
+        """קבלת הודעת וידאו חדשה והכנסתה לתור העיבוד"""
         original_file_name = get_file_name(message)
         clean_file_name = clean_filename(original_file_name)
-        user_id = message.sender_id
+        document_id, size = get_document_identity(message)
 
-        existing_file_id = check_existing_file(clean_file_name)
+        # זיהוי לפי המסמך עצמו; שם הקובץ רק כגיבוי, ולא לשם ברירת המחדל שמתנגש בין סרטונים
+        has_real_name = get_file_name(message, default=None) is not None
+        name_key = clean_file_name if DEDUP_BY_NAME and has_real_name else None
+        existing_file_id = check_existing_file(name_key, document_id, size)
+        self.file_id_lookups.inc(lookup='document', result='hit' if existing_file_id else 'miss')
         if existing_file_id:
-            await self._send_existing_video(message, existing_file_id, clean_file_name)
+            if await self._send_existing_video(message, existing_file_id, clean_file_name):
+                # רישום המסמך הזה כדי שהפעם הבאה תזוהה ישירות לפי המזהה שלו
+                save_file_id(None, existing_file_id, documents=((document_id, size),))
             return
 
-        is_first = len(self.queue_service.user_queue) == 0 or self.queue_service.is_first_user(user_id)
-        
-        if not is_first:
-            position = await self.queue_service.add_to_queue(message)
-            queue_message = await message.reply(f"הקובץ התקבל ✅\nמיקומך בתור: {position}")
-            self.queue_service.queue_messages[message.id] = queue_message
-        else:
-            await self.queue_service.add_to_queue(message)
-        
-        if not self.queue_service.is_first_in_queue(message.id):
-            logging.info(f"Message {message.id} waiting in queue")
-            return
-        
-        try:
-            download_message = await message.reply("הקובץ התקבל\nאנא המתן...✅")
-            await asyncio.sleep(3)
-            await download_message.delete()
-
-            file_path = await self._download_video(message, file, clean_file_name)
-            if file_path:
-                processed_video = await self._process_video(message, file_path, clean_file_name)
-                if processed_video:
-                    await self._send_processed_video(message, processed_video)
-                    await self.queue_service.remove_from_queue(message.id, user_id)
-                    
-                    if len(self.queue_service.upload_queue) > 0:
-                        next_message = self.queue_service.upload_queue[0]
-                        asyncio.create_task(self.process_video_message(next_message))
+        await self.start()
+        # נרשם ביומן לפני הכניסה לתור, כדי שמשימה לא תתחיל בלי רישום
+        self.job_store.add(message.chat_id, message.id, message.sender_id)
+        await self.queue_service.add_to_queue(message)
 
-        except Exception as e:
-            logging.error(f"שגיאה בעיבוד הוידאו: {e}")
-            await message.reply("אירעה שגיאה בעיבוד הוידאו. אנא נסה שוב.")
-            await self.queue_service.remove_from_queue(message.id, user_id)
-            if len(self.queue_service.upload_queue) > 0:
-                next_message = self.queue_service.upload_queue[0]
-                asyncio.create_task(self.process_video_message(next_message))
+        # אם אין מקום פנוי בשלב ההורדה - מודיעים למשתמש על מיקומו בתור
+        position = self.queue_service.get_message_position(message.id)
+        if position and position > self.pipeline.first_stage.idle_workers():
+            queue_message = await self._reply(message, f"הקובץ התקבל ✅\nמיקומך בתור: {position}")
+            if message.id in self.queue_service.upload_queue:
+                self.queue_service.queue_messages[message.id] = queue_message
+            else:
+                # המשימה כבר התחילה או בוטלה בזמן שההודעה נשלחה, ואף אחד לא ימחק אותה
+                try:
+                    await self._delete(queue_message)
+                except Exception as e:
+                    logging.warning(f"Failed to delete queue message: {e}")
+        else:
+            logging.info(f"Message {message.id} queued for an idle worker")
 
     async def _send_existing_video(self, message, file_id, file_name):
         """שליחת וידאו קיים"""
         caption_without_extension = os.path.splitext(file_name)[0]
         try:
-            await self.client.send_file(
+            await self._send_file(
                 message.chat_id,
                 file_id,
                 caption=caption_without_extension
@@ -114,122 +473,225 @@ class VideoService:
             logging.error(f"שגיאה בשליחת וידאו קיים: {str(e)}")
             return False
 
-    async def _download_video(self, message, file, clean_file_name):
-        """הורדת קובץ הוידאו"""
+    async def _download_video(self, message, file, clean_file_name, workspace):
+        """הורדת קובץ הוידאו לתיקיית העבודה של המשימה
+
+        במצב STREAMING_TRANSCODE, מכולות שאפשר לקרוא ברצף מומרות ל-MP4 תוך כדי
+        ההורדה, והנתיב שמוחזר הוא כבר של קובץ ה-MP4.
+        """
         try:
-            file_path = os.path.join(self.download_path, clean_file_name)
+            base_name, ext = os.path.splitext(clean_file_name)
+            if STREAMING_TRANSCODE and ext.lower() in STREAMABLE_EXTENSIONS:
+                file_path = workspace.file(f"{base_name}.mp4")
+
+                async def transfer(progress_callback):
+                    if not await stream_to_mp4(
+                        self.client.iter_download(file),
+                        file_path,
+                        total_size=message.file.size,
+                        progress_callback=progress_callback
+                    ):
+                        raise RuntimeError("ההמרה תוך כדי הורדה נכשלה")
+
+                await self._download_with_progress(message, file_path, transfer)
+                logging.info(f"הקובץ הורד והומר תוך כדי הורדה ל- {file_path}")
+                return file_path
+
+            file_path = workspace.file(clean_file_name)
             await self._download_with_progress(message, file_path)
             logging.info(f"הקובץ הורד בהצלחה ל- {file_path}")
             return file_path
         except (TimeoutError, ConnectionError) as e:
             logging.error(f"שגיאת רשת בהורדת הקובץ: {e}")
-            await message.reply("אירעה שגיאת רשת בהורדת הקובץ. אנא נסה שוב.")
-            await self.queue_service.remove_from_queue(message.id, message.sender_id)
+            await self._reply(message, "אירעה שגיאת רשת בהורדת הקובץ. אנא נסה שוב.")
             return None
         except Exception as e:
             logging.error(f"נכשל בהורדת הקובץ: {e}")
-            await message.reply("אירעה שגיאה בהורדת הקובץ. אנא נסה שוב.")
-            await self.queue_service.remove_from_queue(message.id, message.sender_id)
+            await self._reply(message, "אירעה שגיאה בהורדת הקובץ. אנא נסה שוב.")
             return None
 
-    async def _process_video(self, message, file_path, clean_file_name):
-        """עיבוד קובץ הוידאו"""
+    async def _process_video(self, message, file_path, clean_file_name, workspace, trace):
+        """עיבוד קובץ הוידאו (הפלט נכתב לתיקיית העבודה של המשימה)"""
         processing_message = None
         try:
-            processing_message = await message.reply("🔄 מעבד את הוידאו...")
+            processing_message = await self._reply(message, "🔄 מעבד את הוידאו...")
             
-            base_name, ext = os.path.splitext(clean_file_name)
+            base_name, _ = os.path.splitext(clean_file_name)
             original_path = file_path
+            with trace.span('probe'):
+                probe = await probe_video(file_path)
             
-            if ext.lower() != '.mp4':
-                await processing_message.edit("🔄 ממיר את הוידאו ל-MP4...")
-                mp4_file = os.path.join(self.download_path, f"{base_name}.mp4")
-                if not await convert_to_mp4(file_path, mp4_file):
-                    await processing_message.edit("❌ שגיאה בהמרת הוידאו")
-                    await self.queue_service.remove_from_queue(message.id, message.sender_id)
+            thumbnail_file = workspace.file(f"{base_name}.jpg")
+            if os.path.exists(thumbnail_file):
+                os.remove(thumbnail_file)  # שארית מריצה קודמת, כדי לא להתבלבל בבדיקה למטה
+
+            # הקובץ כבר יכול להיות MP4 אם הומר תוך כדי ההורדה
+            if os.path.splitext(file_path)[1].lower() != '.mp4':
+                await self._edit(processing_message, "🔄 ממיר את הוידאו ל-MP4...")
+                mp4_file = workspace.file(f"{base_name}.mp4")
+                progress_callback = self._conversion_progress_callback(message, processing_message)
+                try:
+                    # בקידוד מלא התמונה הממוזערת נוצרת באותה הרצה של ffmpeg
+                    encode = needs_video_encode(probe.get('streams', []))
+                    trace.set(codec_path='encode' if encode else 'remux')
+                    with trace.span('convert'):
+                        converted = await convert_to_mp4(
+                            file_path, mp4_file, probe, progress_callback, thumbnail_file=thumbnail_file
+                        )
+                finally:
+                    self.conversion_progress.pop(message.id, None)
+                    await self.progress_service.untrack((message.id, 'convert'))
+                if not converted:
+                    await self._edit(processing_message, "❌ שגיאה בהמרת הוידאו")
                     return None
                 file_path = mp4_file
+            else:
+                # MP4 כבר במקור, או שהומר תוך כדי ההורדה
+                source_is_mp4 = os.path.splitext(clean_file_name)[1].lower() == '.mp4'
+                trace.set(codec_path='none' if source_is_mp4 else 'streamed')
 
-            await processing_message.edit("🔄 יוצר תמונה ממוזערת...")
-            thumbnail_file = os.path.join(self.download_path, f"{base_name}.jpg")
-            try:
-                thumbnail_success = await create_thumbnail(file_path, thumbnail_file)
-                if not thumbnail_success:
-                    logging.warning("נכשל ביצירת תמונה ממוזערת, ממשיך בלעדיה")
+            if not os.path.exists(thumbnail_file):
+                await self._edit(processing_message, "🔄 יוצר תמונה ממוזערת...")
+                try:
+                    with trace.span('thumbnail'):
+                        thumbnail_success = await create_thumbnail(file_path, thumbnail_file, probe.get('duration', 0))
+                    if not thumbnail_success:
+                        logging.warning("נכשל ביצירת תמונה ממוזערת, ממשיך בלעדיה")
+                        workspace.release(thumbnail_file)
+                        thumbnail_file = None
+                except Exception as e:
+                    logging.warning(f"שגיאה ביצירת תמונה ממוזערת: {e}")
+                    workspace.release(thumbnail_file)
                     thumbnail_file = None
-            except Exception as e:
-                logging.warning(f"שגיאה ביצירת תמונה ממוזערת: {e}")
-                thumbnail_file = None
-            
-            await processing_message.edit("🔄 מחשב את משך הוידאו...")
-            video = VideoFileClip(file_path)
-            duration = int(video.duration)
-            video.close()
             
-            await processing_message.edit("✅ העיבוד הושלם!")
-            await asyncio.sleep(3)
-            await processing_message.delete()
+            trace.set(output_bytes=os.path.getsize(file_path))
+            await self._edit(processing_message, "✅ העיבוד הושלם!")
+            await self._delete_later(processing_message)
 
+            # ההמרה שומרת על המשך והמימדים, כך שהבדיקה של המקור תקפה גם לפלט
             return {
                 'file_path': file_path,
                 'thumbnail_path': thumbnail_file,
-                'duration': duration,
+                'duration': int(probe.get('duration', 0)),
+                'width': probe.get('width', 0),
+                'height': probe.get('height', 0),
                 'original_path': original_path if original_path != file_path else None
             }
             
         except Exception as e:
             if processing_message:
-                await processing_message.edit("❌ שגיאה בעיבוד הוידאו")
-                await asyncio.sleep(3)
-                await processing_message.delete()
+                await self._edit(processing_message, "❌ שגיאה בעיבוד הוידאו")
+                await self._delete_later(processing_message)
             logging.error(f"שגיאה בעיבוד הוידאו: {e}")
-            await self.queue_service.remove_from_queue(message.id, message.sender_id)
             return None
 
-    async def _send_processed_video(self, message, video_data):
+    def _conversion_progress_callback(self, message, status_message):
+        """יצירת callback להתקדמות ffmpeg שמעדכן את הודעת הסטטוס
+
+        ה-callback נקרא מתוך קריאת הפלט של ffmpeg ולכן לא ממתין: הוא רק שומר
+        את המצב האחרון, ושירות ההתקדמות עורך את ההודעה ברקע.
+        """
+        key = (message.id, 'convert')
+        self.progress_service.track(key, status_message, self._render_conversion_status)
+
+        def callback(info):
+            self.conversion_progress[message.id] = info
+            self.progress_service.update(key, info)
+
+        return callback
+
+    def _render_conversion_status(self, info):
+        """טקסט הודעת הסטטוס לפי מצב ההמרה"""
+        text = "🔄 ממיר את הוידאו ל-MP4...\n"
+        if info['percent'] is not None:
+            filled = int(info['percent'] / 10)
+            text += f"{'▰' * filled}{'▱' * (10 - filled)} {info['percent']:.0f}%\n"
+        text += f"⚡ {info['fps']:.0f} fps (x{info['speed']:.1f})"
+        if info['eta'] is not None:
+            text += f"\n⏱ זמן נותר: {format_duration(info['eta'])}"
+        return text
+
+    def _transfer_renderer(self, title):
+        """יצירת פונקציה שמציגה התקדמות של העברה (current, total)
+
+        המהירות מחושבת בין שתי הצגות, כלומר על פני כל המצבים שנדרסו ביניהן.
+        """
+        loop = asyncio.get_event_loop()
+        last = {'size': 0, 'time': loop.time()}
+
+        def render(current, total):
+            now = loop.time()
+            time_diff = now - last['time']
+            speed = (current - last['size']) / (1024 * 1024 * time_diff) if time_diff > 0 else 0
+            last['size'], last['time'] = current, now
+
+            percentage = int(current * 100 / total) if total else 0
+            filled = int(percentage / 10)
+            progress_bar = "▰" * filled + "▱" * (10 - filled)
+            return (
+                f"{title}\n"
+                f"{progress_bar} {percentage}%\n"
+                f"⚡ מהירות: {speed:.1f} MB/s\n"
+                f"📊 גודל: {total / (1024 * 1024):.1f} MB"
+            )
+
+        return render
+
+    async def _send_processed_video(self, message, video_data, trace):
         """שליחת הוידאו המעובד"""
         try:
             logging.info("מתחיל שליחת וידאו...")
             caption = get_video_caption(video_data['file_path'])
             
             # 1. שולח למשתמש עם פס התקדמות
-            sent_to_user = await self._upload_with_progress(
-                message,
-                video_data,
-                caption
-            )
+            with trace.span('upload_user'):
+                sent_to_user = await self._upload_with_progress(
+                    message,
+                    video_data,
+                    caption
+                )
             
             logging.info(f"שולח לקבוצת היעד {TARGET_GROUP_ID}...")
-            # 2. שולח לקבוצה
-            async with self.group_limiter:
-                sent_to_group = await self.client.send_file(
+            # 2. שולח לקבוצה את אותו מסמך שכבר הועלה - בלי להעלות את הקובץ שוב
+            with trace.span('upload_group'):
+                sent_to_group = await self._send_file(
                     TARGET_GROUP_ID,
-                    file=video_data['file_path'],
-                    thumb=video_data.get('thumbnail_path'),
-                    caption=caption,
-                    attributes=[
-                        DocumentAttributeVideo(
-                            duration=video_data['duration'],
-                            w=0,  # יתמלא אוטומטית
-                            h=0,  # יתמלא אוטומטית
-                            supports_streaming=True
-                        )
-                    ]
+                    sent_to_user.media,
+                    caption=caption
                 )
             
             # 3. שומר את מזהה הקובץ
             file_name = os.path.basename(video_data['file_path'])
             logging.info(f"שומר file_id עבור {file_name}")
-            save_file_id(file_name, sent_to_group.file.id)
+            save_file_id(
+                file_name,
+                sent_to_group.file.id,
+                documents=(
+                    get_document_identity(message),
+                    get_document_identity(sent_to_user),
+                    get_document_identity(sent_to_group),
+                ),
+                content_hash=video_data.get('content_hash')
+            )
             
-            logging.info("מנקה קבצים זמניים...")
-            await self._cleanup_files(video_data)
             logging.info("תהליך השליחה הושלם בהצלחה")
+            return True
             
         except Exception as e:
             logging.error(f"שגיאה בשליחת הוידאו: {str(e)}", exc_info=True)
-            await message.reply("אירעה שגיאה בשליחת הוידאו. אנא נסה שוב.")
-            await self.queue_service.remove_from_queue(message.id, message.sender_id)
+            await self._reply(message, "אירעה שגיאה בשליחת הוידאו. אנא נסה שוב.")
+            return False
+
+    def _video_attributes(self, video_data):
+        """מאפייני הוידאו לשליחה בטלגרם"""
+        return [
+            DocumentAttributeVideo(
+                duration=video_data['duration'],
+                w=video_data['width'],
+                h=video_data['height'],
+                supports_streaming=True
+            )
+        ]
 
     async def _upload_with_progress(self, message, video_data, caption):
         """העלאת קובץ עם פס התקדמות"""
@@ -238,180 +700,112 @@ class VideoService:
         
         cancel_button = [[Button.inline("ביטול ❌", data=f"cancel_upload_{user_id}")]]
         
-        progress_message = await message.reply("📤 מתחיל העלאה...", buttons=cancel_button)
-        last_percentage = 0
-        last_update_time = asyncio.get_event_loop().time()
-        uploaded_size = 0
+        progress_message = await self._reply(message, "📤 מתחיל העלאה...", buttons=cancel_button)
+        progress_key = (message.id, 'upload')
+        self.progress_service.track(
+            progress_key, progress_message, self._transfer_renderer("📤 מעלה את הקובץ..."), cancel_button
+        )
+
+        sent = {'bytes': 0}
 
         async def progress_callback(current, total):
-            try:
-                self._check_upload_cancellation(user_id)  # בדיקת ביטול
-                
-                nonlocal last_percentage, last_update_time, uploaded_size
-                percentage = int(current * 100 / total)
-                current_time = asyncio.get_event_loop().time()
-                time_diff = current_time - last_update_time
-                
-                if percentage >= last_percentage + 5 or time_diff >= 3:
-                    speed = (current - uploaded_size) / (1024 * 1024 * time_diff) if time_diff > 0 else 0
-                    
-                    filled = int(percentage / 10)
-                    empty = 10 - filled
-                    progress_bar = "▰" * filled + "▱" * empty
-                    
-                    try:
-                        async with self.progress_limiter:
-                            await progress_message.edit(
-                                text=f"📤 מעלה את הקובץ...\n"
-                                f"{progress_bar} {percentage}%\n"
-                                f"⚡ מהירות: {speed:.1f} MB/s\n"
-                                f"📊 גודל: {total / (1024 * 1024):.1f} MB",
-                                buttons=cancel_button
-                            )
-                            last_percentage = percentage
-                            last_update_time = current_time
-                            uploaded_size = current
-                    except Exception as e:
-                        if "MESSAGE_NOT_MODIFIED" not in str(e):
-                            logging.debug(f"דילוג על עדכון התקדמות: {str(e)}")
-            except asyncio.CancelledError:
-                raise
-            except Exception as e:
-                logging.error(f"שגיאה בעדכון התקדמות: {str(e)}")
+            self._check_upload_cancellation(user_id)  # בדיקת ביטול
+            self.transfer_bytes.inc(max(0, current - sent['bytes']), direction='upload')
+            sent['bytes'] = current
+            self.progress_service.update(progress_key, current, total)
 
         try:
-            # שולח את הקובץ עם פס התקדמות
-            sent_message = await self.client.send_file(
+            # מעלה את חלקי הקובץ במקביל עם פס התקדמות, ואז שולח את הקובץ שהועלה
+            try:
+                uploaded_file = await self.transfer_service.upload(video_data['file_path'], progress_callback)
+            finally:
+                await self.progress_service.untrack(progress_key)
+            sent_message = await self._send_file(
                 message.chat_id,
-                file=video_data['file_path'],
+                uploaded_file,
                 thumb=video_data.get('thumbnail_path'),
                 caption=caption,
-                progress_callback=progress_callback,
-                attributes=[
-                    DocumentAttributeVideo(
-                        duration=video_data['duration'],
-                        w=0,  # יתמלא אוטומטית
-                        h=0,  # יתמלא אוטומטית
-                        supports_streaming=True
-                    )
-                ]
+                attributes=self._video_attributes(video_data)
             )
-            await progress_message.delete()
+            await self._delete(progress_message)
             if user_id in self.active_uploads:
                 del self.active_uploads[user_id]
             return sent_message
 
         except asyncio.CancelledError:
-            await progress_message.edit("❌ ההעלאה בוטלה!")
+            await self._edit(progress_message, "❌ ההעלאה בוטלה!")
             if user_id in self.active_uploads:
                 del self.active_uploads[user_id]
-            # ניקוי קבצים במקרה של ביטול
-            try:
-                await self._cleanup_files(video_data)
-                logging.info("הקבצים נמחקו בהצלחה אחרי ביטול העלאה")
-            except Exception as cleanup_error:
-                logging.error(f"שגיאה במחיקת קבצים אחרי ביטול העלאה: {cleanup_error}")
-            await asyncio.sleep(3)  # מחכה 3 שניות
-            await progress_message.delete()  # מוחק את ההודעה
+            await self._delete_later(progress_message)  # מוחק את ההודעה אחרי 3 שניות
             raise
 
         except Exception as e:
             logging.error(f"שגיאה בהעלאת הקובץ: {str(e)}")
-            await progress_message.edit("❌ שגיאה בהעלאת הקובץ")
+            await self._edit(progress_message, "❌ שגיאה בהעלאת הקובץ")
             if user_id in self.active_uploads:
                 del self.active_uploads[user_id]
-            # ניקוי קבצים במקרה של שגיאה
-            try:
-                await self._cleanup_files(video_data)
-                logging.info("הקבצים נמחקו בהצלחה אחרי שגיאת העלאה")
-            except Exception as cleanup_error:
-                logging.error(f"שגיאה במחיקת קבצים אחרי שגיאת העלאה: {cleanup_error}")
-            await progress_message.delete()
+            await self._delete(progress_message)
             raise e
 
-    async def _download_with_progress(self, message, file_path):
-        """הורדת קובץ עם פס התקדמות"""
+    async def _download_with_progress(self, message, file_path, transfer=None):
+        """הורדת קובץ עם פס התקדמות
+
+        Args:
+            transfer: פונקציה אסינכרונית שמקבלת progress_callback ומבצעת את ההעברה
+                לתוך file_path. ברירת המחדל היא הורדה (מקבילית לקבצים גדולים) לקובץ.
+        """
         user_id = message.sender_id
         self.active_downloads[user_id] = asyncio.Event()
         
         cancel_button = [[Button.inline("ביטול ❌", data=f"cancel_download_{user_id}")]]
         
-        progress_message = await message.reply("📥 הורדה החלה...", buttons=cancel_button)
-        last_percentage = 0
-        last_update_time = asyncio.get_event_loop().time()
-        downloaded_size = 0
+        progress_message = await self._reply(message, "📥 הורדה החלה...", buttons=cancel_button)
+        progress_key = (message.id, 'download')
+        self.progress_service.track(
+            progress_key, progress_message, self._transfer_renderer("📥 מוריד את הקובץ..."), cancel_button
+        )
+
+        received = {'bytes': 0}
 
         async def progress_callback(current, total):
-            try:
-                self._check_cancellation(user_id)
-                
-                nonlocal last_percentage, last_update_time, downloaded_size
-                percentage = int(current * 100 / total)
-                current_time = asyncio.get_event_loop().time()
-                time_diff = current_time - last_update_time
-                
-                if percentage >= last_percentage + 5 or time_diff >= 3:
-                    speed = (current - downloaded_size) / (1024 * 1024 * time_diff) if time_diff > 0 else 0
-                    
-                    filled = int(percentage / 10)
-                    empty = 10 - filled
-                    progress_bar = "▰" * filled + "▱" * empty
-                    
-                    try:
-                        async with self.progress_limiter:
-                            await progress_message.edit(
-                                f"📥 מוריד את הקובץ...\n"
-                                f"{progress_bar} {percentage}%\n"
-                                f"⚡ מהירות: {speed:.1f} MB/s\n"
-                                f"📊 גודל: {total / (1024 * 1024):.1f} MB"
-                            )
-                            last_percentage = percentage
-                            last_update_time = current_time
-                            downloaded_size = current
-                    except Exception as e:
-                        if "MESSAGE_NOT_MODIFIED" not in str(e):
-                            logging.debug(f"דילוג על עדכון התקדמות: {str(e)}")
-            except asyncio.CancelledError:
-                raise
+            self._check_cancellation(user_id)
+            self.transfer_bytes.inc(max(0, current - received['bytes']), direction='download')
+            received['bytes'] = current
+            self.progress_service.update(progress_key, current, total)
 
         try:
-            await message.download_media(file=file_path, progress_callback=progress_callback)
-            await progress_message.edit("✅ ההורדה הושלמה בהצלחה!")
+            try:
+                if transfer is None:
+                    await self.transfer_service.download(message, file_path, progress_callback)
+                else:
+                    await transfer(progress_callback)
+            finally:
+                await self.progress_service.untrack(progress_key)
+            await self._edit(progress_message, "✅ ההורדה הושלמה בהצלחה!")
             return True
+        except UserCancelledError:
+            # ביטול של המשתמש - מוחקים את הקובץ החלקי ואת נקודת ההמשך
+            self._discard_partial(file_path)
+            await self._edit(progress_message, "❌ ההורדה בוטלה")
+            raise
         except asyncio.CancelledError:
-            # כשההורדה מבוטלת - מוחקים את הקובץ החלקי
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    logging.info(f"נמחק קובץ חלקי: {file_path}")
-                except Exception as e:
-                    logging.error(f"שגיאה במחיקת קובץ חלקי: {str(e)}")
-            await progress_message.edit("❌ ההורדה בוטלה")
+            # עצירה של הבוט - הקובץ החלקי נשאר, וההורדה תמשיך ממנו אחרי ההפעלה מחדש
+            logging.info(f"ההורדה של {file_path} נעצרה, הקובץ החלקי נשמר להמשך")
             raise
         except Exception as e:
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    logging.info(f"נמחק קובץ חלקי בגלל שגיאה: {file_path}")
-                except Exception as cleanup_error:
-                    logging.error(f"שגיאה במחיקת קובץ חלקי: {str(cleanup_error)}")
-            await progress_message.edit("❌ שגיאה בהורדת הקובץ")
-            if user_id in self.active_downloads:
-                del self.active_downloads[user_id]
-            await progress_message.delete()
+            # כל הניסיונות החוזרים נכשלו
+            self._discard_partial(file_path)
+            await self._edit(progress_message, "❌ שגיאה בהורדת הקובץ")
             raise e
         finally:
-            await asyncio.sleep(3)
-            await progress_message.delete()
+            await self._delete_later(progress_message)
             if user_id in self.active_downloads:
                 del self.active_downloads[user_id]
 
-    async def _cleanup_files(self, video_data):
-        """ניקוי קבצים זמניים"""
-        await wait_for_file_release(video_data['file_path'])
-        
-        if video_data.get('original_path'):
-            await wait_and_delete(video_data['original_path'])
-        await wait_and_delete(video_data['file_path'])
-        await wait_and_delete(video_data['thumbnail_path'])
-        logging.info("קבצים זמניים נמחקו בהצלחה.")
+    def _discard_partial(self, file_path):
+        """מחיקת קובץ שההורדה שלו ננטשה, יחד עם נקודת ההמשך שלו"""
+        try:
+            self.transfer_service.discard_partial(file_path)
+        except Exception as e:
+            logging.error(f"שגיאה במחיקת קובץ חלקי: {str(e)}")
+
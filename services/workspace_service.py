@@ -0,0 +1,172 @@
+import os
+import shutil
+import asyncio
+import logging
+from config.settings import TEMP_PATH, JANITOR_MAX_RETRIES, JANITOR_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR_NAME = "jobs"  # תת-התיקייה של תיקיות המשימות בתוך תיקיית ההורדות
+
+class Janitor:
+    """מחיקת קבצים ותיקיות ברקע, עם מספר חסום של ניסיונות חוזרים
+
+    מי שמבקש מחיקה לא ממתין לה. קובץ שעדיין תפוס מנוסה שוב אחרי המתנה
+    שגדלה בכל פעם, ואחרי max_retries ניסיונות הוא נשאר ונרשם בלוג - בלי
+    לעכב מחיקות אחרות או את התור.
+    """
+
+    def __init__(self, max_retries: int = JANITOR_MAX_RETRIES, retry_delay: float = JANITOR_RETRY_DELAY):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = asyncio.Queue()
+        self._task = None
+        self.failed = 0  # מחיקות שנכשלו סופית
+
+    def delete(self, path: str, attempt: int = 0) -> None:
+        """בקשת מחיקה של קובץ או תיקייה (לא ממתין)"""
+        if not path:
+            return
+        self._queue.put_nowait((path, attempt))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            path, attempt = await self._queue.get()
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                logger.info(f"הקובץ {path} נמחק בהצלחה.")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    logger.error(f"נכשל במחיקת {path} אחרי {attempt + 1} ניסיונות: {e}")
+                    continue
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"נכשל במחיקת {path}. מנסה שוב בעוד {delay:.0f} שניות...")
+                loop.call_later(delay, self.delete, path, attempt + 1)
+
+class Workspace:
+    """תיקיית העבודה של משימה אחת, עם ספירת הפניות לכל קובץ בה
+
+    כל קובץ שנוצר דרך file() מתחיל עם הפניה אחת של התיקייה עצמה. שלב שצריך
+    קובץ לאורך זמן מחזיק עוד הפניה (retain) ומשחרר אותה בסוף (release).
+    קובץ נמחק כשההפניה האחרונה שלו משתחררת, והתיקייה כולה - כשהיא נסגרה
+    ואין בה יותר קבצים מוחזקים.
+    """
+
+    def __init__(self, janitor: Janitor, key, path: str):
+        self.janitor = janitor
+        self.key = key
+        self.path = path
+        self.closed = False
+        self._refs = {}
+
+    def file(self, name: str) -> str:
+        """נתיב לקובץ בתיקיית המשימה (נרשם עם ההפניה של התיקייה)"""
+        return self.add(os.path.join(self.path, name))
+
+    def add(self, path: str) -> str:
+        """רישום קובץ קיים (גם מחוץ לתיקייה) כך שיימחק עם המשימה"""
+        if path:
+            self._refs.setdefault(path, 1)
+        return path
+
+    def retain(self, path: str) -> None:
+        if path:
+            self._refs[path] = self._refs.get(path, 0) + 1
+
+    def release(self, path: str) -> None:
+        """שחרור הפניה לקובץ; ההפניה האחרונה מוחקת אותו ברקע"""
+        if not path or path not in self._refs:
+            return
+        self._refs[path] -= 1
+        if self._refs[path] <= 0:
+            del self._refs[path]
+            self.janitor.delete(path)
+        if self.closed and not self._refs:
+            self.janitor.delete(self.path)
+
+    def close(self) -> None:
+        """סיום המשימה: שחרור ההפניות של התיקייה ומחיקתה כשהיא מתפנה"""
+        if self.closed:
+            return
+        self.closed = True
+        for path in list(self._refs):
+            self.release(path)
+        # שאריות שלא נרשמו (נקודת המשך, פלט חלקי של ffmpeg) נמחקות עם התיקייה
+        if not self._refs:
+            self.janitor.delete(self.path)
+
+class WorkspaceManager:
+    """ניהול תיקיות העבודה של המשימות וניקוי שאריות מהרצות קודמות"""
+
+    def __init__(self, root: str, temp_path: str = TEMP_PATH):
+        """אתחול המנהל
+
+        Args:
+            root: תיקיית ההורדות; תיקיות המשימות נוצרות ב-root/jobs
+            temp_path: תיקייה זמנית נוספת שמנוקה בהפעלה
+        """
+        self.root = root
+        self.temp_path = temp_path
+        self.jobs_root = os.path.join(root, JOBS_DIR_NAME)
+        os.makedirs(self.jobs_root, exist_ok=True)
+        self.janitor = Janitor()
+        self._workspaces = {}
+
+    def path_for(self, key) -> str:
+        """תיקיית המשימה לפי (chat_id, message_id)"""
+        chat_id, message_id = key
+        return os.path.join(self.jobs_root, f"{chat_id}_{message_id}")
+
+    def open(self, key) -> Workspace:
+        """פתיחת תיקיית המשימה (קיימת - אם המשימה ממשיכה אחרי הפעלה מחדש)"""
+        workspace = self._workspaces.get(key)
+        if workspace is None:
+            path = self.path_for(key)
+            os.makedirs(path, exist_ok=True)
+            workspace = self._workspaces[key] = Workspace(self.janitor, key, path)
+        return workspace
+
+    def close(self, key) -> None:
+        workspace = self._workspaces.pop(key, None)
+        if workspace:
+            workspace.close()
+
+    def sweep_orphans(self, keep_keys=(), keep_paths=()) -> int:
+        """מחיקת שאריות של הרצות קודמות (קריסה באמצע משימה)
+
+        נמחקים קבצים בתיקיית ההורדות ובתיקייה הזמנית ותיקיות משימות שאין להן
+        משימה ביומן. תת-תיקיות אחרות בתיקיית ההורדות לא נמחקות.
+
+        Args:
+            keep_keys: מפתחות של משימות שעדיין ביומן - התיקיות שלהן נשמרות
+            keep_paths: קבצים שמשימות ביומן עדיין צריכות
+
+        Returns:
+            int: מספר הפריטים שנשלחו למחיקה
+        """
+        keep = {self.path_for(key) for key in keep_keys} | {os.path.abspath(path) for path in keep_paths}
+        orphans = []
+        for directory in (self.root, self.temp_path):
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and os.path.abspath(entry.path) not in keep:
+                    orphans.append(entry.path)
+        for entry in os.scandir(self.jobs_root):
+            if entry.path not in keep:
+                orphans.append(entry.path)
+
+        for path in orphans:
+            self.janitor.delete(path)
+        if orphans:
+            logger.info(f"נמצאו {len(orphans)} קבצים ותיקיות יתומים מהרצות קודמות, מוחק ברקע")
+        return len(orphans)
@@ -0,0 +1,446 @@
+"""סימולציה של התור, התזמון ומגביל הקצב על שעון וירטואלי
+
+מריצה תרחישי תעבורה סינתטיים (הרבה משתמשים, גדלים מעורבים, פרצי קבצים
+וביטולים) דרך המחלקות האמיתיות - QueueService, RateLimiter ו-ProgressService -
+מול שרת טלגרם מדומה שאוכף מגבלות קצב ומחזיר FloodWait כשהן נחצות. שעות של
+תעבורה רצות בשניות, ואותו seed נותן תמיד את אותה תוצאה.
+
+    python simulation/simulate.py                   # כל התרחישים, עם סיכום
+    python simulation/simulate.py --scenario burst --seed 7 --json out.json
+    python simulation/simulate.py --check           # בדיקות רגרסיה (קוד יציאה 1 בכישלון)
+
+העבודה עצמה (הורדה, המרה, העלאה) מדומה כזמן שתלוי בגודל הקובץ, על מספר
+קבוע של עובדים - המטרה היא ההתנהגות של התור והמגביל, לא של ffmpeg.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+from itertools import count
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config.settings דורש את משתני הבוט; בסימולציה אין להם שימוש
+for _name, _value in {
+    'API_ID': '1', 'API_HASH': 'simulation', 'BOT_TOKEN': 'simulation', 'TARGET_GROUP_ID': '-100'
+}.items():
+    os.environ.setdefault(_name, _value)
+
+from telethon.errors import FloodWaitError
+from config.settings import PROGRESS_EDITS_PER_MINUTE
+from services.queue_service import QueueService
+from services.progress_service import ProgressService
+from utils.rate_limiter import RateLimiter
+from simulation.virtual_clock import run as run_virtual
+
+MB = 1024 * 1024
+PROGRESS_PREFIX = "⏳"  # עריכות שמתחילות בזה הן עריכות התקדמות (נספרות בתקציב)
+
+SCENARIOS = {
+    # עומס קבוע: הרבה משתמשים, כל אחד שולח מדי פעם
+    'steady': {
+        'users': 20, 'duration': 2 * 3600, 'interval': 900, 'heavy_users': 0, 'heavy_burst': 0,
+        'cancel_probability': 0.0, 'workers': 3,
+    },
+    # משתמש אחד שולח 40 קבצים בבת אחת, ושאר המשתמשים לא אמורים לחכות לו
+    'burst': {
+        'users': 10, 'duration': 3600, 'interval': 600, 'heavy_users': 1, 'heavy_burst': 40,
+        'cancel_probability': 0.0, 'workers': 2,
+    },
+    # פרצים של כמה משתמשים וביטולים באמצע (גם של משימות ממתינות וגם של הורדות פעילות)
+    'cancels': {
+        'users': 30, 'duration': 3600, 'interval': 400, 'heavy_users': 3, 'heavy_burst': 15,
+        'cancel_probability': 0.3, 'workers': 3,
+    },
+}
+
+# קצב העבודה המדומה (בתים לשנייה) וגבולות הגודל של הקבצים
+RATES = {'download': 20 * MB, 'convert': 40 * MB, 'upload': 10 * MB}
+MIN_SIZE, MAX_SIZE = 2 * MB, 2048 * MB
+TICK = 1.0  # שניות בין דיווחי התקדמות של משימה
+SLOWDOWN_FLOOR = 60.0  # bounded slowdown: קבצים קצרים מזה נמדדים כאילו נמשכו דקה
+
+def percentile(values: list, q: float):
+    """אחוזון לפי nearest-rank (None לרשימה ריקה)"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values) / 100) - 1)]
+
+def jain_index(values: list):
+    """מדד ההוגנות של Jain: 1 = כולם קיבלו אותו דבר, 1/n = אחד קיבל הכל"""
+    if not values:
+        return None
+    return sum(values) ** 2 / (len(values) * sum(value * value for value in values))
+
+class FakeTelegram:
+    """שרת טלגרם מדומה: אוכף מגבלת קצב לכל צ'אט ומונה את הבקשות
+
+    המגבלה סלחנית מעט יותר מזו של RateLimiter (פרץ גדול יותר), כך שמגביל
+    תקין לא אמור לקבל אף FloodWait.
+    """
+
+    def __init__(self, private_per_minute: int = 60, group_per_minute: int = 20, burst: int = 5):
+        self.private_per_minute = private_per_minute
+        self.group_per_minute = group_per_minute
+        self.burst = burst
+        self._tat = {}
+        self.requests = {'send': 0, 'edit': 0, 'progress': 0, 'delete': 0}
+        self.progress_edits = []  # זמני עריכות ההתקדמות
+        self.floods = 0
+
+    def hit(self, chat_id, kind: str) -> None:
+        now = asyncio.get_event_loop().time()
+        per_minute = self.group_per_minute if chat_id < 0 else self.private_per_minute
+        interval = 60 / per_minute
+        tat = max(self._tat.get(chat_id, now), now)
+        if tat - now > self.burst * interval:
+            self.floods += 1
+            raise FloodWaitError(None, capture=math.ceil(tat - now - self.burst * interval))
+        self._tat[chat_id] = tat + interval
+        self.requests[kind] += 1
+        if kind == 'progress':
+            self.progress_edits.append(now)
+
+class _Document:
+    def __init__(self, document_id: int, size: int):
+        self.id = document_id
+        self.size = size
+
+class SimMessage:
+    """הודעה מדומה: מה שהתור, המגביל ושירות ההתקדמות צריכים"""
+
+    def __init__(self, server: FakeTelegram, chat_id: int, message_id: int, sender_id: int, size: int = None):
+        self.server = server
+        self.chat_id = chat_id
+        self.id = message_id
+        self.sender_id = sender_id
+        self.document = _Document(message_id, size) if size is not None else None
+
+    async def reply(self, text, **kwargs):
+        self.server.hit(self.chat_id, 'send')
+        return SimMessage(self.server, self.chat_id, -self.id, 0)
+
+    async def edit(self, text, **kwargs):
+        self.server.hit(self.chat_id, 'progress' if text.startswith(PROGRESS_PREFIX) else 'edit')
+        return self
+
+    async def delete(self):
+        self.server.hit(self.chat_id, 'delete')
+
+def generate_events(scenario: dict, seed: int) -> list:
+    """רשימת אירועים ממוינת לפי זמן: ('arrive', זמן, משתמש, גודל) ו-('cancel', זמן, משתמש)"""
+    rng = random.Random(seed)
+    events = []
+    for user_id in range(1, scenario['users'] + 1):
+        t = rng.expovariate(1 / scenario['interval'])
+        while t < scenario['duration']:
+            events.append(('arrive', t, user_id, _random_size(rng)))
+            t += rng.expovariate(1 / scenario['interval'])
+        if user_id <= scenario['heavy_users']:
+            start = rng.uniform(0, scenario['duration'] / 4)
+            for index in range(scenario['heavy_burst']):
+                events.append(('arrive', start + index, user_id, _random_size(rng)))
+        if rng.random() < scenario['cancel_probability']:
+            events.append(('cancel', rng.uniform(0, scenario['duration']), user_id, None))
+    events.sort(key=lambda event: (event[1], event[2]))
+    return events
+
+def _random_size(rng: random.Random) -> int:
+    """גודל בהתפלגות לוג-אחידה: הרבה קבצים קטנים, מעט סרטים גדולים"""
+    return int(math.exp(rng.uniform(math.log(MIN_SIZE), math.log(MAX_SIZE))))
+
+class Simulation:
+    """הרצה אחת של תרחיש: עובדים, הגעות וביטולים מול התור והמגביל האמיתיים"""
+
+    def __init__(self, scenario: dict, seed: int):
+        self.scenario = scenario
+        self.seed = seed
+        self.events = generate_events(scenario, seed)
+        self.jobs = {}  # message_id -> נתוני המשימה
+        self._ids = count(1)
+        self._cancel_requested = set()  # משתמשים שההורדה הפעילה שלהם צריכה להיעצר
+        self._idle_workers = scenario['workers']
+
+    def _now(self) -> float:
+        return asyncio.get_event_loop().time()
+
+    async def run(self) -> dict:
+        self.server = FakeTelegram()
+        # אותה תצורה כמו ב-VideoService
+        self.limiter = RateLimiter(
+            messages_per_minute=60, limiter_type="simulation", group_messages_per_minute=20,
+            class_budgets={'progress': PROGRESS_EDITS_PER_MINUTE}
+        )
+        self.queue = QueueService(self.limiter)
+        self.progress = ProgressService(self.limiter)
+        for _ in range(self.scenario['workers']):
+            asyncio.create_task(self._worker())
+
+        handlers = []
+        for kind, at, user_id, size in self.events:
+            await asyncio.sleep(max(0.0, at - self._now()))
+            # כל אירוע מטופל במשימה נפרדת, כמו handler של טלגרם
+            if kind == 'arrive':
+                handlers.append(asyncio.create_task(self._arrive(user_id, size)))
+            else:
+                handlers.append(asyncio.create_task(self._cancel(user_id)))
+        await asyncio.gather(*handlers)
+
+        deadline = self.scenario['duration'] * 50
+        while not all(self._finished(job) for job in self.jobs.values()):
+            if self._now() > deadline:
+                break
+            await asyncio.sleep(5)
+        return self._results()
+
+    def _finished(self, job: dict) -> bool:
+        return job['end'] is not None or (job['start'] is None and job['id'] not in self.queue.upload_queue)
+
+    async def _arrive(self, user_id: int, size: int) -> None:
+        """הודעה חדשה - כמו VideoService.process_video_message"""
+        message = SimMessage(self.server, user_id, next(self._ids), user_id, size)
+        self.jobs[message.id] = {
+            'id': message.id, 'user': user_id, 'size': size, 'arrival': self._now(),
+            'short': size <= self.queue.short_job_max_size, 'start': None, 'end': None,
+            'cancelled': False, 'service': sum(size / rate for rate in RATES.values()),
+        }
+        await self.queue.add_to_queue(message)
+        position = self.queue.get_message_position(message.id)
+        if position and position > self._idle_workers:
+            queue_message = await self.limiter.call(
+                user_id, 'send', message.reply, f"הקובץ התקבל ✅\nמיקומך בתור: {position}"
+            )
+            if message.id in self.queue.upload_queue:
+                self.queue.queue_messages[message.id] = queue_message
+            else:
+                # המשימה כבר התחילה או בוטלה בזמן שההודעה נשלחה
+                await self.limiter.call(user_id, 'delete', queue_message.delete)
+
+    async def _cancel(self, user_id: int) -> None:
+        """לחיצה על ביטול - כמו VideoService.cancel_download"""
+        self._cancel_requested.add(user_id)
+        await self.queue.cancel_user_downloads(user_id)
+        for job in self.jobs.values():
+            if job['user'] == user_id and job['start'] is None and job['id'] not in self.queue.upload_queue:
+                job['cancelled'] = True
+
+    async def _worker(self) -> None:
+        while True:
+            queued = await self.queue.get_next_job()
+            self._idle_workers -= 1
+            job = self.jobs[queued.message_id]
+            job['start'] = self._now()
+            try:
+                await self._process(queued, job)
+            except Exception as e:
+                logging.error(f"שגיאה בסימולציה של משימה {queued.message_id}: {e}", exc_info=True)
+            finally:
+                job['end'] = self._now()
+                await self.queue.remove_from_queue(queued.message_id, queued.user_id)
+                self._idle_workers += 1
+
+    async def _process(self, queued, job: dict) -> None:
+        chat_id = queued.chat_id
+        # ביטול שנלחץ לפני שהמשימה התחילה לא עוצר אותה (כמו בבוט - האירוע נוצר מחדש)
+        self._cancel_requested.discard(queued.user_id)
+        status = await self.limiter.call(
+            chat_id, 'send', SimMessage(self.server, chat_id, queued.message_id, queued.user_id).reply, "📥"
+        )
+        for phase, rate in RATES.items():
+            key = (queued.message_id, phase)
+            self.progress.track(key, status, lambda done, total: f"{PROGRESS_PREFIX} {done * 100 // total}%")
+            try:
+                done, total = 0, job['size']
+                while done < total:
+                    step = min(TICK, (total - done) / rate)
+                    await asyncio.sleep(step)
+                    done = min(total, done + int(rate * step) + 1)
+                    self.progress.update(key, done, total)
+                    # כפתור הביטול עוצר רק את ההורדה
+                    if phase == 'download' and queued.user_id in self._cancel_requested:
+                        self._cancel_requested.discard(queued.user_id)
+                        job['cancelled'] = True
+                        await self.limiter.call(chat_id, 'edit', status.edit, "❌ ההורדה בוטלה")
+                        return
+            finally:
+                await self.progress.untrack(key)
+        await self.limiter.call(chat_id, 'edit', status.edit, "✅")
+
+    def _results(self) -> dict:
+        completed = [job for job in self.jobs.values() if job['end'] is not None and not job['cancelled']]
+        started = [job for job in self.jobs.values() if job['start'] is not None]
+        heavy = set(range(1, self.scenario['heavy_users'] + 1))
+
+        def waits(jobs):
+            return [job['start'] - job['arrival'] for job in jobs]
+
+        def distribution(values):
+            return {
+                'count': len(values),
+                **{f'p{q}': _round(percentile(values, q)) for q in (50, 95, 99)},
+                'max': _round(max(values) if values else None),
+            }
+
+        # האטה לכל משתמש: זמן השהייה במערכת ביחס לזמן העבודה עצמה. הרצפה מונעת
+        # מקובץ של שניות, שהמתין קצת, להיראות כמו האטה פי מאה
+        slowdowns = {}
+        for job in completed:
+            slowdown = (job['end'] - job['arrival']) / max(job['service'], SLOWDOWN_FLOOR)
+            slowdowns.setdefault(job['user'], []).append(slowdown)
+        user_slowdowns = [sum(values) / len(values) for values in slowdowns.values()]
+
+        makespan = max((job['end'] for job in started), default=0.0)
+        edits = self.server.progress_edits
+        return {
+            'jobs': len(self.jobs),
+            'completed': len(completed),
+            'cancelled': sum(job['cancelled'] for job in self.jobs.values()),
+            'unfinished': sum(not self._finished(job) for job in self.jobs.values()),
+            'makespan': _round(makespan),
+            'wait': distribution(waits(started)),
+            'wait_short': distribution(waits([job for job in started if job['short']])),
+            'wait_regular': distribution(waits([job for job in started if not job['short']])),
+            'wait_heavy_users': distribution(waits([job for job in started if job['user'] in heavy])),
+            'wait_light_users': distribution(waits([job for job in started if job['user'] not in heavy])),
+            'fairness_jain': _round(jain_index(user_slowdowns), 3),
+            'progress_edits': len(edits),
+            'progress_edits_max_per_minute': _max_in_window(edits, 60),
+            'progress_budget_per_minute': PROGRESS_EDITS_PER_MINUTE,
+            # דלי האסימונים מאפשר פרץ של burst + 1 עריכות מעבר לקצב
+            'progress_budget_burst': self.limiter.burst + 1,
+            'progress_budget_used': _round(len(edits) / (PROGRESS_EDITS_PER_MINUTE * makespan / 60), 3)
+            if makespan else None,
+            'requests': dict(self.server.requests),
+            'flood_waits': self.server.floods,
+            'rate_limiter_wait': _round(self.limiter.total_wait),
+            'queue_leftovers': {
+                'upload_queue': len(self.queue.upload_queue),
+                'active_jobs': len(self.queue.active_jobs),
+                'user_queue': len(self.queue.user_queue),
+                'queue_messages': len(self.queue.queue_messages),
+                'lane_order': sum(len(order) for order in self.queue._lane_order),
+            },
+        }
+
+def _round(value, digits: int = 1):
+    return round(value, digits) if value is not None else None
+
+def _max_in_window(times: list, window: float) -> int:
+    """מספר האירועים המרבי בכל חלון באורך window"""
+    best, start = 0, 0
+    for end, t in enumerate(times):
+        while times[start] < t - window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+def simulate(name: str, seed: int) -> dict:
+    """הרצת תרחיש אחד; מחזיר את התוצאות ואת זמן הריצה האמיתי"""
+    started = time.monotonic()
+    result = run_virtual(Simulation(SCENARIOS[name], seed).run())
+    result['scenario'] = name
+    result['seed'] = seed
+    result['wall_seconds'] = round(time.monotonic() - started, 2)
+    return result
+
+def check(results: dict, seed: int) -> list:
+    """בדיקות הרגרסיה על התוצאות
+
+    Returns:
+        list: (שם התרחיש, שם הבדיקה, עבר?, פירוט)
+    """
+    checks = []
+
+    def expect(name, label, passed, detail):
+        checks.append((name, label, bool(passed), detail))
+
+    for name, result in results.items():
+        expect(name, "כל המשימות הסתיימו", result['unfinished'] == 0, f"לא הסתיימו: {result['unfinished']}")
+        expect(name, "התור התרוקן", not any(result['queue_leftovers'].values()), result['queue_leftovers'])
+        expect(name, "אין FloodWait", result['flood_waits'] == 0, f"FloodWait: {result['flood_waits']}")
+        expect(
+            name, "עריכות ההתקדמות בתוך התקציב",
+            result['progress_edits_max_per_minute']
+            <= result['progress_budget_per_minute'] + result['progress_budget_burst'],
+            f"שיא בדקה: {result['progress_edits_max_per_minute']}/{result['progress_budget_per_minute']}"
+        )
+        again = simulate(name, seed)
+        same = {k: v for k, v in again.items() if k != 'wall_seconds'} == \
+            {k: v for k, v in result.items() if k != 'wall_seconds'}
+        expect(name, "דטרמיניסטי (אותו seed - אותה תוצאה)", same, "")
+
+    steady = results.get('steady')
+    if steady:
+        expect(
+            'steady', "נתיב העדיפות: קבצים קטנים ממתינים פחות",
+            steady['wait_short']['p50'] <= steady['wait_regular']['p50'],
+            f"p50 קטנים {steady['wait_short']['p50']}s, רגילים {steady['wait_regular']['p50']}s"
+        )
+    burst = results.get('burst')
+    if burst:
+        expect(
+            'burst', "משתמש עם פרץ קבצים לא חוסם את האחרים",
+            burst['wait_light_users']['p95'] < burst['wait_heavy_users']['p50'],
+            f"p95 משתמשים רגילים {burst['wait_light_users']['p95']}s, "
+            f"p50 המשתמש הכבד {burst['wait_heavy_users']['p50']}s"
+        )
+    cancels = results.get('cancels')
+    if cancels:
+        expect('cancels', "היו ביטולים בתרחיש", cancels['cancelled'] > 0, f"בוטלו: {cancels['cancelled']}")
+    return checks
+
+def report(result: dict) -> None:
+    def fmt(distribution):
+        return (f"p50 {distribution['p50']}s, p95 {distribution['p95']}s, p99 {distribution['p99']}s, "
+                f"max {distribution['max']}s ({distribution['count']})")
+
+    print(f"== {result['scenario']} (seed {result['seed']}, "
+          f"{result['makespan']}s וירטואליות ב-{result['wall_seconds']}s אמיתיות)")
+    print(f"  משימות: {result['jobs']}, הושלמו {result['completed']}, בוטלו {result['cancelled']}")
+    print(f"  המתנה בתור: {fmt(result['wait'])}")
+    print(f"    קטנים: {fmt(result['wait_short'])}")
+    print(f"    רגילים: {fmt(result['wait_regular'])}")
+    if result['wait_heavy_users']['count']:
+        print(f"    משתמשים כבדים: {fmt(result['wait_heavy_users'])}")
+        print(f"    שאר המשתמשים: {fmt(result['wait_light_users'])}")
+    print(f"  הוגנות (Jain על ההאטה לכל משתמש): {result['fairness_jain']}")
+    print(f"  עריכות התקדמות: {result['progress_edits']}, שיא {result['progress_edits_max_per_minute']} בדקה "
+          f"(תקציב {result['progress_budget_per_minute']}), ניצול {result['progress_budget_used']}")
+    print(f"  בקשות: {result['requests']}, FloodWait: {result['flood_waits']}, "
+          f"המתנה במגביל: {result['rate_limiter_wait']}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="סימולציה של התור ומגביל הקצב על שעון וירטואלי")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                        help="תרחיש להרצה (אפשר כמה פעמים; ברירת מחדל: כולם)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="שמירת התוצאות כ-JSON")
+    parser.add_argument('--check', action='store_true', help="הרצת בדיקות הרגרסיה")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    names = args.scenario or list(SCENARIOS)
+    results = {name: simulate(name, args.seed) for name in names}
+    for result in results.values():
+        report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if args.check:
+        failed = 0
+        print()
+        for name, label, passed, detail in check(results, args.seed):
+            failed += not passed
+            print(f"{'✓' if passed else '✗'} [{name}] {label}" + (f" - {detail}" if detail and not passed else ""))
+        sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
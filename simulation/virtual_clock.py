@@ -0,0 +1,72 @@
+import asyncio
+import selectors
+
+class SimulationDeadlock(RuntimeError):
+    """אין אף טיימר ואף אירוע שיכול להעיר את הסימולציה"""
+
+class _InstantSelector(selectors.BaseSelector):
+    """selector שלא ממתין: במקום לישון עד הטיימר הבא, הוא מקדם את השעון אליו"""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self.loop = None
+
+    def register(self, fileobj, events, data=None):
+        return self._selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self._selector.modify(fileobj, events, data)
+
+    def get_map(self):
+        return self._selector.get_map()
+
+    def close(self):
+        self._selector.close()
+
+    def select(self, timeout=None):
+        ready = self._selector.select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            raise SimulationDeadlock("כל המשימות ממתינות ואין טיימר שיעיר אותן")
+        self.loop.advance(timeout)
+        return ready
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """לולאת asyncio על שעון וירטואלי
+
+    loop.time() מתחיל מ-0 ומתקדם רק כשכל המשימות ממתינות, ישר לטיימר הקרוב.
+    asyncio.sleep, wait_for ו-call_later עובדים כרגיל, כך שקוד אמיתי שמשתמש
+    בהם (התור, מגביל הקצב, שירות ההתקדמות) רץ בלי שינוי - שעות של תעבורה
+    עוברות בשניות, ובאותו סדר בדיוק בכל ריצה.
+    """
+
+    def __init__(self):
+        selector = _InstantSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self._virtual_now = 0.0
+
+    def time(self) -> float:
+        return self._virtual_now
+
+    def advance(self, seconds: float) -> None:
+        self._virtual_now += seconds
+
+def run(coro):
+    """הרצת coroutine עד הסוף על שעון וירטואלי חדש"""
+    loop = VirtualClockLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        # משימות רקע (עובדים, לולאת ההתקדמות) שעדיין ממתינות
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        asyncio.set_event_loop(None)
+        loop.close()
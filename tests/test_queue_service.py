@@ -0,0 +1,110 @@
+"""בדיקות לתזמון ב-QueueService: ביטולים, מגבלת משימות למשתמש ומיקום בתור"""
+import os
+import sys
+import random
+import asyncio
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.settings דורש את משתני הבוט כבר בטעינה
+for name, value in {'API_ID': '1', 'API_HASH': 'test', 'BOT_TOKEN': 'test', 'TARGET_GROUP_ID': '-100'}.items():
+    os.environ.setdefault(name, value)
+
+from services.queue_service import MB, QueueService
+
+SHORT_MAX = 10 * MB
+
+def make_queue(max_jobs_per_user: int = 100) -> QueueService:
+    return QueueService(max_jobs_per_user=max_jobs_per_user, short_job_max_size=SHORT_MAX, short_lane_burst=3)
+
+def message(message_id: int, user_id: int, size: int = 20 * MB):
+    return SimpleNamespace(
+        id=message_id, chat_id=user_id, sender_id=user_id,
+        document=SimpleNamespace(id=message_id, size=size)
+    )
+
+def enqueue(queue: QueueService, *messages) -> None:
+    async def add_all():
+        for item in messages:
+            await queue.add_to_queue(item)
+    asyncio.run(add_all())
+
+def finish(queue: QueueService, message_id: int, user_id: int) -> None:
+    asyncio.run(queue.remove_from_queue(message_id, user_id))
+
+def pop_all(queue: QueueService) -> list:
+    """שליפת כל המשימות שאפשר להתחיל עכשיו, לפי הסדר"""
+    order = []
+    while (job := queue._pop_next_job()) is not None:
+        order.append(job.message_id)
+    return order
+
+def test_cancelling_head_promotes_the_users_next_job():
+    queue = make_queue()
+    enqueue(queue, message(1, 1), message(2, 1), message(3, 2))
+
+    finish(queue, 1, 1)
+
+    assert 1 not in queue.upload_queue
+    assert queue.get_message_position(3) == 1
+    assert queue.get_message_position(2) == 2
+    assert pop_all(queue) == [3, 2]
+
+def test_cancelling_middle_job_skips_it_without_moving_the_head():
+    queue = make_queue()
+    enqueue(queue, message(1, 1), message(2, 1), message(3, 1))
+
+    finish(queue, 2, 1)
+
+    assert queue.get_message_position(1) == 1
+    assert queue.get_message_position(3) == 2
+    assert pop_all(queue) == [1, 3]
+    assert not queue.upload_queue
+
+def test_cancel_user_downloads_drops_all_waiting_jobs_of_the_user():
+    queue = make_queue()
+    enqueue(queue, message(1, 1), message(2, 2), message(3, 1, size=MB))
+
+    cancelled = asyncio.run(queue.cancel_user_downloads(1))
+
+    assert sorted(job.message_id for job in cancelled) == [1, 3]
+    assert pop_all(queue) == [2]
+
+def test_max_jobs_per_user_holds_back_the_users_next_job():
+    queue = make_queue(max_jobs_per_user=1)
+    enqueue(queue, message(1, 1), message(2, 1), message(3, 2))
+
+    # למשתמש 1 כבר יש משימה בעיבוד, ולכן משתמש 2 עוקף אותו
+    assert pop_all(queue) == [1, 3]
+    assert 2 in queue.upload_queue
+
+    finish(queue, 1, 1)
+
+    assert pop_all(queue) == [2]
+
+def test_can_start_refusal_keeps_the_head_in_place():
+    queue = make_queue()
+    enqueue(queue, message(1, 1), message(2, 2))
+
+    assert queue._pop_next_job(can_start=lambda record: False) is None
+    # גם משימה שהייתה מתקבלת לא עוקפת את הראש שנדחה
+    assert queue._pop_next_job(can_start=lambda record: record.message_id != 1) is None
+    assert set(queue.upload_queue) == {1, 2}
+    assert queue.get_message_position(1) == 1
+
+    assert pop_all(queue) == [1, 2]
+
+def test_message_position_matches_pop_order():
+    rng = random.Random(7)
+    queue = make_queue()
+    messages = [
+        message(message_id, rng.randint(1, 5), rng.choice([MB, 5 * MB, 40 * MB, 300 * MB]))
+        for message_id in range(1, 41)
+    ]
+    enqueue(queue, *messages)
+
+    positions = {item.id: queue.get_message_position(item.id) for item in messages}
+
+    assert sorted(positions.values()) == list(range(1, len(messages) + 1))
+    assert pop_all(queue) == sorted(positions, key=positions.get)
@@ -0,0 +1,108 @@
+"""בדיקות ל-RateLimiter על שעון וירטואלי (simulation/virtual_clock)
+
+הזמנים בבדיקות הם זמני הלולאה, כך שהמתנות של עשרות שניות רצות מיד.
+דורש telethon (בשביל FloodWaitError).
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telethon.errors import FloodWaitError
+from utils.rate_limiter import RateLimiter
+from simulation.virtual_clock import run
+
+PEER = 1001
+OTHER_PEER = 1002
+
+def now() -> float:
+    return asyncio.get_event_loop().time()
+
+class FakeRequest:
+    """בקשה לטלגרם שנכשלת ב-FloodWait בקריאות הראשונות"""
+
+    def __init__(self, flood_waits: int = 0, seconds: int = 5):
+        self.flood_waits = flood_waits
+        self.seconds = seconds
+        self.calls = []
+
+    async def __call__(self):
+        self.calls.append(now())
+        if len(self.calls) <= self.flood_waits:
+            raise FloodWaitError(None, capture=self.seconds)
+        return len(self.calls)
+
+def test_burst_then_throttle():
+    limiter = RateLimiter(messages_per_minute=60, burst=3)
+    request = FakeRequest()
+
+    async def scenario():
+        for _ in range(7):
+            await limiter.call(PEER, 'send', request)
+
+    run(scenario())
+
+    # הדלי מתחיל מלא: burst בקשות ועוד אחת מיד, ואחריהן אחת בשנייה
+    assert request.calls == [0, 0, 0, 0, 1, 2, 3]
+
+def test_flood_wait_on_one_peer_does_not_block_another():
+    limiter = RateLimiter(messages_per_minute=60, burst=3)
+    flooded = FakeRequest(flood_waits=1, seconds=30)
+    other = FakeRequest()
+
+    async def scenario():
+        await asyncio.gather(
+            limiter.call(PEER, 'send', flooded),
+            limiter.call(OTHER_PEER, 'send', other),
+        )
+
+    run(scenario())
+
+    assert other.calls == [0]
+    assert flooded.calls == [0, 30]
+    assert limiter.flood_waits == 1
+
+def test_rate_drops_after_flood_wait_and_recovers():
+    limiter = RateLimiter(messages_per_minute=60, burst=3)
+    request = FakeRequest(flood_waits=1, seconds=5)
+    rates = []
+
+    async def scenario():
+        await limiter.call(PEER, 'send', request)
+        bucket = limiter._buckets[PEER]
+        rates.append(bucket.rate)
+        for _ in range(10):
+            await limiter.call(PEER, 'send', request)
+        rates.append(bucket.rate)
+
+    run(scenario())
+
+    base_rate = 1.0  # 60 בדקה
+    # אחרי ה-FloodWait הקצב יורד לחצי, והניסיון החוזר שהצליח כבר מעלה אותו מעט
+    assert rates[0] == pytest.approx(base_rate / 2 + base_rate / 20)
+    assert rates[1] == pytest.approx(base_rate)
+    # בקצב המופחת המרווח בין בקשות (אחרי שה-burst נוצל) גדול משנייה
+    gaps = [later - earlier for earlier, later in zip(request.calls[1:], request.calls[2:])]
+    assert max(gaps) > 1.5
+
+def test_call_retries_flood_wait_only_once():
+    limiter = RateLimiter(messages_per_minute=60, burst=3)
+    request = FakeRequest(flood_waits=5, seconds=5)
+
+    with pytest.raises(FloodWaitError):
+        run(limiter.call(PEER, 'send', request))
+
+    assert len(request.calls) == 2
+
+def test_call_does_not_retry_long_flood_wait():
+    limiter = RateLimiter(messages_per_minute=60, burst=3, max_flood_retry=60)
+    request = FakeRequest(flood_waits=1, seconds=600)
+
+    with pytest.raises(FloodWaitError):
+        run(limiter.call(PEER, 'send', request))
+
+    assert len(request.calls) == 1
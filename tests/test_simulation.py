@@ -0,0 +1,24 @@
+"""בדיקות הרגרסיה של הסימולציה (כמו simulation/simulate.py --check)
+
+כל תרחיש רץ על שעון וירטואלי עם seed קבוע, דרך QueueService, RateLimiter
+ו-ProgressService האמיתיים. דורש telethon (בשביל FloodWaitError).
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from simulation.simulate import SCENARIOS, check, simulate
+
+SEED = 1
+
+@pytest.mark.parametrize('name', sorted(SCENARIOS))
+def test_scenario_passes_regression_checks(name):
+    results = {name: simulate(name, SEED)}
+
+    failures = [(label, detail) for _, label, passed, detail in check(results, SEED) if not passed]
+
+    assert failures == []
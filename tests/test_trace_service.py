@@ -0,0 +1,42 @@
+"""בדיקות לכתיבת צירי הזמן של TraceService"""
+import os
+import sys
+import json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.settings דורש את משתני הבוט כבר בטעינה
+for name, value in {'API_ID': '1', 'API_HASH': 'test', 'BOT_TOKEN': 'test', 'TARGET_GROUP_ID': '-100'}.items():
+    os.environ.setdefault(name, value)
+
+from services.trace_service import TraceService
+
+def read_lines(path) -> list:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+def test_each_instance_writes_to_its_own_file(tmp_path):
+    # התיקיות עוד לא קיימות - השירות יוצר אותן
+    first_path = tmp_path / 'first' / 'traces.jsonl'
+    second_path = tmp_path / 'second' / 'traces.jsonl'
+    first, second = TraceService(path=str(first_path)), TraceService(path=str(second_path))
+
+    for service, message_id in ((first, 1), (second, 2)):
+        trace = service.start((100, message_id), user_id=7)
+        trace.add_span('download', trace.started_at, trace.started_at + 2)
+        service.finish(trace, 'delivered')
+
+    assert [line['message_id'] for line in read_lines(first_path)] == [1]
+    assert [line['message_id'] for line in read_lines(second_path)] == [2]
+    assert read_lines(second_path)[0]['spans'][0]['duration'] == 2
+
+def test_file_rotates_at_max_bytes(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    service = TraceService(path=str(path), max_bytes=300, backups=1)
+
+    for message_id in range(10):
+        service.finish(service.start((100, message_id), user_id=7), 'delivered')
+
+    assert os.path.exists(str(path) + '.1')
+    assert not os.path.exists(str(path) + '.2')
+    assert os.path.getsize(path) <= 300
@@ -0,0 +1,151 @@
+"""בדיקות ל-TransferService: פתיחת החיבורים המקבילים והמשך הורדה מנקודת ההמשך
+
+דורש telethon; החיבורים ללקוח ול-MTProto מוחלפים באובייקטים מדומים.
+"""
+import os
+import sys
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.settings דורש את משתני הבוט כבר בטעינה
+for name, value in {'API_ID': '1', 'API_HASH': 'test', 'BOT_TOKEN': 'test', 'TARGET_GROUP_ID': '-100'}.items():
+    os.environ.setdefault(name, value)
+
+from services import transfer_service
+from services.transfer_service import CHECKPOINT_SUFFIX, TransferService
+
+PART_SIZE = 4096
+
+class FakeSender:
+    """MTProtoSender מדומה; connect נכשל למי שנוצר אחרי fail_from חיבורים"""
+
+    created = []
+    fail_from = None
+
+    def __init__(self, auth_key, loggers=None):
+        self.auth_key = auth_key
+        self.connected = False
+        self.index = len(FakeSender.created)
+        FakeSender.created.append(self)
+
+    async def connect(self, connection):
+        if FakeSender.fail_from is not None and self.index >= FakeSender.fail_from:
+            raise ConnectionError(f"חיבור {self.index} נכשל")
+        self.connected = True
+
+    async def send(self, request):
+        pass
+
+    async def disconnect(self):
+        self.connected = False
+
+class FakeClient:
+    def __init__(self, export_error=None, content: bytes = b''):
+        self.session = SimpleNamespace(dc_id=2, auth_key=b'home-key')
+        self._log = None
+        self._proxy = None
+        self._init_request = SimpleNamespace(query=None)
+        self.export_error = export_error
+        self.content = content  # תוכן הקובץ "בשרת"
+        self.fetched = []  # היסטים שהתבקשו בהורדה
+
+    async def _get_dc(self, dc_id):
+        return SimpleNamespace(ip_address='127.0.0.1', port=443, id=dc_id)
+
+    def _connection(self, *args, **kwargs):
+        return None
+
+    async def _call(self, sender, request):
+        self.fetched.append(request.offset)
+        return SimpleNamespace(bytes=self.content[request.offset:request.offset + request.limit])
+
+    async def iter_download(self, media, offset=0, request_size=None, file_size=None):
+        for start in range(offset, len(self.content), request_size):
+            self.fetched.append(start)
+            yield self.content[start:start + request_size]
+
+    async def __call__(self, request):
+        if self.export_error:
+            raise self.export_error
+        return SimpleNamespace(id=1, bytes=b'auth')
+
+@pytest.fixture(autouse=True)
+def fake_sender(monkeypatch):
+    FakeSender.created = []
+    FakeSender.fail_from = None
+    monkeypatch.setattr(transfer_service, 'MTProtoSender', FakeSender)
+    return FakeSender
+
+def test_upload_disconnects_senders_when_second_sender_fails(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'\0' * (300 * 1024))  # כמה חלקים, כדי שייפתחו שני חיבורים
+    FakeSender.fail_from = 1
+    service = TransferService(FakeClient(), connections=2)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(service._upload_parallel(str(path)))
+
+    assert len(FakeSender.created) == 2
+    assert not FakeSender.created[0].connected
+
+def test_create_sender_disconnects_when_auth_import_fails():
+    service = TransferService(FakeClient(export_error=ConnectionError("ייצוא ההרשאה נכשל")))
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(service._create_sender(4))  # DC אחר - בלי מפתח הרשאה
+
+    assert len(FakeSender.created) == 1
+    assert not FakeSender.created[0].connected
+    assert 4 not in service._auth_keys
+
+def video_message(content: bytes):
+    document = SimpleNamespace(id=77, size=len(content))
+    return SimpleNamespace(file=SimpleNamespace(size=len(content)), media=SimpleNamespace(document=document),
+                           document=document)
+
+def write_partial_download(path, content: bytes, done: set) -> None:
+    """קובץ חלקי (רק החלקים ב-done נכתבו) ונקודת ההמשך שלו, כמו אחרי הורדה שנקטעה"""
+    with open(path, 'wb') as file:
+        file.truncate(len(content))
+        for part in done:
+            file.seek(part * PART_SIZE)
+            file.write(content[part * PART_SIZE:(part + 1) * PART_SIZE])
+    identity = {'document_id': 77, 'size': len(content), 'part_size': PART_SIZE}
+    with open(str(path) + CHECKPOINT_SUFFIX, 'w', encoding='utf-8') as file:
+        file.write(json.dumps(identity) + '\n')
+        file.writelines(f"{part}\n" for part in sorted(done))
+
+def test_parallel_download_resumes_only_missing_parts(tmp_path, monkeypatch):
+    content = os.urandom(PART_SIZE * 5 + 100)  # שישה חלקים, האחרון חלקי
+    path = tmp_path / 'video.mkv'
+    write_partial_download(path, content, {0, 2, 5})
+    monkeypatch.setattr(transfer_service, 'PARALLEL_TRANSFER_MIN_SIZE', 0)
+    monkeypatch.setattr(transfer_service.utils, 'get_input_location', lambda media: (2, 'location'))
+    client = FakeClient(content=content)
+    service = TransferService(client, connections=2, part_size=PART_SIZE)
+
+    asyncio.run(service.download(video_message(content), str(path)))
+
+    assert sorted(client.fetched) == [PART_SIZE * part for part in (1, 3, 4)]
+    assert path.read_bytes() == content
+    assert not os.path.exists(str(path) + CHECKPOINT_SUFFIX)
+    assert not any(sender.connected for sender in FakeSender.created)
+
+def test_sequential_download_resumes_after_first_contiguous_parts(tmp_path):
+    content = os.urandom(PART_SIZE * 5 + 100)
+    path = tmp_path / 'video.mkv'
+    write_partial_download(path, content, {0, 1, 3})
+    client = FakeClient(content=content)
+    service = TransferService(client, connections=1, part_size=PART_SIZE)
+
+    asyncio.run(service.download(video_message(content), str(path)))
+
+    # ממשיכים מהחלק הראשון שחסר; חלק 3 מורד שוב כי ההורדה הרציפה לא מדלגת עליו
+    assert client.fetched == [PART_SIZE * part for part in range(2, 6)]
+    assert path.read_bytes() == content
+    assert not os.path.exists(str(path) + CHECKPOINT_SUFFIX)
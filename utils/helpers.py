@@ -1,7 +1,5 @@
 import re
 import os
-import asyncio
-import logging
 from config.settings import VIDEO_FORMATS
 
 def clean_filename(filename: str) -> str:
@@ -41,7 +39,17 @@ def get_video_caption(file_path: str) -> str:
     
     return caption
 
-def get_file_name(message):
+def format_duration(seconds: float) -> str:
+    """הצגת משך זמן בשניות בפורמט קריא (למשל 1h05m או 3m20s)"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+def get_file_name(message, default="video.mp4"):
     """קבלת שם הקובץ המקורי מהודעת טלגרם
     
     דוגמה:
@@ -49,30 +57,24 @@ def get_file_name(message):
     - הפונקציה תחזיר: "funny_cat_2024.mp4"
     
     אם נשלח קובץ בלי שם:
-    - הפונקציה תחזיר: "video.mp4"
+    - הפונקציה תחזיר: "video.mp4" (או את default שהועבר)
     """
     if message.media and hasattr(message.media, 'document'):
         for attr in message.media.document.attributes:
             if hasattr(attr, 'file_name'):
                 return attr.file_name
-    return "video.mp4"
+    return default
 
-async def wait_for_file_release(file_path: str) -> None:
-    """המתנה עד שהקובץ משתחרר מתהליכים אחרים"""
-    while True:
-        try:
-            os.rename(file_path, file_path)
-            break
-        except OSError:
-            await asyncio.sleep(2)
+def get_document_identity(message) -> tuple:
+    """קבלת הזהות היציבה של המסמך בהודעה
 
-async def wait_and_delete(file_path: str) -> None:
-    """המתנה ומחיקת קובץ עם ניסיונות חוזרים"""
-    while True:
-        try:
-            os.remove(file_path)
-            logging.info(f"הקובץ {file_path} נמחק בהצלחה.")
-            return
-        except OSError:
-            logging.warning(f"נכשל במחיקת {file_path}. מנסה שוב בעוד 2 שניות...")
-            await asyncio.sleep(2)
+    מזהה המסמך נשמר גם כשההודעה מועברת הלאה או נשלחת בשם אחר, ולכן הוא
+    מזהה את התוכן טוב יותר משם הקובץ.
+
+    Returns:
+        tuple: (document_id, size), או (None, None) אם אין מסמך בהודעה
+    """
+    document = getattr(message, 'document', None)
+    if document is None:
+        return None, None
+    return document.id, document.size
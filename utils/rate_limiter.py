@@ -1,98 +1,223 @@
 import asyncio
-import time
 import logging
-from typing import List
+from collections import OrderedDict
+from typing import Optional
+from telethon.errors import FloodWaitError, SlowModeWaitError
+
+logger = logging.getLogger(__name__)
+
+class _Bucket:
+    """דלי אסימונים של יעד אחד, בצורת GCRA: מספיק לשמור זמן הגעה תיאורטי אחד"""
+
+    __slots__ = ('base_rate', 'rate', 'burst', 'tat')
+
+    def __init__(self, per_minute: float, burst: int):
+        self.base_rate = per_minute / 60.0
+        self.rate = self.base_rate
+        self.burst = burst
+        self.tat = 0.0  # הזמן שבו הדלי חוזר להיות מלא
+
+    def reserve(self, now: float) -> float:
+        """שמירת מקום לבקשה אחת
+
+        Returns:
+            float: הזמן שבו מותר לשלוח את הבקשה
+        """
+        interval = 1.0 / self.rate
+        start = max(now, self.tat - self.burst * interval)
+        self.tat = max(self.tat, now) + interval
+        return start
+
+    def delay(self, now: float) -> float:
+        """כמה זמן תמתין בקשה שתגיע עכשיו (בלי לשמור מקום)"""
+        return max(0.0, self.tat - self.burst / self.rate - now)
+
+    def idle(self, now: float) -> bool:
+        return self.tat <= now and self.rate == self.base_rate
+
+
+class _Slot:
+    """הקשר של בקשה אחת דרך המגביל"""
+
+    __slots__ = ('limiter', 'peer', 'method')
+
+    def __init__(self, limiter, peer, method):
+        self.limiter = limiter
+        self.peer = peer
+        self.method = method
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.peer, self.method)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if isinstance(exc_val, (FloodWaitError, SlowModeWaitError)):
+            self.limiter.record_flood_wait(self.peer, self.method, exc_val.seconds)
+        elif exc_type is None:
+            self.limiter.record_success(self.peer)
 
 
 class RateLimiter:
-    """מנהל השהיות להודעות טלגרם
-    
+    """מגביל קצב להודעות טלגרם, לפי צ'אט ולפי סוג פעולה
+
     מגבלות טלגרם:
     - צ'אט פרטי: הודעה 1 בשנייה (60 בדקה)
     - קבוצה: 20 הודעות בדקה
     - שידור המוני: 30 הודעות בשנייה (עם תשלום)
-    
+
+    לכל צ'אט יש דלי אסימונים משלו, כך שצ'אטים שונים לא ממתינים זה לזה.
+    שמירת מקום היא O(1) ולא מחזיקה נעילה בזמן ההמתנה. כשטלגרם מחזיר
+    FloodWait, הצ'אט ומחלקת הפעולה חסומים למשך הזמן שהתבקש, והקצב של אותו
+    צ'אט יורד לחצי ועולה בחזרה בהדרגה עם כל בקשה שמצליחה.
+
     דוגמאות לשימוש:
     ```python
-    # יצירת מגביל לצ'אט פרטי
-    private_limiter = RateLimiter(messages_per_minute=60, limiter_type="private")
-    
-    # שימוש במגביל
-    async with private_limiter:
+    limiter = RateLimiter(messages_per_minute=60, group_messages_per_minute=20)
+
+    # שימוש במגביל עבור צ'אט מסוים
+    async with limiter.limit(message.chat_id, 'edit'):
         await message.edit("עדכון סטטוס")
-    
-    # יצירת מגביל לקבוצה
-    group_limiter = RateLimiter(messages_per_minute=20, limiter_type="group")
-    
-    # שימוש במגביל
-    async with group_limiter:
-        await bot.send_message(group_id, "הודעה לקבוצה")
+
+    # קריאה עם ניסיון חוזר אחרי FloodWait קצר
+    await limiter.call(group_id, 'send', bot.send_message, group_id, "הודעה לקבוצה")
+
+    # מגביל כללי אחד, בלי חלוקה לצ'אטים
+    async with limiter:
+        await bot.send_message(chat_id, "הודעה")
     ```
     """
-    
-    def __init__(self, messages_per_minute: int, limiter_type: str = "private"):
+
+    def __init__(self, messages_per_minute: int, limiter_type: str = "private",
+                 group_messages_per_minute: Optional[int] = None, burst: int = 3,
+                 class_budgets: Optional[dict] = None, max_flood_retry: float = 60):
         """אתחול מגביל הקצב
-        
+
         Args:
-            messages_per_minute (int): כמות ההודעות המקסימלית בדקה
-            limiter_type (str): סוג המגביל ("private" או "group")
+            messages_per_minute (int): הודעות בדקה לכל צ'אט פרטי
+            limiter_type (str): שם המגביל (ללוגים)
+            group_messages_per_minute (int): הודעות בדקה לכל קבוצה/ערוץ (מזהה שלילי)
+            burst (int): כמה בקשות אפשר לשלוח ברצף לפני שהקצב נאכף
+            class_budgets (dict): תקציב כללי בדקה למחלקות פעולה מסוימות, בנוסף
+                למגבלה של הצ'אט (למשל {'progress': 30})
+            max_flood_retry (float): FloodWait עד כמה שניות call() ממתין ומנסה שוב
         """
         self.messages_per_minute = messages_per_minute
-        self.min_interval = 60.0 / messages_per_minute
+        self.group_messages_per_minute = group_messages_per_minute or messages_per_minute
         self.limiter_type = limiter_type
-        self.lock = asyncio.Lock()
-        self.message_times: List[float] = []
-        
-        logging.info(
+        self.burst = burst
+        self.max_flood_retry = max_flood_retry
+        self._buckets = OrderedDict()  # לפי צ'אט, מהשימוש הישן לחדש
+        self._class_buckets = {
+            method: _Bucket(per_minute, burst) for method, per_minute in (class_budgets or {}).items()
+        }
+        self._blocked_until = {}  # (צ'אט, מחלקה) -> זמן סיום ההמתנה שטלגרם ביקש
+        self.flood_waits = 0
+        self.total_wait = 0.0  # סך הזמן שבקשות המתינו במגביל
+
+        logger.info(
             f"נוצר מגביל קצב חדש: "
             f"סוג={limiter_type}, "
-            f"הודעות בדקה={messages_per_minute}, "
-            f"אינטרוול מינימלי={self.min_interval:.2f} שניות"
+            f"הודעות בדקה לצ'אט={messages_per_minute}, "
+            f"לקבוצה={self.group_messages_per_minute}, "
+            f"תקציבים={class_budgets or {}}"
+        )
+
+    @staticmethod
+    def _now() -> float:
+        return asyncio.get_event_loop().time()
+
+    def _bucket(self, peer, now: float) -> _Bucket:
+        """הדלי של הצ'אט, כולל פינוי של דליים שלא היו בשימוש"""
+        bucket = self._buckets.get(peer)
+        if bucket is None:
+            is_group = isinstance(peer, int) and peer < 0
+            per_minute = self.group_messages_per_minute if is_group else self.messages_per_minute
+            bucket = self._buckets[peer] = _Bucket(per_minute, self.burst)
+        else:
+            self._buckets.move_to_end(peer)
+
+        # הישנים ביותר בהתחלה; דלי מלא שלא נחסם זהה לדלי חדש ואפשר לשכוח אותו
+        while len(self._buckets) > 1:
+            oldest_peer, oldest = next(iter(self._buckets.items()))
+            if oldest_peer == peer or not oldest.idle(now):
+                break
+            del self._buckets[oldest_peer]
+        return bucket
+
+    def _blocked(self, peer, method: str, now: float) -> float:
+        until = self._blocked_until.get((peer, method))
+        if until is not None and until <= now:
+            del self._blocked_until[(peer, method)]
+            return now
+        return until or now
+
+    async def acquire(self, peer=None, method: str = 'send') -> None:
+        """המתנה עד שמותר לשלוח בקשה לצ'אט"""
+        now = self._now()
+        start = self._bucket(peer, now).reserve(now)
+        class_bucket = self._class_buckets.get(method)
+        if class_bucket:
+            start = max(start, class_bucket.reserve(now))
+
+        waited = 0.0
+        while True:
+            start = max(start, self._blocked(peer, method, now))
+            if start <= now:
+                break
+            logger.debug(f"[{self.limiter_type}] {peer}/{method} ממתין {start - now:.2f} שניות")
+            await asyncio.sleep(start - now)
+            waited += start - now
+            # ייתכן שבזמן ההמתנה התקבל FloodWait לאותו צ'אט
+            now = self._now()
+        self.total_wait += waited
+
+    def delay(self, peer=None, method: str = 'send') -> float:
+        """כמה שניות תמתין עכשיו בקשה לצ'אט, בלי לשמור מקום ובלי להמתין"""
+        now = self._now()
+        delays = [self._blocked_until.get((peer, method), now) - now]
+        if peer in self._buckets:
+            delays.append(self._buckets[peer].delay(now))
+        if method in self._class_buckets:
+            delays.append(self._class_buckets[method].delay(now))
+        return max(0.0, *delays)
+
+    def record_flood_wait(self, peer, method: str, seconds: float) -> None:
+        """רישום FloodWait: חסימת הצ'אט והמחלקה, והורדת הקצב של הצ'אט"""
+        now = self._now()
+        until = now + seconds
+        key = (peer, method)
+        self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), until)
+        bucket = self._bucket(peer, now)
+        bucket.rate = max(bucket.base_rate / 8, bucket.rate / 2)
+        self.flood_waits += 1
+        logger.warning(
+            f"[{self.limiter_type}] FloodWait של {seconds} שניות עבור {peer}/{method}, "
+            f"קצב חדש: {bucket.rate * 60:.1f} בדקה"
         )
-    
-    def _clean_old_messages(self, current_time: float) -> None:
-        """ניקוי הודעות ישנות (מעל דקה)"""
-        self.message_times = [t for t in self.message_times if current_time - t < 60]
-    
+
+    def record_success(self, peer) -> None:
+        """בקשה שהצליחה מחזירה בהדרגה את הקצב של הצ'אט לקצב הבסיסי"""
+        bucket = self._buckets.get(peer)
+        if bucket and bucket.rate < bucket.base_rate:
+            bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate / 20)
+
+    def limit(self, peer=None, method: str = 'send') -> _Slot:
+        """הקשר (async with) לבקשה אחת לצ'אט"""
+        return _Slot(self, peer, method)
+
+    async def call(self, peer, method: str, func, *args, **kwargs):
+        """הרצת בקשה דרך המגביל, עם ניסיון חוזר אחד אחרי FloodWait קצר"""
+        for attempt in range(2):
+            try:
+                async with self.limit(peer, method):
+                    return await func(*args, **kwargs)
+            except (FloodWaitError, SlowModeWaitError) as e:
+                if attempt or e.seconds > self.max_flood_retry:
+                    raise
+
     async def __aenter__(self):
-        """כניסה להקשר של המגביל"""
-        async with self.lock:
-            current_time = time.time()
-            
-            # ניקוי הודעות ישנות
-            self._clean_old_messages(current_time)
-            
-            # בדיקה אם הגענו למגבלת ההודעות בדקה
-            if len(self.message_times) >= self.messages_per_minute:
-                wait_time = self.message_times[0] + 60 - current_time
-                if wait_time > 0:
-                    logging.debug(
-                        f"[{self.limiter_type}] ממתין {wait_time:.2f} שניות "
-                        f"(הגענו למגבלת {self.messages_per_minute} הודעות בדקה)"
-                    )
-                    await asyncio.sleep(wait_time)
-                    current_time = time.time()
-                    self._clean_old_messages(current_time)
-            
-            # בדיקת אינטרוול מינימלי בין הודעות
-            if self.message_times:
-                elapsed = current_time - self.message_times[-1]
-                if elapsed < self.min_interval:
-                    wait_time = self.min_interval - elapsed
-                    logging.debug(
-                        f"[{self.limiter_type}] ממתין {wait_time:.2f} שניות "
-                        f"(אינטרוול מינימלי)"
-                    )
-                    await asyncio.sleep(wait_time)
-                    current_time = time.time()
-            
-            # הוספת זמן ההודעה הנוכחית
-            self.message_times.append(current_time)
-            logging.debug(
-                f"[{self.limiter_type}] נשלחה הודעה "
-                f"(סה״כ {len(self.message_times)} הודעות בדקה האחרונה)"
-            )
-    
+        """כניסה להקשר של המגביל (מגבלה כללית אחת)"""
+        await self.acquire(None, 'send')
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """יציאה מהקשר של המגביל"""
-        pass
+        await _Slot(self, None, 'send').__aexit__(exc_type, exc_val, exc_tb)
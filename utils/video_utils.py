@@ -1,7 +1,7 @@
 import os
 import logging
+import json
 import subprocess
-from moviepy.editor import VideoFileClip
 
 logger = logging.getLogger(__name__)
 
@@ -70,14 +70,22 @@ def create_thumbnail(input_file: str, output_file: str, time_offset: float = 1.0
 def get_video_info(file_path: str) -> dict:
     """קבלת מידע על קובץ הווידאו"""
     try:
-        with VideoFileClip(file_path) as clip:
-            info = {
-                'duration': int(clip.duration),
-                'width': int(clip.size[0]),
-                'height': int(clip.size[1]),
-                'fps': float(clip.fps),
-                'audio': clip.audio is not None
-            }
+        command = [
+            'ffprobe', '-v', 'error', '-print_format', 'json',
+            '-show_format', '-show_streams', file_path
+        ]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        data = json.loads(result.stdout)
+        streams = data.get('streams', [])
+        video = next(s for s in streams if s.get('codec_type') == 'video')
+        num, _, den = video.get('avg_frame_rate', '0/1').partition('/')
+        info = {
+            'duration': int(float(data.get('format', {}).get('duration', 0))),
+            'width': int(video['width']),
+            'height': int(video['height']),
+            'fps': float(num) / float(den) if float(den or 0) else 0.0,
+            'audio': any(s.get('codec_type') == 'audio' for s in streams)
+        }
         return info
     except Exception as e:
         logger.error(f"שגיאה בקבלת מידע על הווידאו: {e}")